@@ -0,0 +1,126 @@
+"""
+Measure Anki-related operations against a fake AnkiConnect server: how long the known
+data takes to refresh, how fast notes are batch imported, and how long the duplicate
+check before adding a card takes, for collections of several sizes.
+
+    python benchmarks/anki_sync.py
+    python benchmarks/anki_sync.py --notes 1000 10000 --import-notes 500 --lookups 100
+
+Refresh times are for the first refresh with nothing cached, a refresh with nothing
+changed, a refresh after 1% of the notes were edited, and the first refresh after a
+restart, which starts from the saved snapshot and note cache.
+Imports go through the same checks and batching as the batch importers, and are also
+timed with one note per request for comparison.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# Keep the application from touching the real user data
+os.environ.setdefault("VOCABSIEVE_DEBUG", "__benchmark")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loguru import logger  # noqa: E402
+from fake_anki_connect import MODEL, FakeAnkiConnect, FakeCollection  # noqa: E402
+from vocabsieve.anki_connect import get_client, request  # noqa: E402
+from vocabsieve.global_names import settings  # noqa: E402
+from vocabsieve.record import Record  # noqa: E402
+from vocabsieve.tools import addNotes, canAddNotesWithErrorDetail  # noqa: E402
+
+logger.disable("vocabsieve")
+
+
+def percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100)[int(p) - 1]
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def configure(server: FakeAnkiConnect, lang: str) -> None:
+    settings.setValue("anki_api", server.url)
+    settings.setValue("enable_anki", True)
+    settings.setValue("target_language", lang)
+    settings.setValue("note_type", MODEL)
+    settings.setValue("word_field", "Word")
+    settings.setValue("sentence_field", "Sentence")
+    settings.setValue("tracking/fieldmap", json.dumps({MODEL: ["Word", "Sentence"]}))
+    settings.setValue("tracking/anki_query_mature", "prop:ivl>=14")
+    settings.setValue("tracking/anki_query_young", "prop:ivl<14 is:review")
+
+
+def refresh(collection: FakeCollection) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        rec = Record(settings, tmp)
+        result = {"cold": timed(rec._refreshKnownData), "unchanged": timed(rec._refreshKnownData)}
+        collection.touch(list(collection.notes)[::100])
+        result["edited"] = timed(rec._refreshKnownData)
+        rec.pool.close()
+        rec = Record(settings, tmp)
+        result["restart"] = timed(rec._refreshKnownData)
+        rec.pool.close()
+        return result
+
+
+def import_rate(server: FakeAnkiConnect, n: int, chunk_size: int) -> float:
+    "Notes imported per second, like GenericImporter.to_anki"
+    notes = [server.collection.syntheticNote() for _ in range(n)]
+
+    def run():
+        errors = canAddNotesWithErrorDetail(server.url, notes)
+        addNotes(server.url, [note for note, error in zip(notes, errors) if error is None], chunk_size)
+    return n / timed(run)
+
+
+def duplicate_latency(server: FakeAnkiConnect, n: int) -> list[float]:
+    "Latency of the requests made by MainWindow.findDuplicates, for known and unknown words"
+    collection = server.collection
+    client = get_client(server.url)
+    latencies = []
+    for i in range(n):
+        note = collection.syntheticNote(collection.rng.choice(collection.words) if i % 2 else f"unknown{i}")
+        start = time.perf_counter()
+        client.multi([
+            request("modelFieldNames", modelName=MODEL),
+            request("findNotes", query=f"\"Word:{note['fields']['Word']}\""),
+            request("findNotes", query=f"\"Sentence:{note['fields']['Sentence']}\"")
+        ])
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="collection sizes")
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--import-notes", type=int, default=1000, help="notes added per import")
+    parser.add_argument("--chunk-size", type=int, default=100, help="notes per addNotes request")
+    parser.add_argument("--lookups", type=int, default=200, help="duplicate checks per collection")
+    args = parser.parse_args()
+
+    print(f"{'notes':>8}{'cold s':>9}{'same s':>9}{'1% s':>9}{'restart s':>11}"
+          f"{'import/s':>11}{'1/req /s':>11}{'dup p50 ms':>12}{'dup p99 ms':>12}")
+    for n_notes in args.notes:
+        collection = FakeCollection(n_notes)
+        with FakeAnkiConnect(collection) as server:
+            configure(server, args.lang)
+            times = refresh(collection)
+            batched = import_rate(server, args.import_notes, args.chunk_size)
+            single = import_rate(server, args.import_notes, 1)
+            latencies = duplicate_latency(server, args.lookups)
+        print(f"{n_notes:>8}{times['cold']:>9.2f}{times['unchanged']:>9.2f}{times['edited']:>9.2f}"
+              f"{times['restart']:>11.2f}{batched:>11.0f}{single:>11.0f}"
+              f"{percentile(latencies, 50) * 1000:>12.1f}{percentile(latencies, 99) * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compare dictionary database size, import time and lookup latency
+with and without definition compression.
+
+    python benchmarks/dict_compression.py
+    python benchmarks/dict_compression.py --path dict.mdx --type mdx --lang en
+
+Without --path, a synthetic dictionary of --entries HTML definitions is used.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+# Keep the application from touching the real user data
+os.environ.setdefault("VOCABSIEVE_DEBUG", "__benchmark")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from loguru import logger  # noqa: E402
+from vocabsieve.local_dictionary import LocalDictionary  # noqa: E402
+
+logger.disable("vocabsieve")
+
+WORDS = ("the of a to be used in sense meaning figurative noun verb adjective adverb plural "
+         "feminine masculine singular colloquial obsolete archaic especially something someone").split()
+
+
+def synthetic_entries(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(n):
+        senses = "".join(f"<li>{' '.join(rng.choices(WORDS, k=rng.randint(4, 16)))}</li>"
+                         for _ in range(rng.randint(1, 5)))
+        yield (f"word{i}",
+               f'<div class="entry"><b>word{i}</b> <i>{rng.choice(WORDS[10:14])}</i><ol>{senses}</ol></div>')
+
+
+def percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100)[int(p) - 1]
+
+
+def run(args, compress: bool) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = LocalDictionary(tmp, compress=compress)
+        start = time.perf_counter()
+        if args.path:
+            n_rows = db.dictimport(args.path, args.type, args.lang, "bench")
+        else:
+            n_rows = db.importdict(synthetic_entries(args.entries), args.lang, "bench")
+        import_time = time.perf_counter() - start
+
+        words = [word for word, _ in db.getAllWords(args.lang, "bench")]
+        rng = random.Random(1)
+        sample = [rng.choice(words) for _ in range(args.lookups)]
+        latencies = []
+        for word in sample:
+            start = time.perf_counter()
+            db.define(word, args.lang, "bench")
+            latencies.append(time.perf_counter() - start)
+        result = {
+            "rows": n_rows,
+            "size": db.databaseSize(),
+            "import": import_time,
+            "p50": percentile(latencies, 50),
+            "p99": percentile(latencies, 99),
+        }
+        db.pool.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", help="dictionary file to import instead of synthetic data")
+    parser.add_argument("--type", default="stardict", help="dictionary type, as in dictformats")
+    parser.add_argument("--lang", default="en")
+    parser.add_argument("--entries", type=int, default=100000, help="number of synthetic entries")
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+
+    print(f"{'compression':<12}{'rows':>10}{'size MiB':>10}{'import s':>10}{'p50 us':>10}{'p99 us':>10}")
+    for compress in (False, True):
+        r = run(args, compress)
+        print(f"{'on' if compress else 'off':<12}{r['rows']:>10}{r['size'] / 2**20:>10.1f}{r['import']:>10.2f}"
+              f"{r['p50'] * 1e6:>10.1f}{r['p99'] * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+A fake AnkiConnect server over a synthetic collection, for testing and benchmarking
+everything that talks to Anki without a running Anki.
+
+    python benchmarks/fake_anki_connect.py
+    python benchmarks/fake_anki_connect.py --notes 100000 --port 8765
+
+Every note has the fields of the vocabsieve-notes note type and one card. Supported
+actions: version, findNotes, findCards, notesInfo, notesModTime, addNote, addNotes,
+updateNoteFields, deleteNotes, canAddNotes, canAddNotesWithErrorDetail, modelFieldNames,
+modelNames, answerCards and multi. Queries are terms that must all match, out of prop:ivl<op>N, is:new, is:review,
+-is:new, nid:1,2,3, deck:*, note:*, "Field:value" (with \\ escapes) and *.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Iterable, Optional
+
+from vocabsieve.vsnt import FIELDS
+
+MODEL = "vocabsieve-notes"
+NOTE_ID_BASE = 1_600_000_000_000
+CARD_ID_BASE = 1_700_000_000_000
+TERM_RE = re.compile(r'-?"(?:[^"\\]|\\.)*"|\S+')
+ESCAPE_RE = re.compile(r"\\(.)")
+IVL_RE = re.compile(r"prop:ivl(>=|<=|!=|>|<|=)(\d+)$")
+COMPARISONS: dict[str, Callable[[int, int], bool]] = {
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+    "!=": lambda a, b: a != b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+    "=": lambda a, b: a == b,
+}
+
+
+def synthetic_words(n: int, seed: int = 0) -> list[str]:
+    "Distinct made-up alphabetic words"
+    rng = random.Random(seed)
+    onsets = "b c d f g h k l m n p r s t v w z br st tr pl gr sk".split()
+    vowels = "a e i o u ai ou".split()
+    words: set[str] = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(onsets) + rng.choice(vowels) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+class ActionError(Exception):
+    "Error returned in the response instead of a result"
+
+
+class FakeCollection():
+    """
+    Notes, each with one card, indexed for the lookups the actions need
+    All methods are safe to call from several threads
+    """
+
+    def __init__(self, n_notes: int, vocabulary: int = 20000, seed: int = 0) -> None:
+        self.lock = threading.Lock()
+        self.notes: dict[int, dict] = {}
+        self.ivl: dict[int, int] = {}  # Interval of the card of each note, 0 for new cards
+        self._by_field: dict[tuple[str, str], set[int]] = {}
+        self._next_id = NOTE_ID_BASE
+        self.rng = random.Random(seed)
+        self.words = synthetic_words(vocabulary, seed)
+        for _ in range(n_notes):
+            self._add(self.syntheticNote())
+            self.ivl[self._next_id - 1] = self.rng.choice((0, self.rng.randint(1, 13), self.rng.randint(14, 400)))
+
+    def syntheticNote(self, word: Optional[str] = None) -> dict:
+        "A note as accepted by addNote, with a sentence around the word"
+        word = word or self.rng.choice(self.words)
+        sentence = self.rng.choices(self.words, k=self.rng.randint(5, 12))
+        sentence.insert(self.rng.randrange(len(sentence)), f"<b>{word}</b>")
+        fields = dict.fromkeys(FIELDS, "")
+        fields.update(Word=word, Sentence=" ".join(sentence).capitalize() + ".",
+                      Definition=" ".join(self.rng.choices(self.words, k=4)))
+        return {"deckName": "Default", "modelName": MODEL, "fields": fields, "tags": ["vocabsieve"]}
+
+    def _add(self, note: dict) -> int:
+        note_id = self._next_id
+        self._next_id += 1
+        fields = {name: note["fields"].get(name, "") for name in FIELDS}
+        self.notes[note_id] = {"fields": fields, "tags": list(note.get("tags", [])),
+                               "mod": int(time.time())}
+        self.ivl[note_id] = 0
+        for name, value in fields.items():
+            self._by_field.setdefault((name.lower(), value.lower()), set()).add(note_id)
+        return note_id
+
+    def _cannotAdd(self, note: dict) -> Optional[str]:
+        if note.get("modelName") != MODEL:
+            return f"model was not found: {note.get('modelName')}"
+        first = note.get("fields", {}).get(FIELDS[0], "")
+        if not first.strip():
+            return "cannot create note because it is empty"
+        if (note.get("options") or {}).get("allowDuplicate"):
+            return None
+        if self._by_field.get((FIELDS[0].lower(), first.lower())):
+            return "cannot create note because it is a duplicate"
+        return None
+
+    def _matches(self, term: str) -> tuple[Callable[[int], bool], Optional[set[int]]]:
+        "Test of a search term, and the notes it can match if that is known without a scan"
+        negate = term.startswith("-")
+        term = term.lstrip("-")
+        if term.startswith('"'):
+            term = ESCAPE_RE.sub(r"\1", term[1:-1])
+        match: Callable[[int], bool]
+        candidates = None
+        if term == "*" or term.startswith(("deck:", "note:")):
+            match = lambda note_id: True  # noqa: E731
+        elif term == "is:new":
+            match = lambda note_id: self.ivl[note_id] == 0  # noqa: E731
+        elif term == "is:review":
+            match = lambda note_id: self.ivl[note_id] > 0  # noqa: E731
+        elif m := IVL_RE.match(term):
+            compare, days = COMPARISONS[m.group(1)], int(m.group(2))
+            match = lambda note_id: self.ivl[note_id] > 0 and compare(self.ivl[note_id], days)  # noqa: E731
+        elif term.startswith("nid:"):
+            candidates = {int(note_id) for note_id in term[4:].split(",")}
+            match = candidates.__contains__
+        elif ":" in term:
+            name, value = term.split(":", 1)
+            candidates = self._by_field.get((name.lower(), value.lower()), set())
+            match = candidates.__contains__
+        else:
+            raise ActionError(f"unsupported search term: {term}")
+        if negate:
+            return (lambda note_id: not match(note_id)), None
+        return match, candidates
+
+    def findNotes(self, query: str) -> list[int]:
+        with self.lock:
+            tests = [self._matches(term) for term in TERM_RE.findall(query)]
+            notes: Iterable[int] = self.notes
+            for _, candidates in tests:
+                if candidates is not None:
+                    notes = sorted(note_id for note_id in candidates if note_id in self.notes)
+                    break
+            return [note_id for note_id in notes if all(match(note_id) for match, _ in tests)]
+
+    def findCards(self, query: str) -> list[int]:
+        return [note_id - NOTE_ID_BASE + CARD_ID_BASE for note_id in self.findNotes(query)]
+
+    def notesInfo(self, notes: list[int]) -> list[dict]:
+        with self.lock:
+            return [{
+                "noteId": note_id,
+                "modelName": MODEL,
+                "tags": note["tags"],
+                "fields": {name: {"value": value, "order": order}
+                           for order, (name, value) in enumerate(note["fields"].items())},
+                "cards": [note_id - NOTE_ID_BASE + CARD_ID_BASE],
+                "mod": note["mod"],
+            } if (note := self.notes.get(note_id)) else {} for note_id in notes]
+
+    def notesModTime(self, notes: list[int]) -> list[dict]:
+        with self.lock:
+            return [{"noteId": note_id, "mod": self.notes[note_id]["mod"]}
+                    for note_id in notes if note_id in self.notes]
+
+    def addNote(self, note: dict) -> int:
+        with self.lock:
+            if error := self._cannotAdd(note):
+                raise ActionError(error)
+            return self._add(note)
+
+    def addNotes(self, notes: list[dict]) -> list[int]:
+        """Adds the notes that can be added one after the other, and like recent versions of
+        AnkiConnect fails the whole request if any of them cannot"""
+        with self.lock:
+            errors = []
+            note_ids = []
+            for note in notes:
+                if error := self._cannotAdd(note):
+                    errors.append(error)
+                else:
+                    note_ids.append(self._add(note))
+            if errors:
+                raise ActionError(str(errors))
+            return note_ids
+
+    def _unindex(self, note_id: int) -> None:
+        for name, value in self.notes[note_id]["fields"].items():
+            self._by_field[(name.lower(), value.lower())].discard(note_id)
+
+    def updateNoteFields(self, note: dict) -> None:
+        with self.lock:
+            if note["id"] not in self.notes:
+                raise ActionError(f"Note was not found: {note['id']}")
+            self._unindex(note["id"])
+            fields = self.notes[note["id"]]["fields"]
+            fields.update((name, value) for name, value in note["fields"].items() if name in fields)
+            for name, value in fields.items():
+                self._by_field.setdefault((name.lower(), value.lower()), set()).add(note["id"])
+            self.notes[note["id"]]["mod"] += 1
+
+    def deleteNotes(self, notes: list[int]) -> None:
+        with self.lock:
+            for note_id in notes:
+                if note_id in self.notes:
+                    self._unindex(note_id)
+                    del self.notes[note_id]
+                    del self.ivl[note_id]
+
+    def canAddNotes(self, notes: list[dict]) -> list[bool]:
+        with self.lock:
+            return [self._cannotAdd(note) is None for note in notes]
+
+    def canAddNotesWithErrorDetail(self, notes: list[dict]) -> list[dict]:
+        with self.lock:
+            errors = [self._cannotAdd(note) for note in notes]
+        return [{"canAdd": True} if error is None else {"canAdd": False, "error": error} for error in errors]
+
+    def modelNames(self) -> list[str]:
+        return [MODEL]
+
+    def modelFieldNames(self, modelName: str) -> list[str]:
+        if modelName != MODEL:
+            raise ActionError(f"model was not found: {modelName}")
+        return list(FIELDS)
+
+    def answerCards(self, answers: list[dict]) -> list[bool]:
+        "Ease 1 resets the interval, anything else doubles it"
+        results = []
+        with self.lock:
+            for answer in answers:
+                note_id = answer["cardId"] - CARD_ID_BASE + NOTE_ID_BASE
+                if note_id not in self.notes:
+                    results.append(False)
+                    continue
+                self.ivl[note_id] = 1 if answer["ease"] == 1 else max(1, 2 * self.ivl[note_id])
+                results.append(True)
+        return results
+
+    def touch(self, note_ids: list[int]) -> None:
+        "Mark notes as modified, as editing them in Anki would"
+        with self.lock:
+            for note_id in note_ids:
+                self.notes[note_id]["mod"] += 1
+
+    def version(self) -> int:
+        return 6
+
+    def perform(self, request: dict) -> Any:
+        "Result of one action, raises ActionError if it fails"
+        action = request.get("action")
+        params = request.get("params") or {}
+        if action == "multi":
+            return [self.respond(sub) for sub in params.get("actions", [])]
+        if action not in ACTIONS:
+            raise ActionError("unsupported action")
+        try:
+            return getattr(self, action)(**params)
+        except TypeError as e:
+            raise ActionError(str(e))
+
+    def respond(self, request: dict) -> dict:
+        try:
+            return {"result": self.perform(request), "error": None}
+        except ActionError as e:
+            return {"result": None, "error": str(e)}
+
+
+ACTIONS = {"version", "findNotes", "findCards", "notesInfo", "notesModTime", "addNote", "addNotes",
+           "updateNoteFields", "deleteNotes", "canAddNotes", "canAddNotesWithErrorDetail", "modelNames",
+           "modelFieldNames", "answerCards"}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive
+    disable_nagle_algorithm = True
+    collection: FakeCollection
+
+    def do_POST(self) -> None:
+        try:
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            response = self.collection.respond(request)
+        except ValueError as e:
+            response = {"result": None, "error": f"invalid request: {e}"}
+        data = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class FakeAnkiConnect(ThreadingHTTPServer):
+    "Serves a collection in a background thread, use as a context manager"
+    daemon_threads = True
+
+    def __init__(self, collection: FakeCollection, port: int = 0) -> None:
+        handler = type("BoundHandler", (Handler,), {"collection": collection})
+        super().__init__(("127.0.0.1", port), handler)
+        self.collection = collection
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self) -> "FakeAnkiConnect":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=10000)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = FakeAnkiConnect(FakeCollection(args.notes), args.port)
+    print(f"Serving {args.notes} notes at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
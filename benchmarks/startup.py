@@ -0,0 +1,63 @@
+"""
+Measure startup time: how long importing vocabsieve.main takes, and how long
+it takes until the main window is shown and the event loop is running.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10
+
+Every run is a fresh interpreter, so nothing is cached between runs
+other than by the operating system.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import vocabsieve.main
+print(time.perf_counter() - start)
+"""
+
+WINDOW_SCRIPT = """
+import time
+start = time.perf_counter()
+import vocabsieve.main
+from PyQt5.QtCore import QTimer
+
+def shown():
+    print(time.perf_counter() - start, flush=True)
+    vocabsieve.main.app.quit()
+
+# Fires once the event loop is running, after the window has been shown
+QTimer.singleShot(0, shown)
+vocabsieve.main.main()
+"""
+
+
+def measure(script: str) -> float:
+    env = dict(os.environ)
+    # Keep the application from touching the real user data
+    env.setdefault("VOCABSIEVE_DEBUG", "__benchmark")
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    proc = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=120)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{proc.stderr}")
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'':<22}{'median s':>10}{'min s':>10}{'max s':>10}")
+    for name, script in (("import vocabsieve.main", IMPORT_SCRIPT), ("first window", WINDOW_SCRIPT)):
+        times = [measure(script) for _ in range(args.runs)]
+        print(f"{name:<22}{statistics.median(times):>10.3f}{min(times):>10.3f}{max(times):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
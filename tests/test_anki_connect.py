@@ -0,0 +1,135 @@
+import threading
+import pytest
+from types import SimpleNamespace
+from benchmarks.fake_anki_connect import MODEL, ActionError, FakeAnkiConnect, FakeCollection
+from vocabsieve.anki_connect import AnkiConnect, AnkiConnectError, get_client, request
+from vocabsieve.tools import addNotes, canAddNotesWithErrorDetail, notesInfoChunks, notesModTime
+from vocabsieve.vsnt import FIELDS
+
+
+class OlderCollection(FakeCollection):
+    "Returns null for the notes it cannot add, like older versions of AnkiConnect"
+
+    def addNotes(self, notes):
+        with self.lock:
+            return [None if self._cannotAdd(note) else self._add(note) for note in notes]
+
+
+class OldCollection(FakeCollection):
+    "Like versions of AnkiConnect without canAddNotesWithErrorDetail"
+
+    def canAddNotesWithErrorDetail(self, notes):
+        raise ActionError("unsupported action")
+
+
+def new_notes(collection):
+    """Notes to add, the fourth is a duplicate, the eighth is empty and the last has the same
+    first field as the one before it"""
+    notes = [collection.syntheticNote(f"new{i}") for i in range(10)]
+    notes[3]["fields"]["Sentence"] = next(iter(collection.notes.values()))["fields"]["Sentence"]
+    notes[7]["fields"]["Sentence"] = ""
+    notes[8]["fields"]["Sentence"] = 'A "quoted" <b>new8</b> with *wild_cards\\.'
+    notes[9]["fields"]["Sentence"] = notes[8]["fields"]["Sentence"]
+    return notes
+
+
+@pytest.mark.parametrize("collection_class", [FakeCollection, OlderCollection])
+def test_add_notes_errors(collection_class):
+    collection = collection_class(20)
+    notes = new_notes(collection)
+    with FakeAnkiConnect(collection) as server:
+        results = addNotes(server.url, notes, chunk_size=4)
+    errors = {i: str(result) for i, result in enumerate(results) if isinstance(result, AnkiConnectError)}
+    assert set(errors) == {3, 7, 9}
+    assert errors[3] == "cannot create note because it is a duplicate"
+    assert errors[7] == "cannot create note because it is empty"
+    # Every other note is added once and gets its own id, even the one a failed request added
+    assert len(collection.notes) == 20 + 7
+    for note, note_id in zip(notes, results):
+        if not isinstance(note_id, AnkiConnectError):
+            assert collection.notes[note_id]["fields"]["Word"] == note["fields"]["Word"]
+
+
+@pytest.mark.parametrize("collection_class, duplicate, empty", [
+    (FakeCollection, "cannot create note because it is a duplicate", "cannot create note because it is empty"),
+    (OldCollection, "cannot add note", "cannot add note"),
+])
+def test_can_add_notes(collection_class, duplicate, empty):
+    collection = collection_class(20)
+    notes = new_notes(collection)
+    with FakeAnkiConnect(collection) as server:
+        errors = canAddNotesWithErrorDetail(server.url, notes, chunk_size=4)
+    assert errors == [None, None, None, duplicate, None, None, None, empty, None, None]
+
+
+def test_notes_in_chunks():
+    collection = FakeCollection(50)
+    note_ids = collection.findNotes("*")
+    deleted = note_ids[10:13]
+    collection.deleteNotes(deleted)
+    with FakeAnkiConnect(collection) as server:
+        expected = collection.notesInfo(note_ids)
+        chunks = list(notesInfoChunks(server.url, note_ids, chunk_size=7, workers=3))
+        assert sorted(len(chunk) for chunk in chunks) == [1] + [7] * 7
+        # Deleted notes come back as empty entries, like in AnkiConnect
+        assert sorted((info for chunk in chunks for info in chunk), key=lambda info: info.get("noteId", 0)) == \
+            sorted(expected, key=lambda info: info.get("noteId", 0))
+        mod_times = notesModTime(server.url, note_ids, chunk_size=7, workers=3)
+    assert mod_times == {info["noteId"]: info["mod"] for info in expected if info}
+    assert not set(mod_times) & set(deleted)
+
+
+def test_client():
+    collection = FakeCollection(20)
+    with FakeAnkiConnect(collection) as server:
+        assert get_client(server.url) is get_client(server.url)
+        client = AnkiConnect(server.url)
+        session = client.session
+        assert client.invoke("findNotes", query="*") == collection.findNotes("*")
+        with pytest.raises(AnkiConnectError):
+            client.invoke("modelFieldNames", modelName="missing")
+        # Each thread keeps its own session for all of its requests
+        assert client.session is session
+        other: list = []
+        thread = threading.Thread(target=lambda: other.append(client.session))
+        thread.start()
+        thread.join()
+        assert other[0] is not session
+    assert (client.stats["findNotes"].calls, client.stats["findNotes"].errors) == (1, 0)
+    assert (client.stats["modelFieldNames"].calls, client.stats["modelFieldNames"].errors) == (1, 1)
+    assert "findNotes: 1 calls, 0 errors" in client.summary()
+
+
+def test_multi():
+    collection = FakeCollection(20)
+    note_id = collection.findNotes("*")[0]
+    sentence = collection.notes[note_id]["fields"]["Sentence"]
+    with FakeAnkiConnect(collection) as server:
+        fields, found, not_found, error = get_client(server.url).multi([
+            request("modelFieldNames", modelName=MODEL),
+            request("findNotes", query=f'"Sentence:{sentence}"'),
+            request("findNotes", query='"Sentence:not in the collection"'),
+            request("modelFieldNames", modelName="missing"),
+        ])
+    assert fields == list(FIELDS)
+    assert found == [note_id]
+    assert not_found == []
+    assert isinstance(error, AnkiConnectError)
+
+
+def test_find_duplicates(monkeypatch):
+    main = pytest.importorskip("vocabsieve.main", exc_type=ImportError)
+    collection = FakeCollection(20)
+    note_id = collection.findNotes("*")[0]
+    fields = collection.notes[note_id]["fields"]
+    with FakeAnkiConnect(collection) as server:
+        values = {"anki_api": server.url, "note_type": MODEL, "word_field": "Word", "sentence_field": "Sentence"}
+        settings = SimpleNamespace(value=lambda key, default=None, **_: values.get(key, default))
+        monkeypatch.setattr(main, "settings", settings)
+        window = SimpleNamespace(note_type_first_field="")
+        assert main.MainWindow.findDuplicates(window, fields["Word"], fields["Sentence"]) == [note_id]
+        assert window.note_type_first_field == "sentence"
+        assert main.MainWindow.findDuplicates(window, "new", "A sentence not in the collection.") == []
+        values["note_type"] = "missing"
+        assert main.MainWindow.findDuplicates(window, fields["Word"], fields["Sentence"]) == []
+        assert window.note_type_first_field == ""
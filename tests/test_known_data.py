@@ -0,0 +1,53 @@
+from vocabsieve.known_data import COLUMNS, AnkiNote, KnownDataSnapshot, KnownDataStore
+from vocabsieve.models import WordActionWeights
+
+LANG = "en"
+
+
+def test_known_data_store():
+    sources: dict[str, dict[str, int]] = {name: {} for name in COLUMNS}
+    sources["n_seen"] = {"a": 50, "b": 100, "c": 10}
+    sources["n_lookups"] = {"c": 2}
+    store = KnownDataStore.build(LANG, ["a", "b", "c"], sources, {"a": 0.0})
+    waw = WordActionWeights(seen=1, lookup=10, anki_young_ctx=0, anki_young_tgt=0,
+                            anki_mature_ctx=0, anki_mature_tgt=0, threshold=100, threshold_cognate=25)
+    assert store.knownWords(waw) == (["a", "b"], [])
+    assert store.knownWords(waw, {"c"}) == (["a", "b", "c"], ["c"])
+
+    updated = store.updated({"a": None, "c": ((200, 0, 0, 0, 0, 0), 1.0), "d": ((0, 1, 0, 0, 0, 0), 2.0)})
+    expected = KnownDataStore.build(LANG, ["b", "c", "d"],
+                                    {**sources, "n_seen": {"b": 100, "c": 200}, "n_lookups": {"d": 1}}, {"d": 2.0})
+    assert dict(updated) == dict(expected)
+    assert updated.modifiersOf(["b", "c", "d", "a"]).tolist() == [1.0, 1.0, 2.0, 1.0]
+    assert updated.scoresOf(["c", "d", "a"], waw).tolist() == [200, 10, 0]
+    assert updated.knownWords(waw) == (["b", "c"], [])
+    # The original store is left as it was
+    assert store["c"].n_seen == 10 and "a" in store and "d" not in store
+
+
+def test_snapshot_records():
+    snapshot = KnownDataSnapshot(LANG, "{}")
+    touched = snapshot.replaceValues(snapshot.seen, {"cat": 3, "dog": 1, "bird": 2})
+    touched |= snapshot.applyValues(snapshot.lookups, [("cat", 1), ("fish", 2)])
+    touched |= snapshot.applyValues(snapshot.modifiers, [("dog", 0.0)])
+    touched |= snapshot.addNote(1, AnkiNote(1, True, "cat", ("cat", "sat")))
+    touched |= snapshot.addNote(2, AnkiNote(1, False, "", ("bird",)))
+    snapshot.rebuildRecords(touched)
+
+    # Small updates are applied to the rows they touch
+    touched = snapshot.replaceValues(snapshot.seen, {"cat": 3, "dog": 1, "owl": 1})
+    touched |= snapshot.applyValues(snapshot.lookups, [("fish", None)])
+    touched |= snapshot.addNote(1, AnkiNote(2, False, "cat", ("sat",)))
+    touched |= snapshot.removeNote(2)
+    assert touched == {"bird", "owl", "fish", "cat", "sat"}
+    snapshot.rebuildRecords(touched)
+
+    sources = snapshot._sources()
+    expected = KnownDataStore.build(LANG, ["cat", "dog", "owl", "sat"], sources, snapshot.modifiers)
+    store, metadata = snapshot.knownData()
+    assert dict(store) == dict(expected)
+    assert store.modifiersOf(["dog", "cat"]).tolist() == [0.0, 1.0]
+    assert sources["anki_young_tgt"] == {"cat": 1} and not sources["anki_mature_ctx"]
+    assert (metadata.n_seen, metadata.n_lookups, metadata.n_young_tgt, metadata.n_young_ctx,
+            metadata.n_mature_tgt, metadata.n_mature_ctx) == (3, 1, 1, 1, 0, 0)
+    assert snapshot.clearNotes() == {"cat", "sat"} and not snapshot.notes
@@ -0,0 +1,37 @@
+from vocabsieve import lemmatizer
+from vocabsieve.lemma_cache import LemmaCache
+from vocabsieve.lemmatizer import lemmatize_many
+
+
+def test_lemma_cache(tmp_path):
+    path = str(tmp_path / "lemmas.db")
+    cache = LemmaCache(path, "v1")
+    cache.put_many({"cats": "cat", "ran": "run"}, "en")
+    cache.put("Hunde", "Hund", "de", greedy=True)
+    assert cache.get("cats", "en") == "cat"
+    cache.flush()
+    # Another session or process reads what was written
+    other = LemmaCache(path, "v1")
+    assert other.get_many(["cats", "ran", "dogs", "cats"], "en") == {"cats": "cat", "ran": "run"}
+    assert other.get("Hunde", "de") is None
+    assert other.get("Hunde", "de", greedy=True) == "Hund"
+    # Warmed languages are served from memory
+    other.warm("en")
+    cache.put("dogs", "dog", "en")
+    cache.flush()
+    assert other.get("dogs", "en") is None
+    other.put("mice", "mouse", "en")
+    assert other.get("mice", "en") == "mouse"
+    # Lemmas of other lemmatizer versions are discarded
+    assert LemmaCache(path, "v2").get("cats", "en") is None
+
+
+def test_lemmatize_many_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / "lemmas.db")
+    cache = LemmaCache(path, "v1")
+    monkeypatch.setattr(lemmatizer, "_lemma_cache", cache)
+    cache.put("foxes", "cached", "en")
+    assert lemmatize_many(["foxes", "Horses", "horses,"], "en") == ["cached", "horse", "horse"]
+    cache.flush()
+    assert LemmaCache(path, "v1").get_many(["foxes", "Horses", "horses"], "en") == {
+        "foxes": "cached", "Horses": "horse", "horses": "horse"}
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import pytest
+from vocabsieve import lemmatizer
+from vocabsieve.lemmatizer import lem_word, lemmatize_many
+
+TOKENS = {
+    "en": ["Cats,", "running", "«Cats»", "cats", "<b>dogs</b>", "", "...", "were"],
+    "ru": ["Кошки", "бежали", "кошки,", "до́ма"],
+    "xx": ["Unsupported", "words"],
+}
+
+
+@pytest.mark.parametrize("language", TOKENS)
+def test_lemmatize_many(language):
+    tokens = TOKENS[language] * 3
+    assert lemmatize_many(tokens, language) == [lem_word(token, language) for token in tokens]
+    assert lemmatize_many(iter(tokens), language, greedy=True) == [lem_word(token, language, True)
+                                                                   for token in tokens]
+    assert lemmatize_many([], language) == []
+
+
+def test_lemmatize_many_parallel(monkeypatch):
+    monkeypatch.setattr(lemmatizer, "PARALLEL_MIN_FORMS", 10)
+    monkeypatch.setattr(lemmatizer, "LEMMATIZE_CHUNK_SIZE", 7)
+    tokens = [f"{word}{suffix}" for word in ("cat", "dog", "house", "run") for suffix in ("", "s", "ning", "ed")]
+    calls = []
+    lemmas = lemmatize_many(tokens, "en", processes=2, progress=lambda done, total: calls.append((done, total)))
+    assert lemmas == [lem_word(token, "en") for token in tokens]
+    assert calls[-1] == (len(set(tokens)), len(set(tokens)))
+    assert len(calls) == 3
+
+
+def test_lazy_analyzers():
+    # A fresh interpreter, as other tests may have loaded the analyzers already
+    code = ("import sys\n"
+            "from vocabsieve.lemmatizer import lem_word, get_morph\n"
+            "assert not {'pymorphy3', 'simplemma'} & set(sys.modules)\n"
+            "assert lem_word('cats', 'en') == 'cat' and 'pymorphy3' not in sys.modules\n"
+            "assert get_morph('en') is None and 'pymorphy3' not in sys.modules\n"
+            "assert lem_word('кошки', 'ru') == 'кошка' and get_morph('ru') is get_morph('ru')\n")
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
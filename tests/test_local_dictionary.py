@@ -1,4 +1,13 @@
+import gzip
+import json
+import os
+import sqlite3
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from vocabsieve.compiled_dictionary import DictionaryClosedError
 from vocabsieve.local_dictionary import LocalDictionary
+from vocabsieve import dictformats
+from vocabsieve.dict_rebuild import rebuild
 
 
 def test_local_dictionary(tmp_path):
@@ -143,3 +152,204 @@ rådigt (comparative rådigare, superlative rådigast)
     assert db.define("géminer", "fr", "kaikki-french") == """<i>Verb</i>
 1. Se doubler.
 2. Grouper deux à deux, doubler."""
+
+
+def test_parallel_kaikki(tmp_path, monkeypatch):
+    lines = [json.dumps({"word": f"word{i // 2}", "lang_code": "sv" if i % 3 else "fr", "pos": "noun",
+                         "senses": [{"glosses": [f"sense {i}"]}]}) for i in range(2000)]
+    plain = tmp_path / "dump.jsonl"
+    plain.write_text("\n".join(lines) + "\n")
+    compressed = tmp_path / "dump.jsonl.gz"
+    compressed.write_bytes(gzip.compress(plain.read_bytes()))
+    expected = list(dictformats.parseKaikki(str(plain), "sv", processes=1))
+    assert len(expected) == 1000
+    # Consecutive lines with the same headword are combined, lines in other languages skipped
+    assert expected[1] == ("word1", "<i>Noun</i> <br>\n<strong></strong><br>\n<br>\n1. sense 2")
+    assert expected[2] == ("word2", "<i>Noun</i> <br>\n<strong></strong><br>\n<br>\n1. sense 4\n\n"
+                                    "<i>Noun</i> <br>\n<strong></strong><br>\n<br>\n1. sense 5")
+    monkeypatch.setattr(dictformats, "KAIKKI_CHUNK_SIZE", 4096)
+    for path in (plain, compressed):
+        assert list(dictformats.parseKaikki(str(path), "sv", processes=2)) == expected
+
+
+def test_bulk_import(tmp_path):
+    db = LocalDictionary(tmp_path)
+    entries = ((f"word{i}", f"definition {i}") for i in range(1000))
+    assert db.importdict(entries, "en", "generated") == 1000
+    assert db.define("word999", "en", "generated") == "definition 999"
+    # Later duplicates override earlier ones
+    assert db.importdict([("a", "first"), ("b", "b"), ("a", "second")], "en", "dupes") == 3
+    assert db.countEntriesDict("dupes") == 2
+    assert db.define("a", "en", "dupes") == "second"
+
+
+def test_bulk_import_failure_is_isolated(tmp_path):
+    db = LocalDictionary(tmp_path)
+
+    def broken():
+        yield ("ok", "ok")
+        raise ValueError("corrupt file")
+
+    with db.bulkImport(chunk_size=1) as importer:
+        importer.add([("test", "a test")], "de", "good")
+        with pytest.raises(ValueError):
+            importer.add(broken(), "de", "bad")
+    assert importer.n_rows == 1
+    assert db.countDicts() == 1
+    assert db.define("test", "de", "good") == "a test"
+
+
+def test_define_many(tmp_path):
+    db = LocalDictionary(tmp_path)
+    db.importdict({"foo": "a", "bar": "b", "baz": "c"}, "en", "many")
+    words = ["foo", "baz", "missing", "foo"] + [f"w{i}" for i in range(2000)]
+    assert db.define_many(words, "en", "many") == {"foo": "a", "baz": "c"}
+    assert db.define_many([], "en", "many") == {}
+
+
+def test_concurrent_lookups(tmp_path):
+    db = LocalDictionary(tmp_path)
+    db.importdict(((f"word{i}", f"definition {i}") for i in range(1000)), "en", "threads")
+
+    def lookup(i):
+        return db.define(f"word{i}", "en", "threads")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lookup, range(1000)))
+    assert results == [f"definition {i}" for i in range(1000)]
+
+
+def test_compiled_dictionary(tmp_path):
+    db = LocalDictionary(tmp_path)
+    entries = {"b": "bee", "a": "ay", "ä": "umlaut", "Z": "zed", "ab": "ay bee\nsecond line"}
+    db.importdict(entries, "de", "compiled")
+    db.compileDictionary("de", "compiled")
+    compiled = db.getCompiled("de", "compiled")
+    assert compiled is not None
+    assert len(compiled) == len(entries)
+    for word, definition in entries.items():
+        assert compiled.lookup(word) == definition
+    assert compiled.lookup("missing") is None
+    assert compiled.lookup("") is None
+    # Reimporting closes and removes the compiled copy
+    db.importdict({"c": "see"}, "de", "compiled")
+    assert db.getCompiled("de", "compiled") is None
+    assert not os.path.exists(db.compiledFile("de", "compiled"))
+    with pytest.raises(DictionaryClosedError):
+        compiled.lookup("a")
+    db.compileDictionary("de", "compiled")
+    compiled = db.getCompiled("de", "compiled")
+    assert compiled is not None
+    # Compiling again closes the open copy before replacing its file
+    db.compileDictionary("de", "compiled")
+    with pytest.raises(DictionaryClosedError):
+        compiled.lookup("c")
+    assert db.getCompiled("de", "compiled").lookup("c") == "see"
+    db.deletedict("compiled")
+    assert db.getCompiled("de", "compiled") is None
+    assert not os.path.exists(os.path.dirname(db.compiledFile("de", "compiled")))
+
+
+def test_compressed_definitions(tmp_path):
+    db = LocalDictionary(tmp_path)
+    entries = {f"word{i}": f"<div><b>word{i}</b> <i>noun</i> a long definition number {i} with markup</div>"
+               for i in range(3000)}
+    db.importdict(entries, "en", "compressed")
+    assert db.getCodec("compressed") is not None
+    assert db.define("word42", "en", "compressed") == entries["word42"]
+    assert db.define_many(["word1", "word2"], "en", "compressed") == {"word1": entries["word1"],
+                                                                      "word2": entries["word2"]}
+    assert dict(db.getAllWords("en", "compressed")) == entries
+
+
+def test_compress_existing(tmp_path):
+    db = LocalDictionary(tmp_path, compress=False)
+    entries = {f"word{i}": f"<div><b>word{i}</b> <i>verb</i> another long definition, number {i}</div>"
+               for i in range(3000)}
+    db.importdict(entries, "en", "legacy")
+    assert db.getCodec("legacy") is None
+    size_before, size_after = db.compressExisting()
+    assert size_after < size_before
+    assert db.getCodec("legacy") is not None
+    assert dict(db.getAllWords("en", "legacy")) == entries
+
+
+def test_migrate_legacy_table(tmp_path):
+    conn = sqlite3.connect(tmp_path / "dict.db")
+    conn.execute("CREATE TABLE dictionary (word TEXT, definition TEXT, language TEXT, dictname TEXT)")
+    conn.executemany("INSERT INTO dictionary VALUES(?, ?, ?, ?)", [
+        ("hund", "dog", "de", "de-en"),
+        ("katze", "cat", "de", "de-en"),
+        ("chat", "cat", "fr", "fr-en"),
+    ])
+    conn.commit()
+    conn.close()
+    db = LocalDictionary(tmp_path)
+    assert db.needsMigration()
+    steps = []
+    db.migrateLegacy(lambda done, total: steps.append((done, total)))
+    assert steps == [(0, 2), (1, 2), (2, 2)]
+    assert not db.needsMigration()
+    assert db.countDicts() == 2
+    assert db.define("katze", "de", "de-en") == "cat"
+    assert db.getNamesForLang("fr") == ["fr-en"]
+    db.deletedict("de-en")
+    assert db.getDictNames() == ["fr-en"]
+    # Table names of deleted dictionaries are not reused
+    old_table = db.getTable("fr-en")
+    db.deletedict("fr-en")
+    db.importdict({"chien": "dog"}, "fr", "new")
+    assert db.getTable("new") not in (old_table, None)
+
+
+def test_unchanged_source(tmp_path):
+    db = LocalDictionary(tmp_path)
+    path = tmp_path / "dict.json"
+    path.write_text(json.dumps({"a": "b"}))
+    db.dictimport(str(path), "json", "en", "json-dict")
+    assert db.isUnchanged("json-dict", str(path), "json", "en")
+    assert not db.isUnchanged("json-dict", str(path), "json", "de")
+    # Touched, same contents
+    os.utime(path, (0, 0))
+    assert db.isUnchanged("json-dict", str(path), "json", "en")
+    path.write_text(json.dumps({"a": "c"}))
+    assert not db.isUnchanged("json-dict", str(path), "json", "en")
+
+
+def test_parallel_rebuild(tmp_path):
+    db = LocalDictionary(tmp_path)
+    dicts = []
+    for i in range(3):
+        path = tmp_path / f"dict{i}.json"
+        path.write_text(json.dumps({f"word{j}": f"def{i} {j}" for j in range(1000)}))
+        dicts.append({"name": f"dict{i}", "type": "json", "path": str(path), "lang": "en"})
+    broken = tmp_path / "broken.json"
+    broken.write_text("{")
+    dicts.append({"name": "broken", "type": "json", "path": str(broken), "lang": "en"})
+    result = rebuild(db, dicts, processes=2, chunk_size=100)
+    assert sorted(result.imported) == ["dict0", "dict1", "dict2"]
+    assert list(result.failed) == ["broken"]
+    assert result.n_rows == 3000
+    assert db.define("word5", "en", "dict1") == "def1 5"
+    assert sorted(db.getDictNames()) == ["dict0", "dict1", "dict2"]
+    result = rebuild(db, dicts[:2], processes=2)
+    assert sorted(result.skipped) == ["dict0", "dict1"]
+    assert not result.imported
+    assert sorted(db.getDictNames()) == ["dict0", "dict1"]
+    # A single changed dictionary is imported without the worker pool
+    (tmp_path / "dict0.json").write_text(json.dumps({"word": "changed"}))
+    result = rebuild(db, dicts[:2], processes=2)
+    assert (result.imported, result.skipped, result.n_rows) == (["dict0"], ["dict1"], 1)
+    assert db.define("word", "en", "dict0") == "changed"
+    result = rebuild(db, dicts[:1] + dicts[3:], processes=2)
+    assert list(result.failed) == ["broken"]
+
+
+def test_suggest(tmp_path):
+    db = LocalDictionary(tmp_path)
+    db.importdict({"über": "over", "Haus": "house", "Hause": "home", "Häuser": "houses", "Maus": "mouse"},
+                  "de", "de-dict")
+    assert db.suggest("uber", "de", "de-dict")[0] == "über"
+    assert db.suggest("haus", "de", "de-dict", prefix=False) == ["Haus", "Maus", "Hause"]
+    assert db.suggest("hau", "de", "de-dict") == ["Haus", "Hause", "Häuser"]
+    assert db.suggest("xyz", "de", "de-dict") == []
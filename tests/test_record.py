@@ -0,0 +1,238 @@
+import json
+import os
+import threading
+from collections import Counter
+import pytest
+from benchmarks.fake_anki_connect import CARD_ID_BASE, MODEL, NOTE_ID_BASE, FakeAnkiConnect, FakeCollection
+from vocabsieve import lemmatizer, record
+from vocabsieve.known_data import load_snapshot, save_snapshot
+from vocabsieve.models import LookupRecord
+from vocabsieve.record import Record
+
+LANG = "en"
+
+
+class Settings(dict):
+    "In-memory stand-in for QSettings"
+
+    def value(self, key, default=None, type=None):
+        value = self.get(key, default)
+        return type(value) if type is not None and value is not None else value
+
+    def setValue(self, key, value):
+        self[key] = value
+
+
+@pytest.fixture
+def rec(tmp_path, monkeypatch):
+    monkeypatch.setattr(record, "settings", Settings({"target_language": LANG, "enable_anki": False}))
+    return Record(Settings(), tmp_path)
+
+
+@pytest.fixture
+def anki(monkeypatch):
+    collection = FakeCollection(300, vocabulary=500)
+    with FakeAnkiConnect(collection) as server:
+        monkeypatch.setattr(record, "settings", Settings({
+            "target_language": LANG,
+            "anki_api": server.url,
+            "enable_anki": True,
+            "tracking/fieldmap": json.dumps({MODEL: ["Word", "Sentence"]}),
+            "tracking/anki_query_mature": "prop:ivl>=14",
+            "tracking/anki_query_young": "prop:ivl<14 is:review",
+        }))
+        yield collection
+
+
+def full_rebuild(rec):
+    "Known data computed from scratch, without the snapshot of rec"
+    os.remove(rec._snapshotPath(LANG))
+    return Record(Settings(), rec.datapath)._refreshKnownData()
+
+
+def assert_same(known_data, expected):
+    (store, metadata), (expected_store, expected_metadata) = known_data, expected
+    assert dict(store) == dict(expected_store)
+    assert store.modifiersOf(store.lemmas).tolist() == expected_store.modifiersOf(store.lemmas).tolist()
+    assert metadata == expected_metadata
+
+
+def modifier(known_data, lemma):
+    return known_data[0].modifiersOf([lemma]).tolist()[0]
+
+
+def card(note_id):
+    return note_id - NOTE_ID_BASE + CARD_ID_BASE
+
+
+def test_modifiers_during_refresh(rec, monkeypatch):
+    rec.importContent("book", "one two three four", LANG, 1)
+    rec.getKnownData()
+    rec.setModifier(LANG, "one", 0.0)
+    assert modifier(rec.last_known_data, "one") == 0.0
+
+    # A refresh waiting on Anki must not hold up modifier writes
+    record.settings["enable_anki"] = True
+    in_anki, resume = threading.Event(), threading.Event()
+
+    def refreshAnkiNotes(snapshot, touched):
+        in_anki.set()
+        resume.wait()
+    monkeypatch.setattr(rec, "_refreshAnkiNotes", refreshAnkiNotes)
+    result = []
+    refresh = threading.Thread(target=lambda: result.append(rec._refreshKnownData()))
+    refresh.start()
+    assert in_anki.wait(10)
+    writer = threading.Thread(target=lambda: rec.setModifier(LANG, "two", 2.0))
+    writer.start()
+    writer.join(10)
+    assert not writer.is_alive()
+    rec.deleteModifiers(LANG)
+    rec.setModifier(LANG, "three", 0.5)
+    resume.set()
+    refresh.join(10)
+    for known_data in (result[0], rec.last_known_data):
+        assert [modifier(known_data, lemma) for lemma in ("one", "two", "three")] == [1.0, 1.0, 0.5]
+
+
+def test_import_content(rec, monkeypatch):
+    assert rec.importContent("one", "cats dogs cats", LANG, 1)
+    assert not rec.importContent("one", "birds", LANG, 1)
+    # Large contents are lemmatized in a process pool
+    monkeypatch.setattr(lemmatizer, "PARALLEL_MIN_FORMS", 10)
+    monkeypatch.setattr(lemmatizer, "LEMMATIZE_CHUNK_SIZE", 5)
+    words = [f"word{i}" for i in range(30)]
+    calls = []
+    assert rec.importContent("two", " ".join(words + ["cats"]), LANG, 2,
+                             progress=lambda done, total: calls.append((done, total)))
+    assert calls[-1] == (31, 31)
+    assert dict(rec.getSeen(LANG)) == {"cat": 3, "dog": 1, **dict.fromkeys(words, 1)}
+    assert rec.countSeen(LANG) == (34, 32)
+
+
+def test_content_lemmas(rec):
+    rec.importContent("one", "Cats and <b>dogs</b>, cats.", LANG, 1)
+    content_lemmas = """
+        SELECT lemma_ids.lemma, content_lemmas.count FROM content_lemmas
+        JOIN lemma_ids ON lemma_ids.id = content_lemmas.lemma_id
+        WHERE content_id = (SELECT id FROM contents WHERE name=?)
+    """
+    assert dict(rec.pool.cursor().execute(content_lemmas, ("one",))) == {"cat": 2, "and": 1, "dog": 1}
+    assert list(rec.getContentsInfo(LANG)) == [("one", 1, 4)]
+    # Seen words are rebuilt from the stored counts, or from the text again
+    seen = dict(rec.getSeen(LANG))
+    rec.rebuildSeen()
+    assert dict(rec.getSeen(LANG)) == seen
+    rec.rebuildSeen(relemmatize=True)
+    assert dict(rec.getSeen(LANG)) == seen
+    assert dict(rec.pool.cursor().execute(content_lemmas, ("one",))) == {"cat": 2, "and": 1, "dog": 1}
+
+
+def test_delete_content(rec):
+    rec.importContent("one", "apple banana apple", LANG, 1)
+    rec.importContent("two", "banana cherry", LANG, 1)
+    rec.deleteContent("one")
+    assert dict(rec.getSeen(LANG)) == {"banana": 1, "cherry": 1}
+    # Contents recorded before lemma counts were stored
+    with rec.pool.lock:
+        rec.c.execute("INSERT INTO contents(name, content, language, jd, n_words) VALUES(?,?,?,?,?)",
+                      ("old", "cherry date", LANG, 1, 2))
+        rec._seenContent(Counter({"cherry": 1, "date": 1}), LANG)
+        rec.conn.commit()
+    rec.deleteContent("two")
+    assert dict(rec.getSeen(LANG)) == {"cherry": 1, "date": 1}
+    # Without lemma counts to take out, seen words are recomputed from the remaining contents
+    rec.importContent("three", "date", LANG, 1)
+    with rec.pool.lock:
+        rec.c.execute("DELETE FROM content_lemmas WHERE content_id=(SELECT id FROM contents WHERE name='three')")
+        rec.conn.commit()
+    rec.deleteContent("three")
+    assert dict(rec.getSeen(LANG)) == {"cherry": 1, "date": 1}
+    rec.deleteContent("missing")
+
+
+def test_incremental_refresh(rec):
+    words = [f"word{i}" for i in range(300)]
+    rec.importContent("book", " ".join(words[:200]), LANG, 1)
+    assert_same(rec._refreshKnownData(), full_rebuild(rec))
+    snapshot = rec.known_snapshot
+
+    def check():
+        known_data = rec._refreshKnownData()
+        assert rec.known_snapshot is snapshot  # Applied incrementally
+        assert_same(known_data, full_rebuild(rec))
+
+    for word in words[:5]:
+        rec.recordLookup(LookupRecord(word=word, language=LANG, source="test"))
+    check()
+    rec.importContent("article", " ".join(words[100:300]), LANG, 2)
+    rec.deleteContent("book")
+    check()
+    rec.setModifier(LANG, words[150], 0.0)
+    rec.setModifier(LANG, words[250], 2.0)
+    check()
+    rec.deleteModifiers(LANG)
+    rec.setModifier(LANG, words[0], 0.0)
+    check()
+    rec.rebuildSeen(relemmatize=True)
+    check()
+
+
+def test_incremental_refresh_anki(tmp_path, anki, monkeypatch):
+    rec = Record(Settings(), tmp_path)
+    rec.importContent("book", " ".join(anki.words[:200]), LANG, 1)
+    assert_same(rec._refreshKnownData(), full_rebuild(rec))
+    snapshot = rec.known_snapshot
+
+    def check():
+        known_data = rec._refreshKnownData()
+        assert rec.known_snapshot is snapshot  # Applied incrementally
+        assert_same(known_data, full_rebuild(rec))
+
+    young = anki.findNotes("prop:ivl>=7 prop:ivl<14")
+    mature = anki.findNotes("prop:ivl>=14")
+    anki.answerCards([{"cardId": card(note_id), "ease": 3} for note_id in young[:5]]
+                     + [{"cardId": card(note_id), "ease": 1} for note_id in mature[:5]])
+    check()
+    deleted = mature[5:10]
+    anki.deleteNotes(deleted)
+    check()
+    cached = rec.pool.cursor().execute(
+        f"SELECT COUNT(*) FROM anki_notes WHERE note_id IN ({','.join('?' * len(deleted))})", deleted)
+    assert cached.fetchone()[0] == 0
+    anki.updateNoteFields({"id": mature[10], "fields": {"Word": "edited", "Sentence": "An <b>edited</b> note."}})
+    note_id = anki.addNote(anki.syntheticNote("added"))
+    anki.answerCards([{"cardId": card(note_id), "ease": 3}])
+    check()
+    # Without a snapshot, the lemmas of unchanged notes come from the note cache
+    fetched = []
+    monkeypatch.setattr(record, "notesInfoChunks", lambda server, notes: fetched.extend(notes) or iter(()))
+    assert_same(full_rebuild(rec), rec.last_known_data)
+    assert fetched == []
+
+
+def test_known_snapshot(tmp_path, anki):
+    rec = Record(Settings(), tmp_path)
+    rec.importContent("book", " ".join(anki.words[:200]), LANG, 1)
+    rec.recordLookup(LookupRecord(word=anki.words[0], language=LANG, source="test"))
+    rec.setModifier(LANG, anki.words[1], 0.0)
+    known_data = rec._refreshKnownData()
+    snapshot = rec.known_snapshot
+    assert snapshot.notes and snapshot.anki
+    path = str(tmp_path / "copy.snapshot")
+    save_snapshot(snapshot, path)
+    loaded = load_snapshot(path)
+    for name in ("language", "fieldmap", "watermark", "lookups", "seen", "modifiers", "notes", "anki"):
+        assert getattr(loaded, name) == getattr(snapshot, name)
+    assert loaded.records.lemmas == snapshot.records.lemmas
+    assert_same(loaded.knownData(), snapshot.knownData())
+    # The next session starts from the saved snapshot
+    rec = Record(Settings(), tmp_path)
+    assert_same(rec.loadKnownSnapshot(), known_data)
+    assert_same(rec.getKnownData(), known_data)
+    # An unreadable snapshot is rebuilt from scratch
+    with open(rec._snapshotPath(LANG), "wb") as f:
+        f.write(b"garbage")
+    rec = Record(Settings(), tmp_path)
+    assert rec.loadKnownSnapshot() is None
+    assert_same(rec.getKnownData(), known_data)
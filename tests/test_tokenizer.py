@@ -0,0 +1,31 @@
+from vocabsieve.lemmatizer import lem_word
+from vocabsieve.tokenizer import Token, lemmatize_tokens, tokenize
+
+
+def test_tokenize():
+    text = "  The «cats»,\nran <b>home</b>. "
+    tokens = list(tokenize(text, "en"))
+    assert [token.text for token in tokens] == text.split()
+    assert all(text[token.start:token.end] == token.text for token in tokens)
+    assert [token.form for token in tokens] == ["The", "cats", "ran", "home"]
+    assert tokens[1] == Token(6, 13, "«cats»,", "cats")
+
+
+def test_tokenize_strip_tags():
+    text = "a<b>bold</b>word <i>x</i>"
+    tokens = list(tokenize(text, "en", strip_tags=True))
+    assert [token.text for token in tokens] == ["a", "bold", "word", "x"]
+    assert all(text[token.start:token.end] == token.text for token in tokens)
+
+
+def test_tokenize_cjk():
+    assert [token.text for token in tokenize("我喜欢猫。Hello world", "zh")] == \
+        ["我", "喜", "欢", "猫", "。", "Hello", "world"]
+    assert [token.text for token in tokenize("<b>猫</b>です", "ja", strip_tags=True)] == ["猫", "で", "す"]
+    # Other languages keep runs of CJK characters together
+    assert [token.text for token in tokenize("猫です", "en")] == ["猫です"]
+
+
+def test_lemmatize_tokens():
+    text = "Cats chased the cats, «dogs» ran"
+    assert lemmatize_tokens(tokenize(text, "en"), "en") == [lem_word(word, "en") for word in text.split()]
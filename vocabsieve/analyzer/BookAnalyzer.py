@@ -6,7 +6,7 @@ from operator import itemgetter
 from ..tools import ebook2text, starts_with_cyrillic, prettydigits, amount_and_percent, grouper, window, get_first_number
 import time
 from statistics import stdev, mean
-from ..lemmatizer import lem_word
+from ..tokenizer import tokenize, lemmatize_tokens
 from ..importer import WordListImporter
 from ..global_names import logger, settings
 import itertools
@@ -44,14 +44,11 @@ class BookAnalyzer(QDialog):
             # languages: Russian, Ukrainian, Bulgarian, Macedonian, Belarusian, Kazakh,
             # Kyrgyz, Mongolian, Tajik, Uzbek
             self.known_words = {word for word in self.known_words if starts_with_cyrillic(word)}
-        else:
-            self.known_words = set(self.known_words)
         logger.debug(f"Known words: {len(self.known_words)}")
         self.content = "\n".join(self.chapters)
 
         self._layout.addWidget(QLabel("<h2>General info</h2>"), 2, 0, 1, 2)
         self.basic_info_left += "Total characters: " + prettydigits(len(self.content))
-        self.basic_info_left += "<br>Total words: " + prettydigits(len(self.content.split()))
         #self.progress = QProgressDialog("Splitting book into sentences...", "Cancel", 0, len(self.content), self)
         with Pool() as p:
             start = time.time()
@@ -62,9 +59,15 @@ class BookAnalyzer(QDialog):
                                   if sentence)
             logger.debug(f"Split book in { time.time() - start } seconds.")
 
-            start = time.time()
-            self.words = list(p.starmap(lem_word, ((word, self.langcode) for word in self.content.split())))
-            logger.debug(f"Lemmatized book in { time.time() - start } seconds.")
+        start = time.time()
+        # Only unique words are lemmatized, which is much cheaper than spreading every token over a pool
+        self.words = lemmatize_tokens(tokenize(self.content, self.langcode), self.langcode)
+        # Lemmas of each sentence, the simulation reuses them on every slider move
+        sentence_tokens = [list(tokenize(sentence, self.langcode)) for sentence in self.sentences]
+        sentence_lemmas = iter(lemmatize_tokens(itertools.chain.from_iterable(sentence_tokens), self.langcode))
+        self.sentence_lemmas = [list(itertools.islice(sentence_lemmas, len(tokens))) for tokens in sentence_tokens]
+        logger.debug(f"Lemmatized book in { time.time() - start } seconds.")
+        self.basic_info_left += "<br>Total words: " + prettydigits(len(self.words))
         unique_words_3k = []
         unique_words_10k = []
         # Unique words per 3000 tokens
@@ -82,8 +85,8 @@ class BookAnalyzer(QDialog):
             str(round(len(self.content) / len(self.content.split()), 2)) + " ± " + str(round(stdev([len(word) for word in self.content.split()]), 2))
         self.basic_info_right += "<br>Avg. sentence length (chars, incl. spaces): " + str(round(mean(
             [len(sentence) for sentence in self.sentences]), 2)) + " ± " + str(round(stdev([len(sentence) for sentence in self.sentences]), 2))
-        self.basic_info_right += "<br>Avg. sentence length (words): " + str(round(mean([len(sentence.split(
-        )) for sentence in self.sentences]), 2)) + " ± " + str(round(stdev([len(sentence.split()) for sentence in self.sentences]), 2))
+        self.basic_info_right += "<br>Avg. sentence length (words): " + str(round(mean(
+            [len(lemmas) for lemmas in self.sentence_lemmas]), 2)) + " ± " + str(round(stdev([len(lemmas) for lemmas in self.sentence_lemmas]), 2))
         self.basic_info_right += "<br>Unique lemmas per 10000: " + \
             str(round(mean(unique_words_10k))) + " ± " + str(round(stdev(unique_words_10k), 1))
         self._layout.addWidget(QLabel(self.basic_info_right), 3, 1)
@@ -136,7 +139,7 @@ class BookAnalyzer(QDialog):
         self.label_2t.setToolTip("Sentences expected to be encountered, where you know all but two lemmas")
         self.label_3t.setToolTip("Sentences expected to be encountered, where at least three lemmas are unknown to you")
 
-        sentence_target_counts = self.categorizeSentences(self.sentences, self.learning_rate_slider.value() / 100)
+        sentence_target_counts = self.categorizeSentences(self.sentence_lemmas, self.learning_rate_slider.value() / 100)
 
         if sentence_target_counts is None:
             return
@@ -150,10 +153,9 @@ class BookAnalyzer(QDialog):
         start = time.time()
 
         target_words_in_3t = []
-        sentences_3t = [sentence for sentence in self.sentences if self.countTargets3(sentence) == 3]
-        for sentence in sentences_3t:
-            target_words_in_3t.extend([lem_word(word, self.langcode) for word in sentence.split()
-                                      if lem_word(word, self.langcode) not in self.known_words])
+        sentences_3t = [lemmas for lemmas in self.sentence_lemmas if self.countTargets3(lemmas) == 3]
+        for lemmas in sentences_3t:
+            target_words_in_3t.extend(self.getTargets(lemmas))
 
         occurrences_3t = Counter(target_words_in_3t)
         # Get the most frequent words in 3t sentences
@@ -165,7 +167,7 @@ class BookAnalyzer(QDialog):
         for n_cram in [100, 200, 400, 800]:
             most_frequent_3t = [word for word, _ in occurrences_3t.most_common(n_cram)]
             tmp_known_words = self.known_words.union(set(most_frequent_3t))
-            new_count_3t = [self.countTargets3(sentence, tmp_known_words) for sentence in sentences_3t].count(3)
+            new_count_3t = [self.countTargets3(lemmas, tmp_known_words) for lemmas in sentences_3t].count(3)
             cram_widget = QLabel(
                 f"Cram {n_cram} words: {amount_and_percent(new_count_3t, len(self.sentences))} ≥3T sentences")
             cram_widget.setToolTip(
@@ -303,15 +305,16 @@ class BookAnalyzer(QDialog):
 
     def onSliderRelease(self):
         self.learning_rate = self.learning_rate_slider.value() / 100
-        self.categorizeSentences(self.sentences, self.learning_rate)
+        self.categorizeSentences(self.sentence_lemmas, self.learning_rate)
 
     def updateSentenceChart(self):
         window_size = self.sentence_chart_step_size.value()
         self.learning_rate = self.learning_rate_slider.value() / 100
-        self.categorizeSentences(self.sentences, self.learning_rate, window_size)
+        self.categorizeSentences(self.sentence_lemmas, self.learning_rate, window_size)
         settings.setValue("analyzer/sentence_window_size", window_size)
 
-    def categorizeSentences(self, sentences, learning_rate, window_size=None):
+    def categorizeSentences(self, sentence_lemmas, learning_rate, window_size=None):
+        "Simulate reading the book, sentence_lemmas has the lemmas of each sentence"
         with self.is_drawing_lock:
             if window_size is None:
                 window_size = settings.value("analyzer/sentence_window_size", 80, type=int)
@@ -324,17 +327,17 @@ class BookAnalyzer(QDialog):
             known_words = self.known_words.copy()
             learned_words = set()
             sentence_target_counts = []
-            for w in grouper(sentences, window_size):
-                w_counts = [self.countTargets3(sentence, known_words) for sentence in w if sentence]
-                sents_1t = [sentence for i, sentence in zip(w_counts, w) if i == 1]
-                sents_2t = [sentence for i, sentence in zip(w_counts, w) if i == 2]
-                sents_3t = [sentence for i, sentence in zip(w_counts, w) if i == 3]
+            for w in grouper(sentence_lemmas, window_size):
+                w_counts = [self.countTargets3(lemmas, known_words) for lemmas in w if lemmas is not None]
+                sents_1t = [lemmas for i, lemmas in zip(w_counts, w) if i == 1]
+                sents_2t = [lemmas for i, lemmas in zip(w_counts, w) if i == 2]
+                sents_3t = [lemmas for i, lemmas in zip(w_counts, w) if i == 3]
                 sents_to_learn = []
                 sents_to_learn.extend(random.sample(sents_1t, int(len(sents_1t) * learning_rate)))
                 sents_to_learn.extend(random.sample(sents_2t, int(len(sents_2t) * learning_rate**2)))
                 sents_to_learn.extend(random.sample(sents_3t, int(len(sents_3t) * learning_rate**3)))
                 words_to_learn = list(itertools.chain(
-                    *[self.getTargets(sentence, known_words) for sentence in sents_to_learn]))
+                    *[self.getTargets(lemmas, known_words) for lemmas in sents_to_learn]))
                 learned_words.update(words_to_learn)
                 known_words.update(words_to_learn)
 
@@ -410,22 +413,10 @@ class BookAnalyzer(QDialog):
             logger.debug(f"Categorization done in { time.time() - start } seconds.")
         return sentence_target_counts
 
-    def getTargets(self, sentence, known_words=None):
+    def getTargets(self, lemmas, known_words=None):
         if not known_words:
             known_words = self.known_words
-        targets = [
-            lem_word(word, self.langcode)
-            for word in sentence.split()
-            if lem_word(word, self.langcode) not in known_words
-        ]
-        return targets
-
-    def countTargets3(self, sentence, known_words=None):
-        if not known_words:
-            known_words = self.known_words
-        targets = [
-            lem_word(word, self.langcode)
-            for word in sentence.split()
-            if lem_word(word, self.langcode) not in known_words
-        ]
-        return min(len(targets), 3)
+        return [lemma for lemma in lemmas if lemma not in known_words]
+
+    def countTargets3(self, lemmas, known_words=None):
+        return min(len(self.getTargets(lemmas, known_words)), 3)
@@ -0,0 +1,131 @@
+"""
+Client for AnkiConnect
+
+Requests of each thread go through one keep-alive session, so that only the first
+request to a server pays for opening a connection. Several actions can be sent in
+a single request with multi(). The time taken by each action is recorded, see
+AnkiConnect.stats.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+import requests
+from loguru import logger
+
+API_VERSION = 6
+
+
+class AnkiConnectError(Exception):
+    "Error returned by AnkiConnect for an action"
+
+
+@dataclass
+class ActionStats:
+    "Timing of the requests made for one action"
+    calls: int = 0
+    errors: int = 0
+    total: float = 0.0  # seconds
+    slowest: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+
+def request(action: str, **params) -> dict:
+    return {'action': action, 'params': params, 'version': API_VERSION}
+
+
+def _result(response: Any) -> Any:
+    "Check the response to one action and return its result"
+    if not isinstance(response, dict) or len(response) != 2:
+        raise AnkiConnectError('response has an unexpected number of fields')
+    if 'error' not in response:
+        raise AnkiConnectError('response is missing required error field')
+    if 'result' not in response:
+        raise AnkiConnectError('response is missing required result field')
+    if response['error'] is not None:
+        raise AnkiConnectError(response['error'])
+    return response['result']
+
+
+class AnkiConnect():
+    def __init__(self, server: str, timeout: Optional[float] = None) -> None:
+        self.server = server
+        self.timeout = timeout
+        self.stats: dict[str, ActionStats] = {}
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        "Session of the calling thread"
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _post(self, name: str, payload: dict) -> Any:
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.post(self.server, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                stats = self.stats.setdefault(name, ActionStats())
+                stats.calls += 1
+                stats.errors += failed
+                stats.total += elapsed
+                stats.slowest = max(stats.slowest, elapsed)
+
+    def invoke(self, action: str, **params) -> Any:
+        "Perform one action and return its result. Raises AnkiConnectError if it failed"
+        try:
+            return _result(self._post(action, request(action, **params)))
+        except AnkiConnectError:
+            with self._stats_lock:
+                self.stats[action].errors += 1
+            raise
+
+    def multi(self, actions: list[dict]) -> list[Any]:
+        """Perform several actions, made with request(), in one round trip
+        Returns the result of each action, or an AnkiConnectError for those that failed"""
+        if not actions:
+            return []
+        name = "multi(" + ",".join(sorted({action['action'] for action in actions})) + ")"
+        responses = _result(self._post(name, request("multi", actions=actions)))
+        results: list[Any] = []
+        for response in responses:
+            try:
+                results.append(_result(response))
+            except AnkiConnectError as e:
+                results.append(e)
+        return results
+
+    def summary(self) -> str:
+        "Timing of all actions so far, slowest in total first"
+        with self._stats_lock:
+            items = sorted(self.stats.items(), key=lambda item: item[1].total, reverse=True)
+        return "\n".join(
+            f"{name}: {stats.calls} calls, {stats.errors} errors, {stats.total:.3f} s total, "
+            f"{stats.mean * 1000:.1f} ms mean, {stats.slowest * 1000:.1f} ms slowest"
+            for name, stats in items)
+
+
+_clients: dict[str, AnkiConnect] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(server: str) -> AnkiConnect:
+    "Shared client of a server"
+    with _clients_lock:
+        if server not in _clients:
+            logger.debug(f"Connecting to AnkiConnect at {server}")
+            _clients[server] = AnkiConnect(server)
+        return _clients[server]
@@ -0,0 +1,125 @@
+"""
+Compiled read-only dictionary files
+
+A compiled dictionary is a single file that is memory-mapped and searched in place:
+
+    header   magic, number of entries
+    index    one fixed-size record per headword, sorted by UTF-8 bytes of the headword:
+             offset into the data section, headword length, compressed definition length
+    data     headword followed by its zlib-compressed definition, for every entry
+
+Lookups are a binary search over the index, so nothing has to be loaded up front.
+A file has to be closed before it can be replaced or removed on Windows.
+"""
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Callable, Iterable, Optional
+
+MAGIC = b"VSDICT01"
+HEADER = struct.Struct("<8sQ")  # magic, number of entries
+RECORD = struct.Struct("<QII")  # data offset, headword length, definition length
+
+
+class DictionaryClosedError(Exception):
+    "Raised by lookups in a compiled dictionary that was closed"
+
+
+def write_compiled(path: str, entries: Iterable[tuple[str, str]], n_entries: int,
+                   replace: Callable[[str, str], None] = os.replace) -> None:
+    """
+    Write a compiled dictionary file
+    entries must be sorted by headword in binary (UTF-8 byte) order, without duplicates
+    The file is written next to path and moved into place with replace when complete
+    """
+    tmp_path = path + ".tmp"
+    index = bytearray()
+    data_start = HEADER.size + n_entries * RECORD.size
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, n_entries))
+        f.seek(data_start)
+        offset = data_start
+        count = 0
+        previous = b""
+        for word, definition in entries:
+            key = word.encode("utf-8")
+            if count and key <= previous:
+                raise ValueError(f"Entries are not sorted at {word}")
+            value = zlib.compress(definition.encode("utf-8"))
+            index += RECORD.pack(offset, len(key), len(value))
+            f.write(key)
+            f.write(value)
+            offset += len(key) + len(value)
+            previous = key
+            count += 1
+        if count != n_entries:
+            raise ValueError(f"Expected {n_entries} entries, got {count}")
+        f.seek(HEADER.size)
+        f.write(index)
+    replace(tmp_path, path)
+
+
+class CompiledDictionary():
+    """A memory-mapped compiled dictionary file
+    Lookups may run on several threads, close waits for those in progress"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._readers = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_entries = HEADER.unpack_from(self.mm, 0)
+        self.n_entries = int(n_entries)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{path} is not a compiled dictionary")
+
+    def __len__(self) -> int:
+        return self.n_entries
+
+    def _find(self, key: bytes) -> Optional[tuple[int, int, int]]:
+        "Binary search for a headword, returns its index record if found"
+        mm = self.mm
+        lo, hi = 0, self.n_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = RECORD.unpack_from(mm, HEADER.size + mid * RECORD.size)
+            offset, key_len, _ = record
+            current = mm[offset:offset + key_len]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return record
+        return None
+
+    def lookup(self, word: str) -> Optional[str]:
+        """Get the definition of a headword, or None if it is not in the dictionary
+        Raises DictionaryClosedError if the dictionary was closed"""
+        with self._cond:
+            if self._closed:
+                raise DictionaryClosedError(f"{self.path} is closed")
+            self._readers += 1
+        try:
+            record = self._find(word.encode("utf-8"))
+            if record is None:
+                return None
+            offset, key_len, value_len = record
+            start = offset + key_len
+            return zlib.decompress(self.mm[start:start + value_len]).decode("utf-8")
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self._cond.notify_all()
+
+    def close(self) -> None:
+        "Unmap the file once the lookups in progress are done, later lookups raise DictionaryClosedError"
+        with self._cond:
+            self._closed = True
+            self._cond.wait_for(lambda: self._readers == 0)
+            self.mm.close()
@@ -1,5 +1,5 @@
-from typing import TYPE_CHECKING
-from PyQt5.QtWidgets import QDialog, QTreeWidget, QPushButton, QStatusBar, QVBoxLayout, QLabel, QFileDialog, QMessageBox, QTreeWidgetItem, QLineEdit, QComboBox, QFormLayout
+from typing import TYPE_CHECKING, Optional
+from PyQt5.QtWidgets import QDialog, QTreeWidget, QPushButton, QStatusBar, QVBoxLayout, QLabel, QFileDialog, QMessageBox, QTreeWidgetItem, QLineEdit, QComboBox, QFormLayout, QCheckBox
 from PyQt5.QtCore import QDateTime, QCoreApplication, QStandardPaths, QUrl
 from PyQt5.QtGui import QDesktopServices
 import time
@@ -10,6 +10,7 @@ import json
 from ..tools import profile
 from ..global_names import settings
 from ..local_dictionary import dictdb
+from ..dict_rebuild import rebuild, DictProgress
 if TYPE_CHECKING:
     from .general_tab import GeneralTab
 
@@ -41,12 +42,25 @@ class DictManager(QDialog):
         self.remove.clicked.connect(self.onRemove)
         self.rebuild = QPushButton("Rebuild dictionary database")
         self.rebuild.setToolTip("""\
-This will regenerate the database containing dictionary entries.
-This program stores all dictionary entries in a single database to
+This will reimport dictionaries whose files have changed since they were imported.
+This program stores all dictionary entries in a database to
 improve performance during lookups. The files must be in their original location
 to be reimported, otherwise this operation will fail.\
         """)
         self.rebuild.clicked.connect(self.rebuildDB)
+        self.compress = QPushButton("Compress dictionary database")
+        self.compress.setToolTip("""\
+Compress dictionaries that were imported before VocabSieve compressed definitions.
+Newly imported dictionaries are always compressed.\
+        """)
+        self.compress.clicked.connect(self.compressDB)
+        self.compile = QCheckBox("Compile dictionaries for faster lookups")
+        self.compile.setToolTip("""\
+Keep a compiled copy of each dictionary that can be searched without going
+through the database. This uses additional disk space.\
+        """)
+        self.compile.setChecked(settings.value("compile_dicts", False, type=bool))
+        self.compile.toggled.connect(self.onCompileToggled)
         self.status_bar = QStatusBar()
 
     def setupWidgets(self):
@@ -63,34 +77,27 @@ to be reimported, otherwise this operation will fail.\
         self._layout.addWidget(self.add_audio)
         self._layout.addWidget(self.remove)
         self._layout.addWidget(self.rebuild)
+        self._layout.addWidget(self.compress)
+        self._layout.addWidget(self.compile)
         self._layout.addWidget(self.status_bar)
 
     def rebuildDB(self):
-        start = time.time()
         dicts = json.loads(settings.value("custom_dicts", '[]'))
-        dictdb.purge()
-        n_dicts = len(dicts)
-        failed_reads = []
-        failed_errors = []
-        for (i, item) in enumerate(dicts):
-            try:
-                self.status(f"Rebuilding database: dictionary ({i+1}/{n_dicts})"
-                            ".. this can take a while.")
-                QCoreApplication.processEvents()
-                dictdb.dictimport(item['path'], item['type'], item['lang'], item['name'])
-            except Exception as e:
-                # Delete dictionary if read fails
-                failed_reads.append(item['name'])
-                failed_errors.append("\tError:" + repr(e))
-                del dicts[i]
-                settings.setValue("custom_dicts", json.dumps(dicts))
-        dictdb.makeIndex()
-        failures = [name + ": Error: " + error for name, error in zip(failed_reads, failed_errors)]
+        result = rebuild(dictdb, dicts, progress=self.onRebuildProgress)
+        if result.failed:
+            # Delete dictionaries that could not be read
+            dicts = [item for item in dicts if item['name'] not in result.failed]
+            settings.setValue("custom_dicts", json.dumps(dicts))
+        failures = [name + ": Error: " + error for name, error in result.failed.items()]
         failed_msg = ("\nThe following dictionaries could not be imported, and have been removed: \n"
                       + "\n\t".join(failures) if failures else "")
 
+        self.compileDicts([item for item in dicts if item['name'] in result.imported])
         QMessageBox.information(self, "Database rebuilt",
-                                f"Database rebuilt in {format(time.time()-start, '.3f')} seconds.{failed_msg}")
+                                f"Database rebuilt in {format(result.elapsed, '.3f')} seconds, "
+                                f"{len(result.imported)} of {len(dicts)} dictionaries reimported, "
+                                f"{len(result.skipped)} unchanged "
+                                f"({result.n_rows} entries, {result.rate:.0f} entries/s).{failed_msg}")
         self.refresh()
         self.showStats()
 
@@ -129,6 +136,61 @@ to be reimported, otherwise this operation will fail.\
         self.refresh()
         self.showStats()
 
+    def compressDB(self):
+        start = time.time()
+
+        def onProgress(done: int, total: int) -> None:
+            self.status(f"Compressing database: dictionary ({done}/{total}).. this can take a while.")
+            QCoreApplication.processEvents()
+
+        size_before, size_after = dictdb.compressExisting(progress=onProgress)
+        QMessageBox.information(self, "Database compressed",
+                                f"Database compressed in {format(time.time()-start, '.3f')} seconds, "
+                                f"from {size_before / 2**20:.1f} MiB to {size_after / 2**20:.1f} MiB.")
+        self.showStats()
+
+    def onCompileToggled(self, checked: bool) -> None:
+        settings.setValue("compile_dicts", checked)
+        dicts = json.loads(settings.value("custom_dicts", '[]'))
+        if checked:
+            self.compileDicts(dicts)
+        else:
+            for item in dicts:
+                dictdb.removeCompiled(item['name'])
+            self.status("Removed compiled dictionaries")
+
+    def compileDicts(self, dicts: list[dict]) -> None:
+        "Compile dictionaries if enabled. Only dictionaries used for definitions are compiled"
+        if not settings.value("compile_dicts", False, type=bool):
+            return
+        for item in dicts:
+            if item['type'] in ("freq", "audiolib", "cognates"):
+                continue
+            self.status(f"Compiling {item['name']}..")
+            QCoreApplication.processEvents()
+            dictdb.compileDictionary(item['lang'], item['name'])
+        self.status("Compiling done.")
+
+    def onRebuildProgress(self, states: list[DictProgress], eta: Optional[float]) -> None:
+        n_done = sum(state.state in ("done", "failed") for state in states)
+        parts = []
+        for state in states:
+            if state.state != "importing":
+                continue
+            part = f"{state.name}: {state.rows} entries"
+            if state.total:
+                part += f", {state.fraction:.0%}"
+            if (dict_eta := state.eta) is not None:
+                part += f", {dict_eta:.0f}s left"
+            parts.append(part)
+        msg = f"Rebuilding database: {n_done}/{len(states)} dictionaries done"
+        if eta is not None:
+            msg += f", about {eta:.0f}s left"
+        if parts:
+            msg += " | " + "; ".join(parts)
+        self.status(msg)
+        QCoreApplication.processEvents()
+
     @profile
     def refresh(self):
         dicts = json.loads(settings.value("custom_dicts", '[]'))
@@ -239,11 +301,14 @@ class AddDictDialog(QDialog):
             )
             return
 
-        dictdb.dictimport(
+        start = time.time()
+        n_entries = dictdb.dictimport(
             self.path,
             supported_dict_formats.inverse[self.type.currentText()],
             lang,
-            self.name.text())
+            self.name.text(),
+            progress=self.onProgress)
+        elapsed = time.time() - start
         dicts.append({"name": self.name.text(),
                       "type": supported_dict_formats.inverse[self.type.currentText()],
                       "path": self.path,
@@ -251,11 +316,17 @@ class AddDictDialog(QDialog):
                       })
         settings.setValue("custom_dicts", json.dumps(dicts))
         self.parent.status(f"Importing {self.name.text()} to database..")
+        self.parent.compileDicts(dicts[-1:])
         self.parent.refresh()
-        self.parent.status("Importing done.")
+        self.parent.status(f"Importing done: {n_entries} entries in {elapsed:.2f} seconds "
+                           f"({n_entries / elapsed if elapsed else 0:.0f} entries/s).")
         self.parent.showStats()
         self.close()
 
+    def onProgress(self, done: int, total: int) -> None:
+        self.parent.status(f"Importing {self.name.text()} to database.. {done * 100 // max(total, 1)}%")
+        QCoreApplication.processEvents()
+
     def warn(self, text):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Warning)
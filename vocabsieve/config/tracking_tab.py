@@ -69,11 +69,10 @@ class TrackingTab(BaseTab):
             try:
                 api = settings.value('anki_api', 'http://127.0.0.1:8765')
                 query_mature = self.anki_query_mature.text()
-                mature_notes = findNotes(api, query_mature)
+                mature_notes = set(findNotes(api, query_mature))
                 self.mature_count_label.setText(f"Matched {str(len(mature_notes))} notes")
                 query_young = self.anki_query_young.text()
-                young_notes = findNotes(api, query_young)
-                young_notes = [note for note in young_notes if note not in mature_notes]
+                young_notes = set(findNotes(api, query_young)) - mature_notes
                 self.young_count_label.setText(f"Matched {str(len(young_notes))} notes")
             except Exception as e:
                 logger.exception("Error while trying to find notes in Anki: " + repr(e))
@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+import weakref
+from loguru import logger
+
+
+class _Reader():
+    """Holds the read connection of one thread.
+    It is closed when the thread exits and its thread-local storage is released"""
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+
+    def __del__(self) -> None:
+        self.conn.close()
+
+
+class ConnectionPool():
+    """SQLite connections to one database file that can be shared between threads.
+    Every thread gets its own read-only connection, while all writes go through
+    a single connection that is serialized by a lock. The database is switched
+    to WAL mode, so readers do not block the writer and vice versa.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.writer = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        journal_mode = self.writer.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if journal_mode != "wal":
+            logger.warning(f"Could not enable WAL mode for {path}, using {journal_mode}")
+        self.writer.execute("PRAGMA synchronous=NORMAL")
+        self._local = threading.local()
+        self._readers: weakref.WeakSet[_Reader] = weakref.WeakSet()
+
+    def reader(self) -> sqlite3.Connection:
+        "Get the read connection for the calling thread, opening it if needed"
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            reader = _Reader(sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False))
+            reader.conn.execute("PRAGMA query_only=ON")
+            self._local.reader = reader
+            self._readers.add(reader)
+        return reader.conn
+
+    def cursor(self) -> sqlite3.Cursor:
+        "Get a new cursor on the read connection of the calling thread"
+        return self.reader().cursor()
+
+    def close(self) -> None:
+        with self.lock:
+            for reader in list(self._readers):
+                reader.conn.close()
+            self.writer.close()
@@ -58,12 +58,12 @@ class ContentManager(QDialog):
     def refresh(self):
         self.tview.clear()
         langcode = settings.value("target_language", 'en')
-        items = list(self.rec.getContents(langcode))
-        items = sorted(items, key=itemgetter(2), reverse=True)
+        items = list(self.rec.getContentsInfo(langcode))
+        items = sorted(items, key=itemgetter(1), reverse=True)
 
-        for name, content, jd in items:
+        for name, jd, n_words in items:
             treeitem = QTreeWidgetItem([name, QDate.fromJulianDay(
-                jd).toString("yyyy-MM-dd"), str(len(content.split()))])
+                jd).toString("yyyy-MM-dd"), str(n_words)])
             self.tview.addTopLevelItem(treeitem)
         for i in range(3):
             self.tview.resizeColumnToContents(i)
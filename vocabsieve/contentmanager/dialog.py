@@ -1,5 +1,5 @@
 from PyQt5.QtWidgets import QDialog, QLineEdit, QComboBox, QPushButton, QDateEdit, QFormLayout, QLabel
-from PyQt5.QtCore import QDate
+from PyQt5.QtCore import QDate, QCoreApplication
 from bidict import bidict
 from ..dictionary import langs_supported, langcodes
 import os
@@ -89,11 +89,18 @@ class AddContentDialog(QDialog):
         else:
             raise NotImplementedError(f"{self.contenttype} not supported")
 
+        self.parent.status(f"Lemmatizing {self.name.text()}..")
+        QCoreApplication.processEvents()
         self.parent.rec.importContent(
             self.name.text(),
             content,
             langcodes.inverse[self.lang.currentText()],
-            self.date.date().toJulianDay()
+            self.date.date().toJulianDay(),
+            progress=self.onProgress
         )
         self.parent.refresh()
         self.close()
+
+    def onProgress(self, done: int, total: int) -> None:
+        self.parent.status(f"Lemmatizing {self.name.text()}.. {done * 100 // max(total, 1)}%")
+        QCoreApplication.processEvents()
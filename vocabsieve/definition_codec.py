@@ -0,0 +1,69 @@
+"""
+Compression of dictionary definitions
+
+Definitions are compressed one by one with raw deflate, primed with a preset
+dictionary trained on a sample of the same dictionary. Entries of one dictionary
+share a lot of markup and phrasing, so this works far better than compressing
+each definition on its own, while every row can still be decompressed separately.
+"""
+import re
+import zlib
+from collections import Counter
+from typing import Iterable
+
+# Deflate can only refer back 32 KiB, anything longer is wasted
+ZDICT_SIZE = 32768
+COMPRESS_LEVEL = 6
+# Definitions are short, a smaller hash table compresses as well and is much cheaper to copy
+COMPRESS_MEMLEVEL = 5
+# Definitions shorter than this are stored as text, compression would not save anything
+COMPRESS_MIN_LENGTH = 64
+# Tags, and words with the whitespace that follows them
+ZDICT_TOKEN_RE = re.compile(r"<[^<>]{0,200}>|[^<>\s]+\s?")
+
+
+def train_zdict(samples: Iterable[str], size: int = ZDICT_SIZE) -> bytes:
+    """
+    Build a preset dictionary from sample definitions
+    Fragments are ranked by how many bytes they would save. The most valuable ones
+    go last, since deflate encodes matches at shorter distances more cheaply
+    """
+    counts = Counter(token for sample in samples for token in ZDICT_TOKEN_RE.findall(sample))
+    ranked = sorted(
+        ((len(token.encode("utf-8")) * count, token) for token, count in counts.items() if count > 1),
+        reverse=True)
+    parts: list[bytes] = []
+    total = 0
+    for _, token in ranked:
+        encoded = token.encode("utf-8")
+        if total + len(encoded) > size:
+            continue
+        parts.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(parts))
+
+
+class DefinitionCodec():
+    """Compresses and decompresses definitions of one dictionary.
+    Compressed definitions are bytes, definitions that were not worth compressing stay str"""
+
+    def __init__(self, zdict: bytes) -> None:
+        self.zdict = zdict
+        # Priming the window with the dictionary is the expensive part, so do it once and copy
+        self._compressor = zlib.compressobj(
+            COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, COMPRESS_MEMLEVEL, zdict=zdict)
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=zdict)
+
+    def encode(self, definition: str) -> str | bytes:
+        data = definition.encode("utf-8")
+        if len(data) < COMPRESS_MIN_LENGTH:
+            return definition
+        compressor = self._compressor.copy()
+        blob = compressor.compress(data) + compressor.flush()
+        return blob if len(blob) < len(data) else definition
+
+    def decode(self, value: str | bytes) -> str:
+        if isinstance(value, bytes):
+            decompressor = self._decompressor.copy()
+            return (decompressor.decompress(value) + decompressor.flush()).decode("utf-8")
+        return str(value)
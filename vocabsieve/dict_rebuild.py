@@ -0,0 +1,261 @@
+"""
+Parallel rebuild of the dictionary database
+
+Source files are parsed in worker processes, which send their entries in chunks
+to the calling process. There a single writer inserts them, as SQLite only allows
+one writer at a time anyway. Dictionaries whose source files did not change since
+they were last imported are skipped. When only one dictionary changed, it is imported
+directly, so that parsers with a process pool of their own can use every core.
+
+Workers only import the parsers, so this module must not import anything that
+touches Qt or the database at module level.
+"""
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import TYPE_CHECKING, Any, Callable, Optional
+from loguru import logger
+from .dictformats import parse_dictionary, source_files, source_fingerprint
+if TYPE_CHECKING:
+    from .local_dictionary import LocalDictionary
+
+# Number of entries sent from a worker to the writer at a time
+REBUILD_CHUNK_SIZE = 5000
+# Chunks that may be waiting for the writer per worker, bounds memory use
+# when parsing is faster than inserting
+QUEUE_CHUNKS_PER_WORKER = 4
+
+# Messages sent by workers
+ROWS = "rows"
+PROGRESS = "progress"
+DONE = "done"
+FAILED = "failed"
+
+_queue: Any = None
+
+
+def _init_worker(q) -> None:
+    global _queue
+    _queue = q
+
+
+def _parse_worker(index: int, path: str, dicttype: str, lang: str, chunk_size: int, processes: int) -> None:
+    """Parse one dictionary and send its entries to the writer
+    processes is the share of the process budget for parsers that use a pool of their own"""
+    def progress(done: int, total: int) -> None:
+        _queue.put((PROGRESS, index, (done, total)))
+
+    try:
+        for lang_, entries in parse_dictionary(path, dicttype, lang, progress=progress, processes=processes):
+            entries = iter(entries)
+            while chunk := list(islice(entries, chunk_size)):
+                _queue.put((ROWS, index, (lang_, chunk)))
+    except Exception as e:
+        _queue.put((FAILED, index, repr(e)))
+    else:
+        _queue.put((DONE, index, None))
+
+
+@dataclass
+class DictProgress:
+    "Progress of one dictionary during a rebuild"
+    name: str
+    size: int  # bytes of source files
+    state: str = "queued"  # queued, importing, done or failed
+    rows: int = 0
+    done: int = 0  # bytes parsed, only for formats that report it
+    total: int = 0
+    started: Optional[float] = None
+    error: str = ""
+
+    @property
+    def fraction(self) -> float:
+        if self.state in ("done", "failed"):
+            return 1.0
+        if self.total:
+            return self.done / self.total
+        return 0.0
+
+    @property
+    def eta(self) -> Optional[float]:
+        "Estimated seconds until this dictionary is parsed, if it can be known"
+        if self.started is None or not 0 < self.fraction < 1:
+            return None
+        return (time.time() - self.started) * (1 - self.fraction) / self.fraction
+
+
+@dataclass
+class RebuildResult:
+    imported: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    n_rows: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        "Throughput of the rebuild in rows per second"
+        return self.n_rows / self.elapsed if self.elapsed else 0.0
+
+
+def overall_eta(states: list[DictProgress], start: float) -> Optional[float]:
+    "Estimated seconds until the whole rebuild is done, going by source bytes processed"
+    total = sum(state.size for state in states)
+    done = sum(state.size * state.fraction for state in states)
+    if not total or not done:
+        return None
+    return (time.time() - start) * (total - done) / done
+
+
+def _source_size(item: dict) -> int:
+    try:
+        return source_fingerprint(source_files(item['path'], item['type']))[0]
+    except OSError:
+        return 0
+
+
+def _rebuild_one(db: "LocalDictionary", item: dict, state: DictProgress, processes: int,
+                 result: RebuildResult, report: Callable[[], None]) -> None:
+    """Import a single dictionary in this process
+    Parsers that have a pool of their own get the whole process budget, and entries are
+    not passed through another process on their way to the database"""
+    def progress(done: int, total: int) -> None:
+        state.done, state.total = done, total
+        report()
+
+    state.started = time.time()
+    state.state = "importing"
+    report()
+    try:
+        with db.bulkImport():
+            state.rows = db.dictimport(item['path'], item['type'], item['lang'], item['name'],
+                                       progress, processes=processes)
+    except Exception as e:
+        logger.error(f"Failed to import {state.name}: {repr(e)}")
+        state.state = "failed"
+        state.error = repr(e)
+        result.failed[state.name] = state.error
+    else:
+        state.state = "done"
+        result.imported.append(state.name)
+        result.n_rows += state.rows
+    report()
+
+
+def rebuild(db: "LocalDictionary",
+            dicts: list[dict],
+            processes: Optional[int] = None,
+            progress: Optional[Callable[[list[DictProgress], Optional[float]], None]] = None,
+            chunk_size: int = REBUILD_CHUNK_SIZE) -> RebuildResult:
+    """
+    Bring the database in line with a list of dictionaries (as stored in custom_dicts)
+    Dictionaries that are no longer listed are deleted, unchanged ones are skipped,
+    the rest are reimported in parallel. Failed dictionaries are left out of the database.
+    progress is called with the state of every dictionary being imported and the overall ETA
+    """
+    start = time.time()
+    result = RebuildResult()
+    names = {item['name'] for item in dicts}
+    for name in db.getDictNames():
+        if name not in names:
+            db.deletedict(name)
+    changed = []
+    for item in dicts:
+        if db.isUnchanged(item['name'], item['path'], item['type'], item['lang']):
+            result.skipped.append(item['name'])
+        else:
+            db.deletedict(item['name'])
+            changed.append(item)
+    if not changed:
+        result.elapsed = time.time() - start
+        return result
+
+    states = [DictProgress(item['name'], _source_size(item)) for item in changed]
+    budget = processes or os.cpu_count() or 1
+
+    def report() -> None:
+        if progress is not None:
+            progress(states, overall_eta(states, start))
+
+    if len(changed) == 1:
+        _rebuild_one(db, changed[0], states[0], budget, result, report)
+        result.elapsed = time.time() - start
+        return result
+    processes = max(1, min(budget, len(changed)))
+    # Spawn rather than fork: the caller runs Qt and other threads, and a forked worker
+    # can be left stuck on a lock one of them held
+    ctx = multiprocessing.get_context("spawn")
+    q = ctx.Queue(maxsize=QUEUE_CHUNKS_PER_WORKER * processes)
+    logger.info(f"Rebuilding {len(changed)} dictionaries with {processes} processes, "
+                f"{len(result.skipped)} unchanged")
+
+    with db.bulkImport() as importer, \
+            ProcessPoolExecutor(processes, mp_context=ctx, initializer=_init_worker, initargs=(q,)) as executor:
+        futures: dict[Future, int] = {
+            executor.submit(_parse_worker, i, item['path'], item['type'], item['lang'], chunk_size,
+                            max(1, budget // len(changed))): i
+            for i, item in enumerate(changed)}
+
+        def fail(i: int, error: str) -> None:
+            state = states[i]
+            if state.state in ("done", "failed"):
+                return
+            logger.error(f"Failed to import {state.name}: {error}")
+            importer.discard(state.name)
+            result.n_rows -= state.rows
+            state.state = "failed"
+            state.error = error
+            result.failed[state.name] = error
+
+        try:
+            while any(state.state not in ("done", "failed") for state in states):
+                try:
+                    kind, i, payload = q.get(timeout=0.1)
+                except queue.Empty:
+                    # Workers report their own errors, this only happens if the pool broke
+                    for future, i in futures.items():
+                        if future.done() and future.exception() is not None:
+                            fail(i, repr(future.exception()))
+                    report()
+                    continue
+                state = states[i]
+                if state.state == "failed":
+                    continue
+                if state.started is None:
+                    state.started = time.time()
+                    state.state = "importing"
+                if kind == ROWS:
+                    lang, chunk = payload
+                    try:
+                        count = importer.add(chunk, lang, state.name)
+                    except Exception as e:
+                        fail(i, repr(e))
+                    else:
+                        state.rows += count
+                        result.n_rows += count
+                elif kind == PROGRESS:
+                    state.done, state.total = payload
+                elif kind == DONE:
+                    db.recordSource(state.name, changed[i]['path'], changed[i]['type'], changed[i]['lang'])
+                    state.state = "done"
+                    result.imported.append(state.name)
+                elif kind == FAILED:
+                    fail(i, payload)
+                report()
+        finally:
+            # Workers block while the queue is full, keep draining until they exit
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+    result.elapsed = time.time() - start
+    logger.info(f"Rebuilt {len(result.imported)} dictionaries in {result.elapsed:.2f} seconds, "
+                f"{result.n_rows} rows ({result.rate:.0f} rows/s), {len(result.failed)} failed")
+    return result
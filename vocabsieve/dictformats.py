@@ -1,16 +1,22 @@
-from typing import TextIO
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, TextIO
 from loguru import logger
 from readmdict import MDX
 from bidict import bidict
 import os
 import re
+import glob
+import hashlib
 import lzma
 import gzip
 import bz2
 import csv
 import json
+from collections import deque
 from itertools import groupby
+import multiprocessing
 from operator import itemgetter
+from pystardict import Dictionary
+from .lemmatizer import removeAccents
 
 
 supported_dict_formats = bidict({
@@ -42,6 +48,17 @@ def zopen(path) -> TextIO:
     return open(path, 'rt', encoding='utf-8')  # type:ignore
 
 
+def zopen_binary(raw: BinaryIO, path: str) -> BinaryIO:
+    "Wrap an already opened binary file in the decompressor matching its suffix"
+    if path.endswith('.xz'):
+        return lzma.open(raw, 'rb')  # type:ignore
+    if path.endswith('.gz'):
+        return gzip.open(raw, 'rb')  # type:ignore
+    if path.endswith('.bz2'):
+        return bz2.open(raw, 'rb')  # type:ignore
+    return raw
+
+
 def dslopen(path) -> TextIO:
     "Open dsl. Can be .dsl or .dsl.dz. Can be UTF-8 or UTF-16"
     correct_encoding = ""
@@ -131,7 +148,16 @@ def dictinfo(path) -> dict[str, str]:
         raise NotImplementedError("Unsupported format" + basename + ext)
 
 
-def parseMDX(path) -> dict[str, str]:
+MDX_STYLE_RE = re.compile(r'`(\d+)`')
+DSL_TRANSLATION = str.maketrans({"[": "<", "]": ">", "\\": "/"})
+DSL_INDENT_RE = re.compile(r'<m([0-3])>')
+DSL_TAG_RE = re.compile('<[^<]+?>')
+DSL_NUMBERING_RE = re.compile(r'(\d+\.)<br>\s*(\D+)')
+
+
+def parseMDX(path) -> Iterator[tuple[str, str]]:
+    """Parse MDX dictionary, yielding (headword, definition) pairs.
+    Consecutive entries with the same headword are merged"""
     mdx = MDX(path)
     stylesheet_lines = mdx.header[b'StyleSheet'].decode().splitlines()
     stylesheet_map: dict[int, str] = {}
@@ -139,69 +165,62 @@ def parseMDX(path) -> dict[str, str]:
         if line.isnumeric():
             number = int(line)
             stylesheet_map[number] = stylesheet_map.get(number, "") + line
-    newdict: dict[str, str] = {}  # This temporarily stores the new entries
     prev_headword = ""
+    prev_entry = ""
     for item in mdx.items():
         headword_bytes, entry_bytes = item
         headword = headword_bytes.decode()
         entry = entry_bytes.decode()  # type: ignore
         # The following applies the stylesheet
         if stylesheet_map:
-            entry = re.sub(
-                r'`(\d+)`',
+            entry = MDX_STYLE_RE.sub(
                 lambda g: stylesheet_map.get(int(g.group().strip('`'))),  # type:ignore
                 entry
             )
         entry = entry.replace("\n", "").replace("\r", "")
-        # Using newdict.get would become incredibly slow,
-        # here we exploit the fact that they are alphabetically ordered
+        # Entries are alphabetically ordered, so duplicates are always adjacent
         if prev_headword == headword:
-            newdict[headword] = newdict[headword] + entry
+            prev_entry += entry
         else:
-            newdict[headword] = entry
-        prev_headword = headword
-    return newdict
+            if prev_headword:
+                yield prev_headword, prev_entry
+            prev_headword, prev_entry = headword, entry
+    if prev_headword:
+        yield prev_headword, prev_entry
 
 
-def parseDSL(path) -> dict[str, str]:
+def dsl_clean_line(line: str) -> str:
+    "Convert DSL markup in a single line into plain text, keeping indentation"
+    line = line.translate(DSL_TRANSLATION)
+    line = line.replace("{{", "<").replace("}}", ">")
+    line = DSL_INDENT_RE.sub(lambda m: "  " * int(m.group(1)), line)
+    line = DSL_TAG_RE.sub('', line)
+    return line.replace("&quot;", '"').replace("{}", "")
+
+
+def parseDSL(path) -> Iterator[tuple[str, str]]:
     """Parse Lingvo DSL dictionary
-    This produces much simpler markup than the pyglossary implementation
+    This produces much simpler markup than the pyglossary implementation.
+    Lines are processed one at a time, so only the current entry is held in memory
     """
-    with dslopen(path) as f:  # type:ignore
-        lines: list[str] = f.readlines()  # type:ignore
-    allLines = "".join(lines[5:])
-    allLines = allLines.replace("[", "<")
-    allLines = allLines.replace("]", ">")
-    allLines = allLines.replace("{{", "<")
-    allLines = allLines.replace("}}", ">")
-    allLines = allLines.replace("<m0>", "")
-    allLines = allLines.replace("<m1>", "  ")
-    allLines = allLines.replace("<m2>", "    ")
-    allLines = allLines.replace("<m3>", "      ")
-    allLines = allLines.replace("\\", "/")
-
-    allLines = re.sub('<[^<]+?>', '', allLines)
-    allLines = allLines.replace("&quot;", '"')
-    allLines = allLines.replace("{}", "")
-
     current_term = ""
     current_defi = ""
-    data = {}
-    items = []
-    for item in allLines.splitlines():
-        if not item.startswith("#") and not item.startswith("\t") and not item.startswith(" "):
-            data[current_term] = re.sub(r'(\d+\.)<br>\s*(\D+)', r'\1 \2', current_defi)\
-                                   .removesuffix("<br>").strip()
-
-            current_defi = ""
-            current_term = item
-        if item.startswith("\t") or item.startswith(" "):
-            items.append(item)
-            if item.endswith(".wav"):  # Don't include audio file names
+    with dslopen(path) as f:  # type:ignore
+        for n, line in enumerate(f):
+            if n < 5:  # Header
                 continue
-            current_defi += item.lstrip().replace("~", current_term) + "<br>"
-
-    return data
+            item = dsl_clean_line(line.rstrip("\r\n"))
+            if not item.startswith("#") and not item.startswith("\t") and not item.startswith(" "):
+                if current_term:
+                    yield current_term, DSL_NUMBERING_RE.sub(r'\1 \2', current_defi).removesuffix("<br>").strip()
+                current_defi = ""
+                current_term = item
+            if item.startswith("\t") or item.startswith(" "):
+                if item.endswith(".wav"):  # Don't include audio file names
+                    continue
+                current_defi += item.lstrip().replace("~", current_term) + "<br>"
+    if current_term:
+        yield current_term, DSL_NUMBERING_RE.sub(r'\1 \2', current_defi).removesuffix("<br>").strip()
 
 
 def xdxf2text(xdxf_string: str) -> str:
@@ -235,50 +254,153 @@ def xdxf2text(xdxf_string: str) -> str:
     return s.strip()
 
 
-def parseCSV(path) -> dict[str, str]:
-    newdict = {}
+def parseCSV(path) -> Iterator[tuple[str, str]]:
     with open(path, newline="", encoding='utf-8') as csvfile:
-        data = csv.reader(csvfile)
-        for row in data:
-            newdict[row[0]] = row[1]
-    return newdict
+        for row in csv.reader(csvfile):
+            yield row[0], row[1]
 
 
-def parseTSV(path) -> dict[str, str]:
-    newdict = {}
+def parseTSV(path) -> Iterator[tuple[str, str]]:
     with open(path, newline="", encoding='utf-8') as csvfile:
-        data = csv.reader(csvfile, delimiter="\t")
-        for row in data:
-            newdict[row[0]] = row[1]
-    return newdict
+        for row in csv.reader(csvfile, delimiter="\t"):
+            yield row[0], row[1]
+
+
+# Amount of input handed to a worker at once when parsing Kaikki dumps
+KAIKKI_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def kaikki_lang_filter(lang: str) -> Callable[[bytes], bool]:
+    """Cheap check of a raw Kaikki line for the language code, so that entries
+    in other languages are never decoded. It can match lines in other languages too"""
+    needle = f'"lang_code": "{lang}"'.encode()
+    needle_compact = f'"lang_code":"{lang}"'.encode()
+    return lambda line: needle in line or needle_compact in line
+
+
+def kaikki_lines_to_entries(lines: Iterable[bytes], lang: str) -> list[tuple[str, str]]:
+    "Decode and format the Kaikki lines in the given language"
+    may_match = kaikki_lang_filter(lang)
+    entries = []
+    for line in lines:
+        if not may_match(line):
+            continue
+        data = json.loads(line)
+        # The needle could also appear in nested data, so check again
+        if data.get("lang_code") == lang:
+            entries.append((data['word'], kaikki_line_to_textdef(data)))
+    return entries
+
+
+def _kaikki_parse_range(path: str, start: int, end: int, lang: str) -> tuple[int, list[tuple[str, str]]]:
+    "Worker: parse the lines between two byte offsets of an uncompressed dump"
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).splitlines()
+    return end - start, kaikki_lines_to_entries(lines, lang)
+
+
+def _kaikki_parse_lines(lines: list[bytes], n_bytes: int, lang: str) -> tuple[int, list[tuple[str, str]]]:
+    "Worker: parse lines read from a compressed dump"
+    return n_bytes, kaikki_lines_to_entries(lines, lang)
+
+
+def kaikki_byte_ranges(path: str, chunk_size: int = KAIKKI_CHUNK_SIZE) -> list[tuple[int, int]]:
+    "Split an uncompressed file into byte ranges of roughly chunk_size that end on line boundaries"
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()  # Finish the current line
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
 
+def _kaikki_compressed_tasks(path: str, lang: str, chunk_size: int) -> Iterator[tuple]:
+    """Read a compressed dump in batches of lines. Progress is measured on the compressed file
+    Lines in other languages are dropped here rather than sent to the workers"""
+    may_match = kaikki_lang_filter(lang)
+    with open(path, 'rb') as raw:
+        with zopen_binary(raw, path) as f:
+            position = 0
+            while lines := f.readlines(chunk_size):
+                yield [line for line in lines if may_match(line)], raw.tell() - position, lang
+                position = raw.tell()
 
-def parseKaikki(path, lang) -> dict[str, str]:
+
+def parseKaikki(path, lang,
+                processes: Optional[int] = None,
+                progress: Optional[Callable[[int, int], None]] = None) -> Iterator[tuple[str, str]]:
     '''
     Parse a wiktionary dump from Kaikki/Wikiextract
     (https://github.com/tatuylonen/wiktextract)
-    The format is lines of json objects, each containing a word and its definition
+    The format is lines of json objects, each containing a word and its definition.
+    Definitions of consecutive lines with the same headword are combined.
+
+    The file is split into chunks which are decoded and formatted in a process pool.
+    Results are yielded in file order as soon as they are ready.
+    progress is called with (bytes processed, total bytes) after each chunk
     '''
     print("Parsing Kaikki wiktionary dump at " + path)
-    items: list[tuple[str, str]] = []
 
     if path.endswith(".json"):
         logger.warning("Legacy Kaikki JSON dump detected, this may cause issues. New exports have a .jsonl suffix")
 
-    with zopen(path) as f:
-        logger.debug("Parsing Kaikki wiktionary dump at " + path)
-        logger.debug("Only importing entries in language " + lang)
-        for line in f:
-            data = json.loads(line)
-            # Kaikki dumps may have multiple languages, skip others for now
-            if data.get("lang_code") == lang:
-                items.append((data['word'], kaikki_line_to_textdef(data)))
-        logger.debug(f"Found {len(items)} entries")
+    logger.debug("Parsing Kaikki wiktionary dump at " + path)
+    logger.debug("Only importing entries in language " + lang)
+    total = os.path.getsize(path)
+    worker: Callable[..., tuple[int, list[tuple[str, str]]]]
+    tasks: Iterable[tuple]
+    if path.endswith(('.xz', '.gz', '.bz2')):
+        worker = _kaikki_parse_lines
+        tasks = _kaikki_compressed_tasks(path, lang, KAIKKI_CHUNK_SIZE)
+    else:
+        worker = _kaikki_parse_range
+        tasks = ((path, start, end, lang) for start, end in kaikki_byte_ranges(path, KAIKKI_CHUNK_SIZE))
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if total < 2 * KAIKKI_CHUNK_SIZE:
+        processes = 1  # Not worth starting a pool
+    n_entries = 0
+
+    def entries() -> Iterator[tuple[str, str]]:
+        nonlocal n_entries
+        done = 0
+        for n_bytes, chunk in results():
+            n_entries += len(chunk)
+            done += n_bytes
+            if progress is not None:
+                progress(done, total)
+            yield from chunk
+
+    def results() -> Iterator[tuple[int, list[tuple[str, str]]]]:
+        if processes == 1:
+            for task in tasks:
+                yield worker(*task)
+            return
+        # Spawn rather than fork, as callers run Qt and other threads
+        with multiprocessing.get_context("spawn").Pool(processes) as p:
+            # Keep a bounded number of chunks in flight, so that memory use does not
+            # depend on the size of the file. Results are consumed in order.
+            pending: deque = deque()
+            for task in tasks:
+                pending.append(p.apply_async(worker, task))
+                if len(pending) >= 2 * processes:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+
+    n_headwords = 0
     # Combine all definitions for each headword
-    res = dict((word, "\n\n".join([item[1] for item in itr]))
-               for word, itr in groupby(items, itemgetter(0)))
-    logger.debug(f"For {len(res)} headwords")
-    return res
+    for word, itr in groupby(entries(), itemgetter(0)):
+        n_headwords += 1
+        yield word, "\n\n".join(item[1] for item in itr)
+    logger.debug(f"Found {n_entries} entries")
+    logger.debug(f"For {n_headwords} headwords")
 
 
 def kaikki_line_to_textdef(row: dict) -> str:
@@ -307,3 +429,107 @@ def kaikki_line_to_textdef(row: dict) -> str:
                     res += "<br>\n" + str(count) + ". " + defi
                     count += 1
     return res
+
+
+def regularize_headword(word: str) -> str:
+    "If headword is all caps, convert it to all lowercase"
+    return removeAccents(word.lower() if word.isupper() else word)
+
+
+def parse_dictionary(path, dicttype, lang,
+                     progress: Optional[Callable[[int, int], None]] = None,
+                     processes: Optional[int] = None) -> Iterator[tuple[str, Iterable[tuple[str, str]]]]:
+    """
+    Parse a dictionary file of any supported type
+    Yields (language, entries) pairs, only cognates data has more than one language
+    progress is called with (bytes processed, total bytes) for formats that support it
+    """
+    if dicttype == "stardict":
+        stardict = Dictionary(os.path.splitext(path)[0], in_memory=True)
+        if stardict.ifo.sametypesequence == 'x':
+            yield lang, ((regularize_headword(key), xdxf2text(stardict.dict[key])) for key in stardict.idx.keys())
+        else:
+            yield lang, ((regularize_headword(key), stardict.dict[key]) for key in stardict.idx.keys())
+    elif dicttype == "json":
+        with zopen(path) as f:
+            yield lang, json.load(f).items()
+    elif dicttype == "migaku":
+        d: dict[str, str] = {}
+        with zopen(path) as f:
+            data = json.load(f)
+        for item in data:
+            key = regularize_headword(item['term'])
+            if not d.get(key):  # fix for duplicate entries
+                d[key] = item['definition']
+            else:
+                d[key] += "\n" + item['definition']
+        yield lang, d.items()
+    elif dicttype == "wiktdump":
+        yield lang, parseKaikki(path, lang, processes=processes, progress=progress)
+    elif dicttype == "freq":
+        with zopen(path) as f:
+            data = json.load(f)
+        # Ignore proper nouns
+        words = (word for word in data if word and not word[0].isupper())
+        yield lang, ((regularize_headword(word), str(i + 1)) for i, word in enumerate(words))
+    elif dicttype == "audiolib":
+        # Audios will be stored as a serialized json list
+        filelist = []
+        list_d: dict[str, list[str]] = {}
+        for root, _, files in os.walk(path):
+            for item in files:
+                filelist.append(
+                    os.path.relpath(
+                        os.path.join(
+                            root, item), path))
+        for item in filelist:
+            headword = os.path.basename(os.path.splitext(item)[0]).lower()
+            if not list_d.get(headword):
+                list_d[regularize_headword(headword)] = [item]
+            else:
+                list_d[regularize_headword(headword)].append(item)
+        yield lang, ((word, json.dumps(audios)) for word, audios in list_d.items())
+    elif dicttype == 'mdx':
+        yield lang, parseMDX(path)
+    elif dicttype == "dsl":
+        yield lang, parseDSL(path)
+    elif dicttype == "csv":
+        yield lang, parseCSV(path)
+    elif dicttype == "tsv":
+        yield lang, parseTSV(path)
+    elif dicttype == "cognates":
+        with zopen(path) as f:
+            cognates_d: dict[str, dict[str, list[str]]] = json.load(f)
+        for lang_ in cognates_d:
+            yield lang_, ((k, json.dumps(v)) for k, v in cognates_d[lang_].items())
+    else:
+        raise ValueError(f"Unknown dictionary type {dicttype}")
+
+
+def source_files(path: str, dicttype: str) -> list[str]:
+    "Files a dictionary is imported from"
+    if dicttype == "audiolib":
+        return sorted(os.path.join(root, item) for root, _, files in os.walk(path) for item in files)
+    if dicttype == "stardict":
+        # The .ifo file is what gets selected, but the entries are in the files next to it
+        return sorted(glob.glob(glob.escape(os.path.splitext(path)[0]) + ".*"))
+    return [path]
+
+
+def source_fingerprint(files: list[str]) -> tuple[int, float]:
+    "Total size and latest modification time of a list of files"
+    stats = [os.stat(file) for file in files]
+    return sum(stat.st_size for stat in stats), max((stat.st_mtime for stat in stats), default=0.0)
+
+
+def source_hash(files: list[str], dicttype: str) -> str:
+    "Hash of the contents of a list of files. For audio libraries, only names and sizes are hashed"
+    h = hashlib.sha1()
+    for file in files:
+        h.update(os.path.basename(file).encode("utf-8"))
+        if dicttype == "audiolib":
+            h.update(str(os.path.getsize(file)).encode("utf-8"))
+        else:
+            with open(file, "rb") as f:
+                h.update(hashlib.file_digest(f, "sha1").digest())
+    return h.hexdigest()
@@ -4,7 +4,7 @@ from typing import TYPE_CHECKING
 from sentence_splitter import SentenceSplitter
 from .GenericImporter import GenericImporter
 import os
-from ..lemmatizer import lem_word, lem_pre
+from ..tokenizer import tokenize, lemmatize_tokens
 from .models import ReadingNote
 from ..tools import ebook2text
 from .AutoTextVisualizer import AutoTextVisualizer
@@ -29,7 +29,7 @@ class AutoTextImporter(GenericImporter):
                          )
                          if sentence)
 
-        known_words = set(self.known_words)
+        known_words = self.known_words
         already_mined = set()
         reading_notes = []
         norepeat = True
@@ -38,11 +38,14 @@ class AutoTextImporter(GenericImporter):
         visualizer_data: list[str] = []
         for sentence in sentences:
             unknowns = []
+            unknown_lemmas = []
             start = False
-            visualizer_sentence = sentence
+            # Positions of unknown words in the sentence, to be marked in the visualizer
+            spans = []
             # Detect the unknown words in sentence
-            for word, lemma in zip(sentence.split(), map(lambda x: lem_word(x, self.lang), sentence.split())):
-                word = lem_pre(word, self.lang)
+            tokens = list(tokenize(sentence, self.lang))
+            for token, lemma in zip(tokens, lemmatize_tokens(tokens, self.lang)):
+                word = token.form
                 is_capital_but_not_initial = word and word[0].isupper() and not start
                 if lemma not in known_words \
                         and lemma.isalpha() \
@@ -50,13 +53,22 @@ class AutoTextImporter(GenericImporter):
                         and not (is_capital_but_not_initial and treat_capital_words_as_known):
 
                     unknowns.append(word)
-                    visualizer_sentence = visualizer_sentence.replace(word, f"[{word}]")
+                    unknown_lemmas.append(lemma)
+                    if (offset := token.text.find(word)) != -1:
+                        spans.append((token.start + offset, token.start + offset + len(word)))
+
+            visualizer_sentence = ""
+            last = 0
+            for span_start, span_end in spans:
+                visualizer_sentence += sentence[last:span_start] + f"[{sentence[span_start:span_end]}]"
+                last = span_end
+            visualizer_sentence += sentence[last:]
 
             if len(unknowns) == 1:
-                if not (norepeat and lem_word(unknowns[0], self.lang) in already_mined):
+                if not (norepeat and unknown_lemmas[0] in already_mined):
                     #target_sentences.append(sentence)
                     #target_words.append(unknowns[0])
-                    already_mined.update([lem_word(unknowns[0], self.lang)])
+                    already_mined.update([unknown_lemmas[0]])
                     reading_notes.append(ReadingNote(
                         lookup_term=unknowns[0],
                         sentence=sentence,
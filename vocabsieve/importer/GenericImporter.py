@@ -5,13 +5,13 @@ from PyQt5.QtCore import QDateTime, QCoreApplication
 from .BatchNotePreviewer import BatchNotePreviewer
 from ..ui.main_window_base import MainWindowBase
 from .models import ReadingNote
-from ..models import SRSNote
-from ..tools import prepareAnkiNoteDict, addNotes, remove_punctuations, canAddNotes
+from ..models import AudioDefinition, Definition, SRSNote
+from ..tools import prepareAnkiNoteDict, addNotes, remove_punctuations, canAddNotesWithErrorDetail
 
 import re
 import os
 import json
-import itertools
+from collections import Counter
 from datetime import datetime as dt
 from ..global_names import datapath, logger, settings
 from typing import TYPE_CHECKING, Optional
@@ -19,6 +19,9 @@ from typing import TYPE_CHECKING, Optional
 if TYPE_CHECKING:
     from ..main import MainWindow
 
+# Notes whose words are looked up together
+DEFINE_CHUNK_SIZE = 50
+
 
 def date_to_timestamp(datestr: str):
     return dt.strptime(datestr, "%Y-%m-%d %H:%M:%S").timestamp()
@@ -164,23 +167,39 @@ class GenericImporter(QDialog):
         self.lookup_button.setEnabled(False)
         self.anki_button.setEnabled(False)
         self.preview_widget.reset()
+
+        # Remove punctuations
+        words = [remove_punctuations(note.lookup_term) for note in self.selected_reading_notes]
+        definitions1: dict[str, Optional[Definition]] = {}
+        definitions2: dict[str, Optional[Definition]] = {}
+        audio_definitions: dict[str, list[AudioDefinition]] = {}
+        audio_enabled = json.loads(settings.value("audio_sg", "[]")) != []
+
         count = 0
-        for n_looked_up, note in enumerate(self.selected_reading_notes):
+        for n_looked_up, (note, word) in enumerate(zip(self.selected_reading_notes, words)):
+            if n_looked_up % DEFINE_CHUNK_SIZE == 0:
+                # Look up the words of the next notes together, so each source is queried in batches
+                # instead of per note, while the dialog keeps responding
+                chunk = [word for word in dict.fromkeys(words[n_looked_up:n_looked_up + DEFINE_CHUNK_SIZE])
+                         if word not in definitions1]
+                definitions1.update(defi1.getFirstDefinitions(chunk))
+                if definition2_enabled:
+                    definitions2.update(defi2.getFirstDefinitions(chunk))
+                if audio_enabled:
+                    try:
+                        audio_definitions.update(self._parent.audio_selector.getDefinitionsForWords(chunk))
+                    except Exception:
+                        pass
             QCoreApplication.processEvents()
             logger.debug(f"Handling reading note: {note}")
             self.lastDate = max(note.date, self.lastDate)
-            # Remove punctuations
-            word = remove_punctuations(note.lookup_term)
             if settings.value("bold_word", True, type=bool):
                 sentence = note.sentence.replace(word, f"<strong>{word}</strong>")
             else:
                 sentence = note.sentence
 
-            definition1 = defi1.getFirstDefinition(word)
-            if definition2_enabled:
-                definition2 = defi2.getFirstDefinition(word)
-            else:
-                definition2 = None
+            definition1 = definitions1[word]
+            definition2 = definitions2.get(word)
             if not (definition1 or definition2) and not self.add_even_if_no_defi.isChecked():
                 continue
             count += 1
@@ -189,15 +208,8 @@ class GenericImporter(QDialog):
             QCoreApplication.processEvents()
 
             audio_path = ""
-            if json.loads(settings.value("audio_sg", "[]")) != []:
-                try:
-                    audio_definitions = self._parent.audio_selector.getDefinitions(word)
-                    if audio_definitions and audio_definitions[0].audios is not None:
-                        audios = audio_definitions[0].audios
-                    else:
-                        audios = {}
-                except Exception:
-                    audios = {}
+            if word_audio_definitions := audio_definitions.get(word):
+                audios = word_audio_definitions[0].audios
                 if audios:
                     # First item
                     audio_path = audios[next(iter(audios))]
@@ -240,12 +252,15 @@ class GenericImporter(QDialog):
 
         # Check if we can add notes
         logger.info(f"Trying to add {len(notes_data)} notes to Anki.")
-        checks = canAddNotes(settings.value("anki_api"), notes_data)
-        logger.info(f"{sum(checks)} out of {len(checks)} notes can be added to Anki, proceeding.")
+        errors = canAddNotesWithErrorDetail(settings.value("anki_api"), notes_data)
+        logger.info(f"{errors.count(None)} out of {len(errors)} notes can be added to Anki, proceeding.")
+        for error, count in Counter(error for error in errors if error is not None).items():
+            logger.info(f"{count} notes cannot be added: {error}")
         # Filter out the notes that can't be added
-        notes_data = list(itertools.compress(notes_data, checks))
+        notes_data = [note for note, error in zip(notes_data, errors) if error is None]
         logger.info(f"Sending {len(notes_data)} notes to AnkiConnect")
         res = addNotes(settings.value("anki_api"), notes_data)
+        n_added = sum(isinstance(note_id, int) for note_id in res)
         # Record last import data
         if self.methodname not in ('auto', 'wordlist'):  # don't save for auto vocab extraction
             settings.setValue("last_import_method", self.methodname)
@@ -258,5 +273,5 @@ class GenericImporter(QDialog):
             QDateTime.currentDateTime().toString('[hh:mm:ss]') + " "
             + str(len(notes_data))
             + " notes have been exported, of which "
-            + str(len([i for i in res if i]))
+            + str(n_added)
             + " were successfully added to your collection."))
@@ -0,0 +1,378 @@
+"""
+Incremental known data
+
+Known data is computed from a snapshot of its sources for one language: lookup and
+seen counts and modifiers of each lemma, and the lemmas each Anki note contributes.
+A refresh only applies what changed since the snapshot was taken, and rebuilds the
+WordRecords of the lemmas it touched. Published dicts of WordRecords are never
+modified afterwards, so they can be read from other threads during a refresh.
+
+WordRecords are kept in a KnownDataStore, as NumPy columns with one row per lemma,
+so that scores and known words of all lemmas are computed in a few array operations.
+
+Snapshots are saved to disk, so that known data is available right at startup
+and only has to be brought up to date. The file is a JSON header with the strings,
+followed by columns of numbers packed with the array module.
+"""
+import dataclasses
+import json
+import os
+import struct
+import sys
+from array import array
+from collections import Counter
+from collections.abc import Collection, Iterable, Iterator, Mapping
+from dataclasses import dataclass, field
+from itertools import accumulate, repeat
+from typing import Optional
+import numpy as np
+from .models import KnownMetadata, WordActionWeights, WordRecord
+from .tokenizer import lemmatize_tokens, tokenize
+
+ANKI_KEYS = ("anki_young_ctx", "anki_young_tgt", "anki_mature_ctx", "anki_mature_tgt")
+# Count columns of a KnownDataStore, the fields of WordRecord
+COLUMNS = ("n_seen", "n_lookups") + ANKI_KEYS
+
+SNAPSHOT_MAGIC = b"VSKD"
+SNAPSHOT_VERSION = 2
+
+
+def is_word(lemma: str) -> bool:
+    "Whether a lemma is kept in known data"
+    return lemma.isalpha() and not lemma.startswith('http') and " " not in lemma
+
+
+def note_lemmas(info: dict, fieldmap: dict[str, list[str]], langcode: str) -> tuple[str, tuple[str, ...]]:
+    "Target lemma and context lemmas of an Anki note, as returned by notesInfo"
+    word_field, ctx_field = fieldmap.get(info['modelName']) or ("<Ignore>", "<Ignore>")
+    word = ""
+    ctx = ""
+    if word_field != "<Ignore>":
+        word = info['fields'][word_field]['value']
+    if ctx_field != "<Ignore>":
+        ctx = info['fields'][ctx_field]['value']
+    # word field is assumed to be already lemmatized
+    ctx_lemmas = set(lemmatize_tokens(tokenize(ctx, langcode, strip_tags=True), langcode)) if ctx else set()
+    ctx_lemmas.discard(word)  # Don't count if already counted as word
+    return word, tuple(ctx_lemmas)
+
+
+def _weights(waw: WordActionWeights) -> dict[str, int]:
+    return {"n_seen": waw.seen, "n_lookups": waw.lookup, **{key: getattr(waw, key) for key in ANKI_KEYS}}
+
+
+class KnownDataStore(Mapping[str, WordRecord]):
+    """
+    Known data of one language as parallel NumPy arrays, one row per lemma
+    It can be used as a read-only dict of WordRecords, which are created on access.
+    A store is never modified, updated() returns a new one
+    """
+
+    def __init__(self, language: str, lemmas: list[str], counts: dict[str, np.ndarray],
+                 modifiers: np.ndarray, index: Optional[dict[str, int]] = None) -> None:
+        self.language = language
+        self.lemmas = lemmas
+        self.index = index if index is not None else dict(zip(lemmas, range(len(lemmas))))
+        self.counts = counts  # int32 column for each of COLUMNS
+        self.modifiers = modifiers  # Multiplies the thresholds, 1.0 by default
+
+    @classmethod
+    def build(cls, language: str, lemmas: Iterable[str], sources: dict[str, dict[str, int]],
+              modifiers: dict[str, float]) -> "KnownDataStore":
+        """Store of some lemmas, with counts taken from a dict for each of COLUMNS
+        Lemmas missing from a dict have a count of 0"""
+        lemmas = list(lemmas)
+        index = dict(zip(lemmas, range(len(lemmas))))
+
+        def column(values: Mapping, dtype, default) -> np.ndarray:
+            result = np.full(len(lemmas), default, dtype=dtype)
+            rows = np.fromiter(map(index.get, values, repeat(-1)), dtype=np.int64, count=len(values))
+            data = np.fromiter(values.values(), dtype=dtype, count=len(values))
+            result[rows[rows >= 0]] = data[rows >= 0]
+            return result
+
+        return cls(language, lemmas, {name: column(sources[name], np.int32, 0) for name in COLUMNS},
+                   column(modifiers, np.float64, 1.0), index)
+
+    def updated(self, rows: dict[str, Optional[tuple[tuple[int, ...], float]]]) -> "KnownDataStore":
+        """A new store with some rows replaced. rows maps lemmas to their counts,
+        in the order of COLUMNS, and modifier, or to None to remove them"""
+        added = [lemma for lemma, row in rows.items() if row is not None and lemma not in self.index]
+        lemmas = self.lemmas + added
+        index = self.index | {lemma: i for i, lemma in enumerate(added, len(self.lemmas))}
+        counts = {name: np.concatenate((column, np.zeros(len(added), dtype=np.int32)))
+                  for name, column in self.counts.items()}
+        modifiers = np.concatenate((self.modifiers, np.ones(len(added))))
+        removed = []
+        for lemma, row in rows.items():
+            if row is None:
+                if lemma in index:
+                    removed.append(index[lemma])
+                continue
+            i = index[lemma]
+            for name, count in zip(COLUMNS, row[0]):
+                counts[name][i] = count
+            modifiers[i] = row[1]
+        if not removed:
+            return KnownDataStore(self.language, lemmas, counts, modifiers, index)
+        keep = np.ones(len(lemmas), dtype=bool)
+        keep[removed] = False
+        return KnownDataStore(self.language, [lemma for lemma, kept in zip(lemmas, keep) if kept],
+                              {name: column[keep] for name, column in counts.items()}, modifiers[keep])
+
+    def __getitem__(self, lemma: str) -> WordRecord:
+        i = self.index[lemma]
+        return WordRecord(lemma=lemma, language=self.language,
+                          **{name: int(column[i]) for name, column in self.counts.items()})
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.lemmas)
+
+    def __len__(self) -> int:
+        return len(self.lemmas)
+
+    def __contains__(self, lemma: object) -> bool:
+        return lemma in self.index
+
+    def scores(self, waw: WordActionWeights) -> np.ndarray:
+        "Score of every lemma, in the order of lemmas"
+        result = np.zeros(len(self.lemmas), dtype=np.int64)
+        for name, weight in _weights(waw).items():
+            result += weight * self.counts[name].astype(np.int64)
+        return result
+
+    def scoresOf(self, lemmas: Iterable[str], waw: WordActionWeights) -> np.ndarray:
+        "Scores of some lemmas, 0 for lemmas that are not in the store"
+        rows = np.fromiter(map(self.index.get, lemmas, repeat(-1)), dtype=np.int64)
+        if not self.lemmas:
+            return np.zeros(len(rows), dtype=np.int64)
+        return np.where(rows >= 0, self.scores(waw)[rows], 0)
+
+    def modifiersOf(self, lemmas: Iterable[str]) -> np.ndarray:
+        "Modifiers of some lemmas, 1.0 for lemmas that are not in the store"
+        rows = np.fromiter(map(self.index.get, lemmas, repeat(-1)), dtype=np.int64)
+        if not self.lemmas:
+            return np.ones(len(rows))
+        return np.where(rows >= 0, self.modifiers[rows], 1.0)
+
+    def mask(self, lemmas: Iterable[str]) -> np.ndarray:
+        "Which rows belong to some lemmas"
+        result = np.zeros(len(self.lemmas), dtype=bool)
+        rows = np.fromiter(map(self.index.get, lemmas, repeat(-1)), dtype=np.int64)
+        result[rows[rows >= 0]] = True
+        return result
+
+    def known(self, waw: WordActionWeights, cognates: Collection[str] = ()) -> tuple[np.ndarray, np.ndarray]:
+        """Which lemmas are known, and which of them are known as cognates
+        Cognates only need to reach the lower threshold. Modifiers scale both thresholds"""
+        scores = self.scores(waw)
+        known = scores >= waw.threshold * self.modifiers
+        known_cognates = ~known & (scores >= waw.threshold_cognate * self.modifiers) & self.mask(cognates)
+        return known | known_cognates, known_cognates
+
+    def knownWords(self, waw: WordActionWeights, cognates: Collection[str] = ()) -> tuple[list[str], list[str]]:
+        "Known lemmas, and those that are known as cognates"
+        known, known_cognates = self.known(waw, cognates)
+        lemmas = np.array(self.lemmas, dtype=object)
+        return lemmas[known].tolist(), lemmas[known_cognates].tolist()
+
+
+@dataclass
+class AnkiNote:
+    "Lemmas contributed by one Anki note"
+    mod: int  # Modification time in Anki
+    mature: bool
+    tgt: str
+    ctx: tuple[str, ...]
+
+
+@dataclass
+class KnownDataSnapshot:
+    language: str
+    fieldmap: str  # As stored in the settings
+    watermark: int = 0  # Last change in the database that was applied
+    lookups: dict[str, int] = field(default_factory=dict)
+    seen: dict[str, int] = field(default_factory=dict)
+    modifiers: dict[str, float] = field(default_factory=dict)
+    notes: dict[int, AnkiNote] = field(default_factory=dict)
+    anki: dict[str, Counter[str]] = field(default_factory=lambda: {key: Counter() for key in ANKI_KEYS})
+    records: KnownDataStore = field(init=False)
+    metadata: KnownMetadata = field(default_factory=KnownMetadata)
+
+    def __post_init__(self) -> None:
+        self.records = KnownDataStore.build(self.language, [], {name: {} for name in COLUMNS}, {})
+
+    @staticmethod
+    def applyValues(values: dict, rows: Iterable[tuple[str, Optional[float]]]) -> set[str]:
+        "Set the value of each lemma, None removes it. Returns the lemmas"
+        touched = set()
+        for lemma, value in rows:
+            if value is None:
+                values.pop(lemma, None)
+            else:
+                values[lemma] = value
+            touched.add(lemma)
+        return touched
+
+    @staticmethod
+    def replaceValues(values: dict, new_values: dict) -> set[str]:
+        "Replace all values with new_values. Returns the lemmas whose value changed"
+        return KnownDataSnapshot.applyValues(values, [
+            *((lemma, value) for lemma, value in new_values.items() if values.get(lemma) != value),
+            *((lemma, None) for lemma in values if lemma not in new_values)])
+
+    def _countNote(self, note: AnkiNote, sign: int) -> set[str]:
+        prefix = "anki_mature_" if note.mature else "anki_young_"
+        tgt_counts, ctx_counts = self.anki[prefix + "tgt"], self.anki[prefix + "ctx"]
+        touched = set(note.ctx)
+        for counts, lemmas in ((tgt_counts, (note.tgt,) if note.tgt else ()), (ctx_counts, note.ctx)):
+            for lemma in lemmas:
+                counts[lemma] += sign
+                if counts[lemma] <= 0:
+                    del counts[lemma]
+        n_tgt = sign if note.tgt else 0
+        if note.tgt:
+            touched.add(note.tgt)
+        if note.mature:
+            self.metadata.n_mature_tgt += n_tgt
+            self.metadata.n_mature_ctx += sign * len(note.ctx)
+        else:
+            self.metadata.n_young_tgt += n_tgt
+            self.metadata.n_young_ctx += sign * len(note.ctx)
+        return touched
+
+    def addNote(self, note_id: int, note: AnkiNote) -> set[str]:
+        "Add or replace a note. Returns the lemmas whose counts changed"
+        touched = self.removeNote(note_id)
+        self.notes[note_id] = note
+        return touched | self._countNote(note, 1)
+
+    def removeNote(self, note_id: int) -> set[str]:
+        note = self.notes.pop(note_id, None)
+        return self._countNote(note, -1) if note is not None else set()
+
+    def clearNotes(self) -> set[str]:
+        touched = set()
+        for note_id in list(self.notes):
+            touched |= self.removeNote(note_id)
+        return touched
+
+    def _sources(self) -> dict[str, dict[str, int]]:
+        return {"n_seen": self.seen, "n_lookups": self.lookups, **self.anki}
+
+    def rebuildRecords(self, lemmas: Iterable[str]) -> None:
+        "Rebuild the rows of some lemmas into a new store"
+        lemmas = {lemma for lemma in lemmas if is_word(lemma)}
+        if not lemmas:
+            return
+        sources = self._sources()
+        if len(lemmas) > len(self.records) // 2:
+            # Cheaper to start over
+            present = set(self.modifiers).union(*sources.values())
+            self.records = KnownDataStore.build(
+                self.language, (lemmas | set(self.records.lemmas)) & present, sources, self.modifiers)
+            return
+        rows: dict[str, Optional[tuple[tuple[int, ...], float]]] = {}
+        for lemma in lemmas:
+            counts = tuple(sources[name].get(lemma, 0) for name in COLUMNS)
+            if any(counts) or lemma in self.modifiers:
+                rows[lemma] = (counts, self.modifiers.get(lemma, 1.0))
+            else:
+                rows[lemma] = None
+        self.records = self.records.updated(rows)
+
+    def knownData(self) -> tuple[KnownDataStore, KnownMetadata]:
+        metadata = dataclasses.replace(self.metadata, n_lookups=len(self.lookups), n_seen=len(self.seen))
+        return self.records, metadata
+
+
+def save_snapshot(snapshot: KnownDataSnapshot, path: str) -> None:
+    "Write a snapshot to a file, replacing it atomically"
+    vocab: dict[str, int] = {}
+
+    def lemma_ids(lemmas: Iterable[str]) -> array:
+        return array('i', (vocab.setdefault(lemma, len(vocab)) for lemma in lemmas))
+
+    notes = snapshot.notes.values()
+    columns = {
+        "lookups_lemmas": lemma_ids(snapshot.lookups),
+        "lookups_counts": array('i', snapshot.lookups.values()),
+        "seen_lemmas": lemma_ids(snapshot.seen),
+        "seen_counts": array('i', snapshot.seen.values()),
+        "modifiers_lemmas": lemma_ids(snapshot.modifiers),
+        "modifiers_values": array('d', snapshot.modifiers.values()),
+        "note_ids": array('q', snapshot.notes),
+        "note_mods": array('q', (note.mod for note in notes)),
+        "note_mature": array('b', (note.mature for note in notes)),
+        # -1 for notes without a target word
+        "note_tgts": array('i', (vocab.setdefault(note.tgt, len(vocab)) if note.tgt else -1 for note in notes)),
+        # Context lemmas of all notes, one after the other
+        "note_ctx_ends": array('i', accumulate(len(note.ctx) for note in notes)),
+        "note_ctx": lemma_ids(lemma for note in notes for lemma in note.ctx),
+        "record_lemmas": lemma_ids(snapshot.records),
+    }
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "byteorder": sys.byteorder,
+        "language": snapshot.language,
+        "fieldmap": snapshot.fieldmap,
+        "watermark": snapshot.watermark,
+        "vocab": list(vocab),
+        "columns": [[name, column.typecode, column.itemsize, len(column)] for name, column in columns.items()],
+    }, ensure_ascii=False).encode("utf-8")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack("<I", len(header)) + header)
+        for column in columns.values():
+            column.tofile(f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str) -> KnownDataSnapshot:
+    "Read a snapshot written by save_snapshot. Raises ValueError if the file is not usable"
+    with open(path, "rb") as f:
+        data = memoryview(f.read())
+    if data[:4] != SNAPSHOT_MAGIC:
+        raise ValueError("Not a known data snapshot")
+    header_len, = struct.unpack_from("<I", data, 4)
+    header = json.loads(bytes(data[8:8 + header_len]))
+    if header["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header['version']}")
+    offset = 8 + header_len
+    columns: dict[str, array] = {}
+    for name, typecode, itemsize, length in header["columns"]:
+        column = array(typecode)
+        if column.itemsize != itemsize:
+            raise ValueError("Snapshot was written on an incompatible platform")
+        column.frombytes(data[offset:offset + itemsize * length])
+        if header["byteorder"] != sys.byteorder:
+            column.byteswap()
+        columns[name] = column
+        offset += itemsize * length
+
+    vocab: list[str] = header["vocab"]
+    snapshot = KnownDataSnapshot(language=header["language"], fieldmap=header["fieldmap"],
+                                 watermark=header["watermark"])
+    snapshot.lookups = dict(zip(map(vocab.__getitem__, columns["lookups_lemmas"]), columns["lookups_counts"]))
+    snapshot.seen = dict(zip(map(vocab.__getitem__, columns["seen_lemmas"]), columns["seen_counts"]))
+    snapshot.modifiers = dict(zip(map(vocab.__getitem__, columns["modifiers_lemmas"]), columns["modifiers_values"]))
+    ctx = columns["note_ctx"]
+    start = 0
+    for note_id, mod, mature, tgt, end in zip(columns["note_ids"], columns["note_mods"], columns["note_mature"],
+                                              columns["note_tgts"], columns["note_ctx_ends"]):
+        snapshot.notes[note_id] = AnkiNote(mod, bool(mature), vocab[tgt] if tgt >= 0 else "",
+                                           tuple(map(vocab.__getitem__, ctx[start:end])))
+        start = end
+
+    # Everything else is derived from the sources
+    for mature, kind in ((True, "mature"), (False, "young")):
+        notes = [note for note in snapshot.notes.values() if note.mature == mature]
+        tgt_counts = Counter(note.tgt for note in notes if note.tgt)
+        ctx_counts = Counter(lemma for note in notes for lemma in note.ctx)
+        snapshot.anki[f"anki_{kind}_tgt"] = tgt_counts
+        snapshot.anki[f"anki_{kind}_ctx"] = ctx_counts
+        setattr(snapshot.metadata, f"n_{kind}_tgt", tgt_counts.total())
+        setattr(snapshot.metadata, f"n_{kind}_ctx", ctx_counts.total())
+    snapshot.records = KnownDataStore.build(snapshot.language, map(vocab.__getitem__, columns["record_lemmas"]),
+                                            snapshot._sources(), snapshot.modifiers)
+    return snapshot
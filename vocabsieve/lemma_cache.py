@@ -0,0 +1,132 @@
+"""
+Persistent cache of lemmas, shared between sessions and processes
+
+Lemmas are stored in a small SQLite database keyed by (language, greedy, form).
+Lookups of a language go to memory once it has been warmed, new lemmas are added to
+memory immediately and written to disk in the background. The database is in WAL mode,
+so any process can open it by path and read it while another one is writing.
+"""
+import atexit
+import queue
+import threading
+import time
+from typing import Iterable
+from loguru import logger
+from .connection_pool import ConnectionPool
+
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER, which is 999 on older builds
+LOOKUP_CHUNK_SIZE = 900
+
+
+class LemmaCache():
+    """
+    version identifies the lemmatizers the lemmas came from.
+    When it changes, the cached lemmas are discarded
+    """
+
+    def __init__(self, path: str, version: str) -> None:
+        self.pool = ConnectionPool(path)
+        self.conn = self.pool.writer
+        self._memory: dict[tuple[str, bool], dict[str, str]] = {}
+        self._warmed: set[tuple[str, bool]] = set()
+        self._pending: queue.Queue[tuple[str, bool, list[tuple[str, str]]]] = queue.Queue()
+        with self.pool.lock:
+            self.createTables()
+            row = self.conn.execute("SELECT value FROM metadata WHERE key='version'").fetchone()
+            if row is None or row[0] != version:
+                if row is not None:
+                    logger.info(f"Lemmatizers changed from {row[0]} to {version}, clearing lemma cache")
+                self.conn.execute("DELETE FROM lemmas")
+                self.conn.execute("INSERT OR REPLACE INTO metadata(key, value) VALUES('version', ?)", (version,))
+            self.conn.commit()
+        self._writer = threading.Thread(target=self._writeLoop, daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def createTables(self) -> None:
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS lemmas (
+            language TEXT,
+            greedy INTEGER,
+            form TEXT,
+            lemma TEXT,
+            PRIMARY KEY (language, greedy, form)
+        ) WITHOUT ROWID
+        """)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """)
+
+    def warm(self, language: str, greedy: bool = False) -> None:
+        "Load all lemmas of a language into memory, so later lookups do not touch the database"
+        if (language, greedy) in self._warmed:
+            return
+        start = time.time()
+        loaded = dict(self.pool.cursor().execute(
+            "SELECT form, lemma FROM lemmas WHERE language=? AND greedy=?", (language, greedy)))
+        # Keep lemmas added while loading
+        loaded.update(self._memory.get((language, greedy), {}))
+        self._memory[(language, greedy)] = loaded
+        self._warmed.add((language, greedy))
+        logger.debug(f"Loaded {len(loaded)} cached lemmas for {language} in {time.time() - start:.2f} seconds")
+
+    def get_many(self, forms: Iterable[str], language: str, greedy: bool = False) -> dict[str, str]:
+        "Get cached lemmas of many forms. Forms that are not cached are omitted"
+        forms = list(forms)
+        memory = self._memory.get((language, greedy), {})
+        result = {form: memory[form] for form in forms if form in memory}
+        if (language, greedy) in self._warmed:
+            return result
+        missing = [form for form in dict.fromkeys(forms) if form not in result]
+        c = self.pool.cursor()
+        for i in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+            chunk = missing[i:i + LOOKUP_CHUNK_SIZE]
+            c.execute(f"""
+                SELECT form, lemma FROM lemmas
+                WHERE language=? AND greedy=?
+                AND form IN ({",".join("?" * len(chunk))})
+                """, (language, greedy, *chunk))
+            result.update(c.fetchall())
+        return result
+
+    def get(self, form: str, language: str, greedy: bool = False) -> str | None:
+        return self.get_many([form], language, greedy).get(form)
+
+    def put_many(self, lemmas: dict[str, str], language: str, greedy: bool = False) -> None:
+        "Cache lemmas of many forms. They are written to disk in the background"
+        if not lemmas:
+            return
+        self._memory.setdefault((language, greedy), {}).update(lemmas)
+        self._pending.put((language, greedy, list(lemmas.items())))
+
+    def put(self, form: str, lemma: str, language: str, greedy: bool = False) -> None:
+        self.put_many({form: lemma}, language, greedy)
+
+    def flush(self) -> None:
+        "Wait until all cached lemmas are written to disk"
+        self._pending.join()
+
+    def _writeLoop(self) -> None:
+        while True:
+            batches = [self._pending.get()]
+            # Write everything that piled up in one transaction
+            while True:
+                try:
+                    batches.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self.pool.lock:
+                    for language, greedy, items in batches:
+                        self.conn.executemany(
+                            "INSERT OR IGNORE INTO lemmas(language, greedy, form, lemma) VALUES(?, ?, ?, ?)",
+                            ((language, greedy, form, lemma) for form, lemma in items))
+                    self.conn.commit()
+            except Exception as e:
+                logger.error(f"Failed to write lemma cache: {repr(e)}")
+            finally:
+                for _ in batches:
+                    self._pending.task_done()
@@ -1,30 +1,56 @@
-import simplemma
-import pymorphy3
 import re
+import multiprocessing
+import threading
 from functools import lru_cache
+from typing import Any, Callable, Iterable, Optional
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import importlib
+import importlib.metadata
+import importlib.util
 import unicodedata
+from .lemma_cache import LemmaCache
 
-PYMORPHY_SUPPORT = []
-morph = {}
-try:
-    import pymorphy3_dicts_ru
-    morph['ru'] = pymorphy3.MorphAnalyzer(path=pymorphy3_dicts_ru.get_path(), lang="ru")
-    PYMORPHY_SUPPORT.append("ru")
-    print("pymorphy3 is available for RU")
-except ImportError as e:
-    print("pymorphy3 is not available for RU, performance may be bad:", e)
-except FileNotFoundError as e:
-    print("pymorphy3 is not available for RU, performance may be bad:", e)
-
-try:
-    import pymorphy3_dicts_uk
-    morph['uk'] = pymorphy3.MorphAnalyzer(path=pymorphy3_dicts_uk.get_path(), lang="uk")
-    print("pymorphy3 is available for UK")
-    PYMORPHY_SUPPORT.append("uk")
-except ImportError as e:
-    print("pymorphy3 is not available for UK, performance may be bad:", e)
-except FileNotFoundError as e:
-    print("pymorphy3 is not available for UK, performance may be bad:", e)
+# Analyzers take a while to load and are only needed for their own language,
+# so they are loaded on first use. simplemma is also imported lazily
+PYMORPHY_DICTS = {"ru": "pymorphy3_dicts_ru", "uk": "pymorphy3_dicts_uk"}
+_morph: dict[str, Any] = {}
+_morph_lock = threading.Lock()
+
+
+def get_morph(language: str) -> Optional[Any]:
+    "pymorphy3 analyzer for a language, loaded on first use. None if it is not available"
+    if language not in PYMORPHY_DICTS:
+        return None
+    if language not in _morph:
+        with _morph_lock:
+            if language not in _morph:
+                _morph[language] = _load_morph(language)
+    return _morph[language]
+
+
+def _load_morph(language: str) -> Optional[Any]:
+    try:
+        import pymorphy3
+        dicts = importlib.import_module(PYMORPHY_DICTS[language])
+        analyzer = pymorphy3.MorphAnalyzer(path=dicts.get_path(), lang=language)
+        print(f"pymorphy3 is available for {language.upper()}")
+        return analyzer
+    except (ImportError, FileNotFoundError) as e:
+        print(f"pymorphy3 is not available for {language.upper()}, performance may be bad:", e)
+        return None
+
+
+# Distinct forms sent to a worker at a time when lemmatizing in parallel
+LEMMATIZE_CHUNK_SIZE = 2000
+# Starting worker processes and loading the lemmatizers in each of them takes a while,
+# so smaller vocabularies are lemmatized in the calling process
+PARALLEL_MIN_FORMS = 20000
+# Leave cores to the interface and to sqlite while a large text is lemmatized
+MAX_PROCESSES = 4
+
+# Persistent cache in front of the lemmatizers, see use_lemma_cache
+_lemma_cache: Optional[LemmaCache] = None
 
 simplemma_languages = ["ast", "bg", "ca", "cs", "cy", "da", "de", "el", "en",
                        "enm", "es", "et", "fa", "fi", "fr", "ga", "gd", "gl",
@@ -34,18 +60,89 @@ simplemma_languages = ["ast", "bg", "ca", "cs", "cy", "da", "de", "el", "en",
                        "sw", "tl", "tr", "uk"]
 
 
+# Punctuation, html tags and {} annotations, all removed in a single pass
+LEM_PRE_RE = re.compile(r'[\?\.!«»”“"…,()\[\]]+|<.*?>|\{.*?\}')
+
+
 def lem_pre(word, language):
     _ = language
-    word = re.sub(r'[\?\.!«»”“"…,()\[\]]*', "", word).strip()
-    word = re.sub(r"<.*?>", "", word)
-    word = re.sub(r"\{.*?\}", "", word)
-    return word
+    return LEM_PRE_RE.sub("", word).strip()
 
 
 def lem_word(word, language, greedy=False):
     return lemmatize(lem_pre(word, language), language, greedy)
 
 
+def lemmatize_many(tokens: Iterable[str], language: str, greedy: bool = False,
+                   processes: int = 1,
+                   progress: Optional[Callable[[int, int], None]] = None) -> list[str]:
+    """Lemmatize many tokens at once, the same as lem_word on each of them.
+    Every distinct token is normalized and lemmatized only once, so the cost depends
+    on the size of the vocabulary rather than the number of tokens.
+    With processes > 1, large vocabularies are lemmatized in a pool of at most
+    MAX_PROCESSES spawned processes.
+    progress is called with (forms lemmatized, forms to lemmatize).
+    Returns the lemmas in the same order as the tokens"""
+    tokens = tokens if isinstance(tokens, list) else list(tokens)
+    forms = {token: LEM_PRE_RE.sub("", token).strip() for token in set(tokens)}
+    unique_forms = list(set(forms.values()))
+    if _lemma_cache is None:
+        lemmas = _lemmatize_forms(unique_forms, language, greedy, processes, progress)
+    else:
+        lemmas = _lemma_cache.get_many(unique_forms, language, greedy)
+        new_lemmas = _lemmatize_forms([form for form in unique_forms if form not in lemmas],
+                                      language, greedy, processes, progress)
+        _lemma_cache.put_many(new_lemmas, language, greedy)
+        lemmas.update(new_lemmas)
+    return [lemmas[forms[token]] for token in tokens]
+
+
+def _lemmatize_chunk(forms: list[str], language: str, greedy: bool) -> list[str]:
+    # Runs in worker processes, so it must not use the lemma cache
+    return [_lemmatize(form, language, greedy) for form in forms]
+
+
+def _lemmatize_forms(forms: list[str], language: str, greedy: bool, processes: int,
+                     progress: Optional[Callable[[int, int], None]]) -> dict[str, str]:
+    chunks = [forms[i:i + LEMMATIZE_CHUNK_SIZE] for i in range(0, len(forms), LEMMATIZE_CHUNK_SIZE)]
+    results: Iterable[list[str]]
+    if processes > 1 and len(forms) >= PARALLEL_MIN_FORMS:
+        # Callers are multithreaded (Qt, the connection pool), and forking them
+        # can leave a worker stuck on a lock some other thread held, so spawn
+        executor = ProcessPoolExecutor(min(processes, len(chunks), MAX_PROCESSES),
+                                       mp_context=multiprocessing.get_context("spawn"))
+        results = executor.map(_lemmatize_chunk, chunks, repeat(language), repeat(greedy))
+    else:
+        executor = None
+        # Without a persistent cache, keep the in-memory cache of lemmatize warm
+        results = ([lemmatize(form, language, greedy) for form in chunk] if _lemma_cache is None
+                   else _lemmatize_chunk(chunk, language, greedy) for chunk in chunks)
+    lemmas: dict[str, str] = {}
+    try:
+        for chunk, result in zip(chunks, results):
+            lemmas.update(zip(chunk, result))
+            if progress is not None:
+                progress(len(lemmas), len(forms))
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return lemmas
+
+
+def lemmatizer_version() -> str:
+    "Versions of the lemmatizers in use. Cached lemmas are only valid for the same versions"
+    return (f"simplemma {importlib.metadata.version('simplemma')}, "
+            f"pymorphy3 {importlib.metadata.version('pymorphy3')} "
+            f"({','.join(lang for lang, module in PYMORPHY_DICTS.items() if importlib.util.find_spec(module))})")
+
+
+def use_lemma_cache(path: str) -> LemmaCache:
+    "Keep lemmas in a persistent cache at path, which can be shared by several processes"
+    global _lemma_cache
+    _lemma_cache = LemmaCache(path, lemmatizer_version())
+    return _lemma_cache
+
+
 def removeAccents(word) -> str:
     #print("Removing accent marks from query ", word)
     ACCENT_MAPPING = {
@@ -80,14 +177,24 @@ def removeAccents(word) -> str:
 def lemmatize(word, language, greedy=False):
     """Lemmatize a word. We will use PyMorphy for RU, UK, simplemma for others,
     and if that isn't supported , we give up. Should not fail under any circumstances"""
+    if _lemma_cache is not None and (lemma := _lemma_cache.get(word, language, greedy)) is not None:
+        return lemma
+    lemma = _lemmatize(word, language, greedy)
+    if _lemma_cache is not None:
+        _lemma_cache.put(word, lemma, language, greedy)
+    return lemma
+
+
+def _lemmatize(word, language, greedy=False):
     try:
         if language == 'ru':
             word = removeAccents(word)
         if not word:
             return word
-        if language in PYMORPHY_SUPPORT and morph.get(language):
-            return morph[language].parse(word)[0].normal_form
+        if (morph := get_morph(language)) is not None:
+            return morph.parse(word)[0].normal_form
         if language in simplemma_languages:
+            import simplemma
             return simplemma.lemmatize(word, lang=language, greedy=greedy)  # pyright: ignore[reportPrivateImportUsage]
         else:
             return word
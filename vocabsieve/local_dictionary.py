@@ -1,250 +1,788 @@
 
-from ast import parse
+import json
 import sqlite3
 import os
+import time
+import shutil
+import hashlib
+import threading
+import unicodedata
+from collections import Counter
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Optional, cast
 
-from .dictformats import parseMDX, parseDSL, parseCSV, parseTSV, xdxf2text, zopen, parseKaikki
-from .lemmatizer import removeAccents
-from pystardict import Dictionary
-import json
+from .dictformats import parse_dictionary, regularize_headword, source_files, source_fingerprint, source_hash
+from loguru import logger
+from .connection_pool import ConnectionPool
+from .compiled_dictionary import CompiledDictionary, write_compiled
+from .definition_codec import DefinitionCodec, train_zdict
 from .global_names import lock, datapath as datapath_
 
+# Number of rows sent to sqlite per executemany call during imports
+IMPORT_CHUNK_SIZE = 50000
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER, which is 999 on older builds
+DEFINE_MANY_CHUNK_SIZE = 900
+# Number of definitions used to train the compression dictionary of each dictionary
+ZDICT_SAMPLE_SIZE = 2000
+# Number of headwords sampled to find the characters used by a dictionary
+ALPHABET_SAMPLE_SIZE = 20000
+# Only the most common characters are tried when looking for misspellings,
+# otherwise dictionaries of languages with large scripts would need far too many queries
+ALPHABET_SIZE = 64
+
+# Pragmas applied for the duration of a bulk import. Durability does not matter
+# here, since a failed import can always be redone from the source file
+# journal_mode is left alone, the database stays in WAL mode for concurrent readers
+IMPORT_PRAGMAS = {
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": "-65536",  # 64 MiB
+}
+
+
+def search_key(word: str) -> str:
+    "Key for case and accent insensitive search: casefolded, with all diacritics removed"
+    return "".join(c for c in unicodedata.normalize("NFKD", word.casefold()) if not unicodedata.combining(c))
+
+
+def edits1(key: str, alphabet: str) -> set[str]:
+    "All strings one deletion, transposition, substitution or insertion away from key"
+    splits = [(key[:i], key[i:]) for i in range(len(key) + 1)]
+    deletes = {left + right[1:] for left, right in splits if right}
+    transposes = {left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1}
+    replaces = {left + c + right[1:] for left, right in splits if right for c in alphabet}
+    inserts = {left + c + right for left, right in splits for c in alphabet}
+    return (deletes | transposes | replaces | inserts) - {key, ""}
+
+
+class BulkImporter():
+    """Streams dictionary entries into the database inside a single transaction.
+    Indices of the dictionaries being imported are dropped for the duration of
+    the import and recreated at the end, which is much faster than updating them
+    for every row.
+    Use LocalDictionary.bulkImport() to obtain one.
+    """
+
+    def __init__(self, db: "LocalDictionary", chunk_size: int = IMPORT_CHUNK_SIZE) -> None:
+        self.db = db
+        self.chunk_size = chunk_size
+        self.n_rows = 0
+        self.start = 0.0
+        self.elapsed = 0.0
+        self._imported_names: set[str] = set()
+        self._saved_pragmas: dict[str, str] = {}
+
+    def __enter__(self) -> "BulkImporter":
+        # Hold the writer for the whole import
+        self.db.pool.lock.acquire()
+        self.start = time.time()
+        self.db.conn.commit()
+        for pragma, value in IMPORT_PRAGMAS.items():
+            self._saved_pragmas[pragma] = str(self.db.c.execute(f"PRAGMA {pragma}").fetchone()[0])
+            self.db.c.execute(f"PRAGMA {pragma}={value}")
+        self.db.c.execute("BEGIN")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            if exc_type is None:
+                for name in self._imported_names:
+                    self.db.removeDuplicates(name)
+                    self.db.makeIndex(name)
+                    self.db.updateAlphabet(name)
+                self.db.conn.commit()
+            else:
+                self.db.conn.rollback()
+        finally:
+            for pragma, value in self._saved_pragmas.items():
+                self.db.c.execute(f"PRAGMA {pragma}={value}")
+            self.db._bulk = None
+            self.db.pool.lock.release()
+        self.elapsed = time.time() - self.start
+        logger.info(f"Bulk import finished: {self.n_rows} rows in {self.elapsed:.2f} seconds "
+                    f"({self.rate:.0f} rows/s)")
+
+    @property
+    def rate(self) -> float:
+        "Throughput of this import in rows per second"
+        return self.n_rows / self.elapsed if self.elapsed else 0.0
+
+    def add(self, entries: Iterable[tuple[str, str]], lang: str, name: str) -> int:
+        """Insert (headword, definition) pairs in chunks. Returns number of rows inserted.
+        Each call is wrapped in a savepoint, so a failure only discards this dictionary
+        """
+        start = time.time()
+        if name not in self._imported_names:
+            # A compiled copy would be out of date after this
+            self.db.removeCompiled(name)
+        entries = ((word, definition.replace("\\n", "\n")) for word, definition in entries)
+        count = 0
+        self.db.c.execute("SAVEPOINT import_dictionary")
+        try:
+            table = self.db.createDictTable(name)
+            if name not in self._imported_names:
+                self.db.dropIndex(name)
+            if self.db.compress:
+                if (codec := self.db.getCodec(name)) is None:
+                    sample = list(islice(entries, ZDICT_SAMPLE_SIZE))
+                    codec = self.db.trainCodec(name, (definition for _, definition in sample))
+                    entries = chain(sample, entries)
+                rows = ((word, codec.encode(definition), lang, search_key(word)) for word, definition in entries)
+            else:
+                rows = ((word, definition, lang, search_key(word)) for word, definition in entries)
+            while chunk := list(islice(rows, self.chunk_size)):
+                self.db.c.executemany(f"""
+                    INSERT INTO {table}(word, definition, language, key)
+                    VALUES(?, ?, ?, ?)
+                    """, chunk)
+                count += len(chunk)
+        except BaseException:
+            self.db._codecs.pop(name, None)
+            self.db.c.execute("ROLLBACK TO import_dictionary")
+            self.db.c.execute("RELEASE import_dictionary")
+            raise
+        self.db.c.execute("RELEASE import_dictionary")
+        self._imported_names.add(name)
+        self.n_rows += count
+        elapsed = time.time() - start
+        logger.debug(f"Inserted {count} entries into {name} ({lang}) in {elapsed:.2f} seconds "
+                     f"({count / elapsed if elapsed else 0:.0f} rows/s)")
+        return count
+
+    def discard(self, name: str) -> None:
+        "Drop everything imported into a dictionary so far, e.g. when parsing its source failed midway"
+        if table := self.db._writerTable(name):
+            self.db.c.execute(f"DROP TABLE {table}")
+            self.db.c.execute("DELETE FROM dictionaries WHERE name=?", (name,))
+        self.db._tables.pop(name, None)
+        self.db._codecs.pop(name, None)
+        self._imported_names.discard(name)
+
 
 class LocalDictionary():
-    def __init__(self, datapath) -> None:
+    """
+    Each dictionary is stored in its own table, so that deleting or reimporting one
+    does not touch the others. The dictionaries table maps names to tables and keeps
+    the compression dictionary and information about the source files.
+    """
+
+    def __init__(self, datapath, compress: bool = True) -> None:
         path = os.path.join(datapath, "dict.db")
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.compiled_path = os.path.join(datapath, "compiled")
+        self._compiled: dict[tuple[str, str], Optional[CompiledDictionary]] = {}
+        self._compiled_lock = threading.Lock()
+        # Compress definitions of newly imported dictionaries
+        self.compress = compress
+        self._codecs: dict[str, DefinitionCodec] = {}
+        self._tables: dict[str, str] = {}
+        self._cognates: dict[tuple, frozenset[str]] = {}
+        # self.conn and self.c are the writer, reads go through per-thread connections
+        self.pool = ConnectionPool(path)
+        self.conn = self.pool.writer
         self.c = self.conn.cursor()
-        self.createTables()
-        self.makeIndex()
+        self.conn.create_function("search_key", 1, search_key, deterministic=True)
+        self._bulk: Optional[BulkImporter] = None
+        with self.pool.lock:
+            self.createTables()
+            self.addSearchKeys()
 
-    def makeIndex(self) -> None:
-        try:
-            self.c.execute("""
-            CREATE UNIQUE INDEX IF NOT EXISTS dictionary_index ON dictionary(language, dictname, word)
-            """)  # Faster lookups
-            self.c.execute("""
-            CREATE INDEX IF NOT EXISTS dictname_index ON dictionary(dictname)
-            """)  # Faster counting of entries
-            print("Either successfully made unique index, or there is already one")
-        except sqlite3.IntegrityError:
-            print("Unable to make unique index")
+    @staticmethod
+    def tableName(dict_id: int) -> str:
+        return f"dict_{dict_id}"
+
+    def makeIndex(self, name: str) -> None:
+        if table := self._writerTable(name):
+            try:
+                self.c.execute(f"""
+                CREATE UNIQUE INDEX IF NOT EXISTS {table}_index ON {table}(language, word)
+                """)  # Faster lookups
+            except sqlite3.IntegrityError:
+                print("Unable to make unique index")
+            self.c.execute(f"""
+            CREATE INDEX IF NOT EXISTS {table}_key ON {table}(language, key, word)
+            """)  # Fuzzy and prefix search
+
+    def dropIndex(self, name: str) -> None:
+        if table := self._writerTable(name):
+            self.c.execute(f"DROP INDEX IF EXISTS {table}_index")
+            self.c.execute(f"DROP INDEX IF EXISTS {table}_key")
+
+    def removeDuplicates(self, name: str) -> None:
+        "Keep only the last inserted definition of each headword in a dictionary"
+        if table := self._writerTable(name):
+            self.c.execute(f"""
+                DELETE FROM {table}
+                WHERE rowid NOT IN (
+                    SELECT MAX(rowid) FROM {table}
+                    GROUP BY language, word
+                )
+            """)
 
     def createTables(self) -> None:
+        # Lets deleting a dictionary give space back without a VACUUM.
+        # Only has an effect on new databases, or after the next VACUUM
+        self.c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # AUTOINCREMENT, so that the table names of deleted dictionaries are never reused
         self.c.execute("""
-        CREATE TABLE IF NOT EXISTS dictionary (
+        CREATE TABLE IF NOT EXISTS dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            zdict BLOB,
+            source_path TEXT,
+            source_size INTEGER,
+            source_mtime REAL,
+            source_hash TEXT,
+            alphabet TEXT,
+            source_type TEXT,
+            source_lang TEXT
+        )
+        """)
+        columns = [row[1] for row in self.c.execute("PRAGMA table_info(dictionaries)")]
+        for column in ("alphabet", "source_type", "source_lang"):
+            if column not in columns:
+                self.c.execute(f"ALTER TABLE dictionaries ADD COLUMN {column} TEXT")
+        sql = self.c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='dictionaries'").fetchone()[0]
+        if "AUTOINCREMENT" not in sql:
+            # Created by an earlier version, copy it into a table with the same ids
+            self.c.execute(f"CREATE TABLE dictionaries_new {sql[sql.index('('):]}"
+                           .replace("id INTEGER PRIMARY KEY", "id INTEGER PRIMARY KEY AUTOINCREMENT"))
+            self.c.execute("INSERT INTO dictionaries_new SELECT * FROM dictionaries")
+            self.c.execute("DROP TABLE dictionaries")
+            self.c.execute("ALTER TABLE dictionaries_new RENAME TO dictionaries")
+        self.conn.commit()
+
+    def needsMigration(self) -> bool:
+        "Whether the database still has the single dictionary table of older versions, see migrateLegacy"
+        return bool(self.pool.cursor().execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='dictionary'").fetchone())
+
+    def migrateLegacy(self, progress: Optional[Callable[[int, int], None]] = None) -> None:
+        """Move dictionaries from the single table used by older versions into their own tables
+        This can take a while on large databases. progress is called with
+        (dictionaries moved, total dictionaries), and finally (total, total) before the VACUUM"""
+        if not self.needsMigration():
+            return
+        start = time.time()
+        with self.pool.lock:
+            has_zdicts = bool(
+                self.c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='zdicts'").fetchone())
+            names = [row[0] for row in self.c.execute("SELECT DISTINCT dictname FROM dictionary").fetchall()]
+            logger.info(f"Moving {len(names)} dictionaries to their own tables")
+            for i, name in enumerate(names):
+                if progress is not None:
+                    progress(i, len(names))
+                table = self.createDictTable(name)
+                self.c.execute(f"""
+                    INSERT INTO {table}(word, definition, language, key)
+                    SELECT word, definition, language, search_key(word) FROM dictionary
+                    WHERE dictname=?
+                    ORDER BY rowid
+                """, (name,))
+                self.removeDuplicates(name)
+                self.makeIndex(name)
+                self.updateAlphabet(name)
+                if has_zdicts:
+                    self.c.execute("""
+                        UPDATE dictionaries
+                        SET zdict=(SELECT zdict FROM zdicts WHERE zdicts.dictname=dictionaries.name)
+                        WHERE name=?
+                    """, (name,))
+            self.c.execute("DROP TABLE dictionary")
+            self.c.execute("DROP TABLE IF EXISTS zdicts")
+            self.conn.commit()
+            if progress is not None:
+                progress(len(names), len(names))
+            self.c.execute("VACUUM")
+        logger.info(f"Moved dictionaries in {time.time() - start:.2f} seconds")
+
+    def addSearchKeys(self) -> None:
+        "Add search keys to dictionaries imported by older versions"
+        names = [name for name in self.getDictNames()
+                 if "key" not in [row[1] for row in self.c.execute(
+                     f"PRAGMA table_info({self._writerTable(name)})")]]
+        if not names:
+            return
+        start = time.time()
+        for name in names:
+            table = self._writerTable(name)
+            self.c.execute(f"ALTER TABLE {table} ADD COLUMN key TEXT")
+            self.c.execute(f"UPDATE {table} SET key=search_key(word)")
+            self.makeIndex(name)
+            self.updateAlphabet(name)
+        self.conn.commit()
+        logger.info(f"Added search keys to {len(names)} dictionaries in {time.time() - start:.2f} seconds")
+
+    def updateAlphabet(self, name: str) -> None:
+        "Store the most common characters in the search keys of a dictionary"
+        if not (table := self._writerTable(name)):
+            return
+        n_rows = self.c.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        # Sample rows throughout the table rather than the first ones, which are often sorted
+        self.c.execute(f"SELECT key FROM {table} WHERE rowid % ? = 0 LIMIT ?",
+                       (max(1, n_rows // ALPHABET_SAMPLE_SIZE), ALPHABET_SAMPLE_SIZE))
+        counts = Counter(c for row in self.c.fetchall() if row[0] for c in row[0])
+        alphabet = "".join(c for c, _ in counts.most_common(ALPHABET_SIZE))
+        self.c.execute("UPDATE dictionaries SET alphabet=? WHERE name=?", (alphabet, name))
+
+    def createDictTable(self, name: str) -> str:
+        "Register a dictionary and create its table if it does not exist yet. Returns the table name"
+        if table := self._writerTable(name):
+            return table
+        self.c.execute("INSERT INTO dictionaries(name) VALUES(?)", (name,))
+        table = self.tableName(cast(int, self.c.lastrowid))
+        self.c.execute(f"""
+        CREATE TABLE {table} (
             word TEXT,
             definition TEXT,
             language TEXT,
-            dictname TEXT
+            key TEXT
         )
         """)
-        self.conn.commit()
+        return table
 
-    def importdict(self, data: dict[str, str], lang: str, name: str) -> None:
-        for item in data.items():
-            # Handle escape sequences
-            self.c.execute("""
-                INSERT INTO dictionary(word, definition, language, dictname)
-                VALUES(?, ?, ?, ?)
-                """,
-                           (
-                               item[0],
-                               item[1].replace("\\n", "\n"),
-                               lang,
-                               name
-                           )
-                           )
-        self.conn.commit()
+    def _writerTable(self, name: str) -> Optional[str]:
+        "Table of a dictionary as seen by the writer, which includes uncommitted imports"
+        row = self.c.execute("SELECT id FROM dictionaries WHERE name=?", (name,)).fetchone()
+        return self.tableName(row[0]) if row else None
+
+    def getTable(self, name: str) -> Optional[str]:
+        "Table of a dictionary, or None if there is no such dictionary"
+        if name not in self._tables:
+            row = self.pool.cursor().execute("SELECT id FROM dictionaries WHERE name=?", (name,)).fetchone()
+            if row is None:
+                # Not cached, it may still be imported
+                return None
+            self._tables[name] = self.tableName(row[0])
+        return self._tables[name]
+
+    def getDictNames(self) -> list[str]:
+        "Names of all dictionaries in the database"
+        return [row[0] for row in self.pool.cursor().execute("SELECT name FROM dictionaries ORDER BY id")]
+
+    def bulkImport(self, chunk_size: int = IMPORT_CHUNK_SIZE) -> BulkImporter:
+        """Start a bulk import. All importdict calls inside the with block
+        share a single transaction"""
+        if self._bulk is not None:
+            raise RuntimeError("A bulk import is already in progress")
+        self._bulk = BulkImporter(self, chunk_size)
+        return self._bulk
+
+    def importdict(self, data: dict[str, str] | Iterable[tuple[str, str]], lang: str, name: str) -> int:
+        "Import (headword, definition) pairs. Returns number of rows inserted"
+        entries = data.items() if isinstance(data, dict) else data
+        if self._bulk is not None:
+            return self._bulk.add(entries, lang, name)
+        with self.bulkImport() as importer:
+            return importer.add(entries, lang, name)
 
     def deletedict(self, name: str) -> None:
-        self.c.execute("""
-            DELETE FROM dictionary
-            WHERE dictname=?
-        """, (name,))
-        self.conn.commit()
-        self.c.execute("VACUUM")
+        self.removeCompiled(name)
+        with self.pool.lock:
+            if table := self._writerTable(name):
+                self.c.execute(f"DROP TABLE {table}")
+                self.c.execute("DELETE FROM dictionaries WHERE name=?", (name,))
+                self.conn.commit()
+                self.c.execute("PRAGMA incremental_vacuum")
+        self._tables.pop(name, None)
+        self._codecs.pop(name, None)
+        self._cognates.clear()
 
-    def getCognates(self, lang: str) -> sqlite3.Cursor:
-        return self.c.execute("""
-            SELECT word, definition FROM dictionary
+    def getCognates(self, lang: str) -> Iterator[tuple[str, str]]:
+        if (table := self.getTable("cognates")) is None:
+            return iter(())
+        c = self.pool.cursor().execute(f"""
+            SELECT word, definition FROM {table}
             WHERE language=?
-            AND dictname='cognates'
             """, (lang,))
+        return ((word, self.decode("cognates", definition)) for word, definition in c)
 
     def hasCognatesData(self) -> bool:
-        self.c.execute("""
-            SELECT COUNT(*) FROM dictionary
-            WHERE dictname='cognates'
-            """)
-        return bool(self.c.fetchone()[0] > 0)
+        if (table := self.getTable("cognates")) is None:
+            return False
+        c = self.pool.cursor()
+        c.execute(f"SELECT EXISTS(SELECT 1 FROM {table})")
+        return bool(c.fetchone()[0])
 
     def define(self, word: str, lang: str, name: str) -> str:
         """
         Get definition from database
         Should raise KeyError if word not found
         """
-        self.c.execute("""
-            SELECT definition FROM dictionary
+        if (table := self.getTable(name)) is None:
+            raise KeyError(f"Dictionary {name} not found")
+        c = self.pool.cursor()
+        c.execute(f"""
+            SELECT definition FROM {table}
             WHERE word=?
             AND language=?
-            AND dictname=?
-            """, (word, lang, name))
-        if results := self.c.fetchone():
-            return str(results[0])
+            """, (word, lang))
+        if results := c.fetchone():
+            return self.decode(name, results[0])
         else:
             raise KeyError(f"Word {word} not found in {name}")
 
+    def define_many(self, words: Iterable[str], lang: str, name: str) -> dict[str, str]:
+        """
+        Get definitions for many words at once
+        Returns a dict of word to definition; words not found are omitted
+        """
+        words = list(dict.fromkeys(words))
+        result: dict[str, str] = {}
+        if (table := self.getTable(name)) is None:
+            return result
+        c = self.pool.cursor()
+        for i in range(0, len(words), DEFINE_MANY_CHUNK_SIZE):
+            chunk = words[i:i + DEFINE_MANY_CHUNK_SIZE]
+            c.execute(f"""
+                SELECT word, definition FROM {table}
+                WHERE language=?
+                AND word IN ({",".join("?" * len(chunk))})
+                """, (lang, *chunk))
+            result.update((word, self.decode(name, definition)) for word, definition in c.fetchall())
+        return result
+
+    def getAlphabet(self, name: str) -> str:
+        row = self.pool.cursor().execute("SELECT alphabet FROM dictionaries WHERE name=?", (name,)).fetchone()
+        return (row[0] or "") if row else ""
+
+    def suggest(self, word: str, lang: str, name: str, limit: int = 10, prefix: bool = True) -> list[str]:
+        """
+        Get headwords similar to a word, best matches first:
+        the same up to case and diacritics, then one edit away, then (if prefix) starting with it
+        """
+        if (table := self.getTable(name)) is None or not (key := search_key(word)):
+            return []
+        c = self.pool.cursor()
+        found: dict[str, None] = {}
+        c.execute(f"""
+            SELECT word FROM {table}
+            WHERE language=? AND key=?
+            ORDER BY word
+            """, (lang, key))
+        found.update((row[0], None) for row in c.fetchall())
+
+        candidates = sorted(edits1(key, self.getAlphabet(name)))
+        close: list[tuple[str, str]] = []
+        for i in range(0, len(candidates), DEFINE_MANY_CHUNK_SIZE):
+            chunk = candidates[i:i + DEFINE_MANY_CHUNK_SIZE]
+            c.execute(f"""
+                SELECT key, word FROM {table}
+                WHERE language=?
+                AND key IN ({",".join("?" * len(chunk))})
+                """, (lang, *chunk))
+            close.extend(c.fetchall())
+        # Prefer candidates of the same length, which are likelier to be typos than missing letters
+        close.sort(key=lambda row: (abs(len(row[0]) - len(key)), row[0], row[1]))
+        found.update((word_, None) for _, word_ in close)
+
+        if prefix and len(found) < limit:
+            c.execute(f"""
+                SELECT word FROM {table}
+                WHERE language=?
+                AND key > ? AND key < ?
+                ORDER BY key, word
+                LIMIT ?
+                """, (lang, key, key + "\U0010ffff", limit))
+            found.update((row[0], None) for row in c.fetchall())
+        return list(found)[:limit]
+
     def getAllWords(self, lang: str, name: str) -> list[tuple[str, str]]:
         """
         Get all words from database
         Should raise KeyError if word not found
         """
-        self.c.execute("""
-        SELECT word, definition FROM dictionary
+        if (table := self.getTable(name)) is None:
+            raise KeyError(f"Dictionary {name} not found")
+        c = self.pool.cursor()
+        c.execute(f"""
+        SELECT word, definition FROM {table}
         WHERE language=?
-        AND dictname=?
-        """, (lang, name))
-        return self.c.fetchall()
+        """, (lang,))
+        return [(word, self.decode(name, definition)) for word, definition in c.fetchall()]
 
     def countEntries(self) -> int:
-        self.c.execute("""
-        SELECT COUNT(*) FROM dictionary
-        """)
-        return int(self.c.fetchone()[0])
+        return sum(self.countEntriesDict(name) for name in self.getDictNames())
 
     def countEntriesDict(self, name) -> int:
-        self.c.execute("""
-        SELECT COUNT(*) FROM dictionary
-        WHERE dictname=?
-        """, (name,))
-        return int(self.c.fetchone()[0])
+        if (table := self.getTable(name)) is None:
+            return 0
+        c = self.pool.cursor()
+        c.execute(f"""
+        SELECT COUNT(*) FROM {table}
+        """)
+        return int(c.fetchone()[0])
 
     def countDicts(self) -> int:
-        self.c.execute("""
-        SELECT COUNT(DISTINCT dictname) FROM dictionary
+        c = self.pool.cursor()
+        c.execute("""
+        SELECT COUNT(*) FROM dictionaries
         """)
-        return int(self.c.fetchone()[0])
+        return int(c.fetchone()[0])
 
     def getNamesForLang(self, lang: str) -> list[str]:
-        self.c.row_factory = lambda cursor, row: row[0]
-        self.c.execute("""
-        SELECT DISTINCT dictname FROM dictionary
-        WHERE language=?
-        """, (lang,))
-        res = self.c.fetchall()
-        self.c.row_factory = None
-        return res
+        names = []
+        c = self.pool.cursor()
+        for name in self.getDictNames():
+            if table := self.getTable(name):
+                c.execute(f"SELECT EXISTS(SELECT 1 FROM {table} WHERE language=?)", (lang,))
+                if c.fetchone()[0]:
+                    names.append(name)
+        return names
 
     def purge(self) -> None:
-        self.c.execute("""
-        DROP TABLE IF EXISTS dictionary
-        """)
-        self.createTables()
-        self.c.execute("VACUUM")
+        with self._compiled_lock:
+            self._closeCompiled(list(self._compiled))
+            self._removeCompiledFiles(self.compiled_path)
+        self._codecs.clear()
+        self._tables.clear()
+        self._cognates.clear()
+        with self.pool.lock:
+            tables = [row[0] for row in self.c.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'dict\\_%' ESCAPE '\\'").fetchall()]
+            for table in tables:
+                self.c.execute(f"DROP TABLE {table}")
+            self.c.execute("""
+            DROP TABLE IF EXISTS dictionaries
+            """)
+            self.createTables()
+            self.c.execute("VACUUM")
+
+    def recordSource(self, name: str, path: str, dicttype: str, lang: str) -> None:
+        "Remember the files a dictionary was imported from, so that unchanged ones can be skipped later"
+        files = source_files(path, dicttype)
+        size, mtime = source_fingerprint(files)
+        with self.pool.lock:
+            self.c.execute("""
+                UPDATE dictionaries
+                SET source_path=?, source_size=?, source_mtime=?, source_hash=?, source_type=?, source_lang=?
+                WHERE name=?
+            """, (path, size, mtime, source_hash(files, dicttype), dicttype, lang, name))
+            if self._bulk is None:
+                self.conn.commit()
+
+    def isUnchanged(self, name: str, path: str, dicttype: str, lang: str) -> bool:
+        "Whether a dictionary was imported from the same files as they are now, with the same type and language"
+        row = self.pool.cursor().execute("""
+            SELECT source_path, source_type, source_lang, source_size, source_mtime, source_hash FROM dictionaries
+            WHERE name=?
+            """, (name,)).fetchone()
+        if row is None or row[:3] != (path, dicttype, lang):
+            return False
+        old_size, old_mtime, old_hash = row[3:]
+        try:
+            files = source_files(path, dicttype)
+            size, mtime = source_fingerprint(files)
+        except OSError:
+            return False
+        if size != old_size:
+            return False
+        if mtime == old_mtime:
+            return True
+        # Touched, but the contents may still be the same
+        if old_hash is not None and source_hash(files, dicttype) == old_hash:
+            with self.pool.lock:
+                self.c.execute("UPDATE dictionaries SET source_mtime=? WHERE name=?", (mtime, name))
+                self.conn.commit()
+            return True
+        return False
+
+    def getCodec(self, name: str) -> Optional[DefinitionCodec]:
+        "Get the codec of a dictionary, or None if its definitions are not compressed"
+        if name not in self._codecs:
+            row = self.pool.cursor().execute("SELECT zdict FROM dictionaries WHERE name=?", (name,)).fetchone()
+            if row is None or row[0] is None:
+                # Not cached, one may be trained later
+                return None
+            self._codecs[name] = DefinitionCodec(row[0])
+        return self._codecs[name]
+
+    def trainCodec(self, name: str, samples: Iterable[str]) -> DefinitionCodec:
+        "Train a compression dictionary for a dictionary from sample definitions and store it"
+        zdict = train_zdict(samples)
+        with self.pool.lock:
+            self.c.execute("UPDATE dictionaries SET zdict=? WHERE name=?", (zdict, name))
+        codec = DefinitionCodec(zdict)
+        self._codecs[name] = codec
+        return codec
+
+    def decode(self, name: str, value: str | bytes) -> str:
+        "Decompress a definition read from the database"
+        if isinstance(value, bytes):
+            return cast(DefinitionCodec, self.getCodec(name)).decode(value)
+        return str(value)
+
+    def compressExisting(self, progress: Optional[Callable[[int, int], None]] = None) -> tuple[int, int]:
+        """
+        Compress the definitions of dictionaries that were imported uncompressed
+        progress is called with (dictionaries done, total dictionaries)
+        Returns the database size in bytes before and after
+        """
+        size_before = self.databaseSize()
+        with self.pool.lock:
+            self.conn.commit()
+            names = self.getDictNames()
+            for i, name in enumerate(names):
+                if progress is not None:
+                    progress(i, len(names))
+                table = cast(str, self._writerTable(name))
+                if (codec := self.getCodec(name)) is None:
+                    self.c.execute(f"""
+                        SELECT definition FROM {table}
+                        LIMIT ?
+                        """, (ZDICT_SAMPLE_SIZE,))
+                    codec = self.trainCodec(name, (str(row[0]) for row in self.c.fetchall()))
+                last_rowid = 0
+                while True:
+                    self.c.execute(f"""
+                        SELECT rowid, definition FROM {table}
+                        WHERE typeof(definition)='text'
+                        AND rowid>?
+                        ORDER BY rowid
+                        LIMIT ?
+                        """, (last_rowid, IMPORT_CHUNK_SIZE))
+                    rows = self.c.fetchall()
+                    if not rows:
+                        break
+                    last_rowid = rows[-1][0]
+                    self.c.executemany(
+                        f"UPDATE {table} SET definition=? WHERE rowid=?",
+                        [(encoded, rowid) for rowid, definition in rows
+                         if isinstance(encoded := codec.encode(definition), bytes)])
+                self.conn.commit()
+                logger.info(f"Compressed {name}")
+            if progress is not None:
+                progress(len(names), len(names))
+            self.c.execute("VACUUM")
+        size_after = self.databaseSize()
+        logger.info(f"Compressed dictionary database from {size_before} to {size_after} bytes")
+        return size_before, size_after
+
+    def databaseSize(self) -> int:
+        "Size of the database in bytes, not counting the write-ahead log"
+        c = self.pool.cursor()
+        page_count = c.execute("PRAGMA page_count").fetchone()[0]
+        page_size = c.execute("PRAGMA page_size").fetchone()[0]
+        return int(page_count * page_size)
+
+    def compiledFile(self, lang: str, name: str) -> str:
+        "Path of the compiled copy of a dictionary. Names can contain anything, so they are hashed"
+        return os.path.join(self.compiled_path, hashlib.sha1(name.encode("utf-8")).hexdigest(), lang + ".vsd")
+
+    def compileDictionary(self, lang: str, name: str) -> str:
+        """
+        Write a compiled, memory-mappable copy of a dictionary for faster lookups
+        Returns the path of the compiled file
+        """
+        start = time.time()
+        if (table := self.getTable(name)) is None:
+            raise KeyError(f"Dictionary {name} not found")
+        path = self.compiledFile(lang, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        c = self.pool.cursor()
+        c.execute(f"""
+            SELECT COUNT(*) FROM {table}
+            WHERE language=?
+            """, (lang,))
+        n_entries = int(c.fetchone()[0])
+        # BINARY collation sorts by UTF-8 bytes, which is the order the compiled file needs
+        c.execute(f"""
+            SELECT word, definition FROM {table}
+            WHERE language=?
+            ORDER BY word
+            """, (lang,))
+
+        def replace(tmp_path: str, path: str) -> None:
+            # The old file has to be closed before it can be replaced on Windows
+            with self._compiled_lock:
+                self._closeCompiled([(lang, name)])
+                os.replace(tmp_path, path)
+        write_compiled(path, ((word, self.decode(name, definition or "")) for word, definition in c), n_entries,
+                       replace)
+        logger.info(f"Compiled {name} ({lang}), {n_entries} entries in {time.time() - start:.2f} seconds")
+        return path
+
+    def getCompiled(self, lang: str, name: str) -> Optional[CompiledDictionary]:
+        "Get the compiled copy of a dictionary, or None if it has not been compiled"
+        key = (lang, name)
+        with self._compiled_lock:
+            if key not in self._compiled:
+                path = self.compiledFile(lang, name)
+                try:
+                    self._compiled[key] = CompiledDictionary(path) if os.path.exists(path) else None
+                except ValueError as e:
+                    logger.warning(repr(e))
+                    self._compiled[key] = None
+            return self._compiled[key]
+
+    def _closeCompiled(self, keys: Iterable[tuple[str, str]]) -> None:
+        """Close compiled copies so that their files can be replaced or removed, must hold _compiled_lock
+        Lookups already searching them finish first, later ones fall back to the database"""
+        for key in keys:
+            if (compiled := self._compiled.pop(key, None)) is not None:
+                compiled.close()
+
+    @staticmethod
+    def _removeCompiledFiles(path: str) -> None:
+        if not os.path.exists(path):
+            return
+        try:
+            shutil.rmtree(path)
+        except OSError as e:
+            logger.error(f"Could not remove compiled dictionaries at {path}: {repr(e)}")
+
+    def removeCompiled(self, name: str) -> None:
+        "Delete the compiled copies of a dictionary in all languages"
+        with self._compiled_lock:
+            self._closeCompiled([key for key in self._compiled if key[1] == name])
+            self._removeCompiledFiles(os.path.dirname(self.compiledFile("", name)))
 
     @staticmethod
     def regularize_headword(word: str) -> str:
         "If headword is all caps, convert it to all lowercase"
-        return removeAccents(word.lower() if word.isupper() else word)
+        return regularize_headword(word)
 
-    def dictimport(self, path, dicttype, lang, name) -> None:
-        "Import dictionary from file to database"
-        d: dict[str, str] = {}
-        if dicttype == "stardict":
-            stardict = Dictionary(os.path.splitext(path)[0], in_memory=True)
-            if stardict.ifo.sametypesequence == 'x':
-                for key in stardict.idx.keys():
+    def dictimport(self, path, dicttype, lang, name,
+                   progress: Optional[Callable[[int, int], None]] = None,
+                   processes: Optional[int] = None) -> int:
+        """Import dictionary from file to database. Returns number of rows imported
+        progress is called with (bytes processed, total bytes) for formats that support it
+        processes limits parsers that use a process pool, by default one per core"""
+        if self._bulk is None:
+            with self.bulkImport():
+                return self.dictimport(path, dicttype, lang, name, progress, processes)
+        count = self._dictimport(path, dicttype, lang, name, progress, processes)
+        self.recordSource(name, path, dicttype, lang)
+        return count
 
-                    d[self.regularize_headword(key)] = xdxf2text(stardict.dict[key])
-            else:
-                for key in stardict.idx.keys():
-                    d[self.regularize_headword(key)] = stardict.dict[key]
-            self.importdict(d, lang, name)
-        elif dicttype == "json":
-            with zopen(path) as f:
-                d = json.load(f)
-                self.importdict(d, lang, name)
-        elif dicttype == "migaku":
-            with zopen(path) as f:
-                data = json.load(f)
-                for item in data:
-                    key = self.regularize_headword(item['term'])
-                    if not d.get(key):  # fix for duplicate entries
-                        d[key] = item['definition']
-                    else:
-                        d[key] += "\n" + item['definition']
-                self.importdict(d, lang, name)
-        elif dicttype == "wiktdump":
-            self.importdict(parseKaikki(path, lang), lang, name)
-        elif dicttype == "freq":
-            with zopen(path) as f:
-                data = json.load(f)
-                i = 0
-                for word in data:
-                    if word and not word[0].isupper():  # Ignore proper nouns
-                        d[self.regularize_headword(word)] = str(i + 1)
-                        i += 1
-                self.importdict(d, lang, name)
-        elif dicttype == "audiolib":
-            # Audios will be stored as a serialized json list
-            filelist = []
-            list_d: dict[str, list[str]] = {}
-            for root, _, files in os.walk(path):
-                for item in files:
-                    filelist.append(
-                        os.path.relpath(
-                            os.path.join(
-                                root, item), path))
-            for item in filelist:
-                headword = os.path.basename(os.path.splitext(item)[0]).lower()
-                if not list_d.get(headword):
-                    list_d[self.regularize_headword(headword)] = [item]
-                else:
-                    list_d[self.regularize_headword(headword)].append(item)
-            for word, audios in list_d.items():
-                d[word] = json.dumps(audios)
-            self.importdict(d, lang, name)
-        elif dicttype == 'mdx':
-            d = parseMDX(path)
-            self.importdict(d, lang, name)
-        elif dicttype == "dsl":
-            d = parseDSL(path)
-            self.importdict(d, lang, name)
-        elif dicttype == "csv":
-            d = parseCSV(path)
-            self.importdict(d, lang, name)
-        elif dicttype == "tsv":
-            d = parseTSV(path)
-            self.importdict(d, lang, name)
-        elif dicttype == "cognates":
-            with zopen(path) as f:
-                cognates_d: dict[str, dict[str, list[str]]] = json.load(f)
-            for lang_ in cognates_d:
-                data = {k: json.dumps(v) for k, v in cognates_d[lang_].items()}
-                self.importdict(data, lang_, name)
-        else:
-            raise ValueError(f"Unknown dictionary type {dicttype}")
+    def _dictimport(self, path, dicttype, lang, name, progress, processes=None) -> int:
+        count = 0
+        for lang_, entries in parse_dictionary(path, dicttype, lang, progress=progress, processes=processes):
+            count += self.importdict(entries, lang_, name)
+        return count
 
     def dictdelete(self, name) -> None:
         self.deletedict(name)
 
-    def getCognatesData(self, language: str, known_langs: list[str]) -> set[str]:
-        "Get all cognates from the local database in a given language"
-        data = self.getCognates(language)
+    def getCognatesData(self, language: str, known_langs: list[str]) -> frozenset[str]:
+        """Get all cognates from the local database in a given language
+        The result is cached until the cognates data changes"""
         known_langs = [lang.strip() for lang in known_langs]
-        if not known_langs:
-            return set()
-        if not known_langs[0]:
-            return set()
-        cognates = []
-        for word, cognates_in in data:
-            for lang in known_langs:
-                if lang in cognates_in:
-                    cognates.append(word)
-                    break
-        return set(cognates)
-
+        if not known_langs or not known_langs[0]:
+            return frozenset()
+        if (table := self.getTable("cognates")) is None:
+            return frozenset()
+        # Reimporting creates new rows, so the last rowid tells whether the data changed
+        last_row = self.pool.cursor().execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0]
+        key = (language, tuple(known_langs), table, last_row)
+        if (cognates := self._cognates.get(key)) is None:
+            start = time.time()
+            # Each word has a JSON list of languages, a quoted language only matches a whole item
+            patterns = [json.dumps(lang) for lang in known_langs]
+            cognates = frozenset(word for word, cognates_in in self.getCognates(language)
+                                 if any(pattern in cognates_in for pattern in patterns))
+            self._cognates = {key: cognates}
+            logger.debug(f"Loaded {len(cognates)} cognates in {time.time() - start:.2f} seconds")
+        return cognates
 
 dictdb = LocalDictionary(datapath_)
@@ -3,6 +3,7 @@ import dataclasses
 import importlib.metadata
 import os
 import sys
+import threading
 import time
 import re
 from datetime import datetime
@@ -16,7 +17,7 @@ from loguru import logger
 from markdown import markdown
 from PyQt5.QtCore import QCoreApplication, QStandardPaths, QTimer, QDateTime, QThread, QUrl, pyqtSlot, QThreadPool, pyqtSignal, Qt
 from PyQt5.QtGui import QClipboard, QKeySequence, QPixmap, QDesktopServices, QImage, QTextCursor
-from PyQt5.QtWidgets import QApplication, QMessageBox, QAction, QShortcut, QFileDialog
+from PyQt5.QtWidgets import QApplication, QMessageBox, QAction, QShortcut, QFileDialog, QProgressDialog
 
 import qdarktheme
 
@@ -30,15 +31,12 @@ from .importer import KindleVocabImporter, KoreaderVocabImporter, AutoTextImport
 from .reader import ReaderServer
 from .contentmanager import ContentManager
 from .tools import (
-    compute_word_score,
     failCards,
     is_json,
     make_audio_source_group,
-    modelFieldNames,
     prepareAnkiNoteDict,
     is_oneword,
     addNote,
-    findNotes,
     guiBrowse,
     make_dict_source,
     getVersion,
@@ -46,10 +44,13 @@ from .tools import (
     remove_punctuations,
     unix_milliseconds_to_datetime_str,
     apply_word_rules)
+from .anki_connect import get_client, request as anki_request
 from .ui import MainWindowBase, WordMarkingDialog
+from .known_data import KnownDataStore
 from .models import (AudioSourceGroup, KnownMetadata, LookupRecord, SRSNote, TrackingDataError,
-                     WordRecord, LookupTrigger)
-from .lemmatizer import lem_word
+                     WordActionWeights, WordRecord, LookupTrigger)
+from .lemmatizer import lem_word, use_lemma_cache
+from .tokenizer import tokenize, lemmatize_tokens
 from .uncaught_hook import ExceptionCatcher
 
 
@@ -63,7 +64,7 @@ class MainWindow(MainWindowBase):
         self.catcher = ExceptionCatcher()
         self.datapath = datapath
         self.thread_manager = QThreadPool()
-        self.known_data: Optional[dict[str, WordRecord]] = None
+        self.known_data: Optional[KnownDataStore] = None
         self.known_metadata: Optional[KnownMetadata] = None
         self.known_data_timestamp: float = 0
         self.last_got_focus: float = time.time()
@@ -72,7 +73,10 @@ class MainWindow(MainWindowBase):
         self.previous_word: str = ""
         self.previous_trigger: LookupTrigger = LookupTrigger.double_clicked
         self.pause_polling: bool = False
-        self.cognates: set[str] = set()
+        self.cognates: frozenset[str] = frozenset()
+        # Known data, weights and cognates the known words were computed from, and the result
+        self._known_words_cache: Optional[tuple[KnownDataStore, WordActionWeights, frozenset[str],
+                                                tuple[frozenset[str], frozenset[str]]]] = None
         app.applicationStateChanged.connect(self.onApplicationStateChanged)
         self.setupMenu()
         self.setupButtons()
@@ -80,6 +84,7 @@ class MainWindow(MainWindowBase):
         self.setupShortcuts()
         self.checkUpdatesOnThread()
         self.initSources()
+        self.loadKnownData()
         self.initTimers()
         self.got_updates.connect(self.gotUpdatesInfo)
 
@@ -334,6 +339,9 @@ class MainWindow(MainWindowBase):
         words = self.freq_widget.getAllWords()
         dialog = WordMarkingDialog(self, words)
         dialog.exec()
+        # The record applied the new modifiers to its known data
+        if self.rec.last_known_data is not None:
+            self.known_data, self.known_metadata = self.rec.last_known_data
 
     def onOpenDataFolder(self):
         QDesktopServices.openUrl(QUrl.fromLocalFile(datapath))
@@ -361,28 +369,25 @@ class MainWindow(MainWindowBase):
         elif self.known_data is None:
             self.warnKnownDataNotReady()
 
-    def getKnownWords(self) -> tuple[list[str], list[str]]:
-        if self.known_data is not None:
-            langcode = settings.value('target_language', 'en')
-            known_threshold = settings.value('tracking/known_threshold', 100, type=int)
-            known_threshold_cognate = settings.value('tracking/known_threshold_cognate', 25, type=int)
-            known_words: list[str] = []
-            known_cognates: list[str] = []
-            self.cognates = set()
-            if dictdb.hasCognatesData():
-                known_langs = settings.value('tracking/known_langs', 'en').split(",")
-                self.cognates = dictdb.getCognatesData(langcode, known_langs)
-            waw = self.getWordActionWeights()
-            for word, word_record in self.known_data.items():
-                score = compute_word_score(word_record, waw)
-                if score >= known_threshold:
-                    known_words.append(word)
-                elif (score >= known_threshold_cognate) and (word in self.cognates):
-                    known_words.append(word)
-                    known_cognates.append(word)
-            return known_words, known_cognates
-        else:
-            return [], []
+    def getKnownWords(self) -> tuple[frozenset[str], frozenset[str]]:
+        """Known words and the cognates among them
+        They are only computed again when the known data, weights, thresholds or cognates changed.
+        Known data is replaced by a new store whenever it or the modifiers change"""
+        if self.known_data is None:
+            return frozenset(), frozenset()
+        langcode = settings.value('target_language', 'en')
+        self.cognates = frozenset()
+        if dictdb.hasCognatesData():
+            known_langs = settings.value('tracking/known_langs', 'en').split(",")
+            self.cognates = dictdb.getCognatesData(langcode, known_langs)
+        waw = self.getWordActionWeights()
+        cached = self._known_words_cache
+        if cached is not None and cached[0] is self.known_data and cached[1] == waw and cached[2] is self.cognates:
+            return cached[3]
+        known_words, known_cognates = self.known_data.knownWords(waw, self.cognates)
+        result = frozenset(known_words), frozenset(known_cognates)
+        self._known_words_cache = (self.known_data, waw, self.cognates, result)
+        return result
 
     def exportKnownWords(self):
         path, _ = QFileDialog.getSaveFileName(
@@ -401,7 +406,7 @@ class MainWindow(MainWindowBase):
             return
         known_words, _ = self.getKnownWords()
         with open(path, 'w', encoding='utf-8') as file:
-            json.dump(known_words, file, indent=4, ensure_ascii=False)
+            json.dump(sorted(known_words), file, indent=4, ensure_ascii=False)
 
     def checkDataAvailability(self) -> TrackingDataError:
         # Check is Anki enabled
@@ -420,6 +425,13 @@ class MainWindow(MainWindowBase):
         # fieldmap is set
         return TrackingDataError.no_errors
 
+    def loadKnownData(self) -> None:
+        "Use the known data saved in the last session until it is refreshed"
+        known_data = self.rec.loadKnownSnapshot()
+        if known_data is not None:
+            self.known_data, self.known_metadata = known_data
+            self.known_data_timestamp = time.time()
+
     @pyqtSlot()
     def getKnownDataOnThread(self) -> None:
         if self.checkDataAvailability() != TrackingDataError.no_errors:
@@ -746,43 +758,51 @@ class MainWindow(MainWindowBase):
         We support using either sentence or word as first field
         word is already lemmatized
         Returns note ids if card with word found in Anki, None if not found"""
-        if self.checkAnkiConnect() == 0:
-            return []
         api = settings.value("anki_api", "http://127.0.0.1:8765")
 
         note_type = settings.value("note_type")
+        word_field = settings.value("word_field")
+        sentence_field = settings.value("sentence_field")
+        queries = {
+            "word": f"\"{word_field}:{word}\"",
+            "sentence": f"\"{sentence_field}:{sentence}\""
+        }
+        # Get the fields and look up both candidates for the first field in one round trip
         logger.debug(f'Trying to obtain fields for note type "{note_type}"')
-
-        fields = modelFieldNames(api, note_type)
+        try:
+            fields, *found = get_client(api).multi([
+                anki_request("modelFieldNames", modelName=note_type),
+                *(anki_request("findNotes", query=query) for query in queries.values())
+            ])
+        except Exception as e:
+            logger.error(f"Could not check for duplicates: {repr(e)}")
+            self.note_type_first_field = ""
+            return []
         logger.debug(f'Fields for note type "{note_type}": {fields}')
-        if not fields:
+        if isinstance(fields, Exception) or not fields:
             logger.error(f"Could not obtain fields for note type {note_type}")
             self.note_type_first_field = ""
             return []
-        if fields[0] == settings.value("word_field"):
+        if fields[0] == word_field:
             logger.info(
                 f'First field is word field, trying to find a note with field "{fields[0]}" having value "{word}"')
-            find_query = f"\"{fields[0]}:{word}\""
             self.note_type_first_field = "word"
-        elif fields[0] == settings.value("sentence_field"):
+        elif fields[0] == sentence_field:
             logger.info(
                 f'First field is sentence field, trying to find a note with field "{fields[0]}" having value "{sentence}"')
-            find_query = f"\"{fields[0]}:{sentence}\""
             self.note_type_first_field = "sentence"
         else:
             logger.error(f"First field is neither word field nor sentence field, skipping checking for duplicates")
             return []
-        try:
-            notes_found = findNotes(api, find_query)
-
-            if notes_found:
-                logger.debug(f"Found notes for \"{word}\": {notes_found}")
-                return cast(list[int], notes_found)
-            else:
-                logger.debug("Did not find Anki note")
-                return []
-        except Exception:
-            logger.debug("Did not find Anki note with query: " + find_query)
+        notes_found = dict(zip(queries, found))[self.note_type_first_field]
+        if isinstance(notes_found, Exception):
+            logger.debug("Did not find Anki note with query: " + queries[self.note_type_first_field])
+            return []
+        if notes_found:
+            logger.debug(f"Found notes for \"{word}\": {notes_found}")
+            return cast(list[int], notes_found)
+        else:
+            logger.debug("Did not find Anki note")
             return []
 
     def lookup(self, target: str, no_lemma=False, trigger=LookupTrigger.double_clicked) -> None:
@@ -918,11 +938,11 @@ class MainWindow(MainWindowBase):
         # Add bold underscores around for each word with the same lemma
         lemma = lem_word(word, self.getLanguage())
         already_bolded = set()
-        for token in sentence_text.split():
-            token = re.sub('[\\?\\.!«»…()\\[\\]]*', "", token)
-            if lem_word(token, self.getLanguage()) == lemma and token not in already_bolded:
-                self.sentence.bold(token)
-                already_bolded.add(token)
+        tokens = list(tokenize(sentence_text, self.getLanguage()))
+        for token, token_lemma in zip(tokens, lemmatize_tokens(tokens, self.getLanguage())):
+            if token_lemma == lemma and token.form not in already_bolded:
+                self.sentence.bold(token.form)
+                already_bolded.add(token.form)
 
     def getLanguage(self) -> str:
         return settings.value("target_language", "en")  # type: ignore
@@ -1103,6 +1123,23 @@ class MainWindow(MainWindowBase):
             self.thread2.start()
 
 
+def migrateDictionaries() -> None:
+    "Upgrade a dictionary database of an older version, showing progress"
+    progress = QProgressDialog("Upgrading dictionary database..", None, 0, 0)
+    progress.setWindowTitle("VocabSieve")
+    progress.setMinimumDuration(0)
+
+    def update(done: int, total: int) -> None:
+        progress.setMaximum(total)
+        progress.setValue(done)
+        if done == total:
+            progress.setLabelText("Compacting dictionary database..")
+        QCoreApplication.processEvents()
+
+    dictdb.migrateLegacy(update)
+    progress.close()
+
+
 def main():
     # In Windows 11 QToolTip background color is not displayed correctly in dark theme.
     # To get the theme to work properly on Windows 11, add an additional qss that removes the border.
@@ -1117,6 +1154,12 @@ def main():
             qdarktheme.setup_theme(theme, additional_qss=qss)
    # if using system, don't set up theme
 
+    if dictdb.needsMigration():
+        migrateDictionaries()
+
+    lemma_cache = use_lemma_cache(os.path.join(datapath, "lemmas.db"))
+    threading.Thread(target=lemma_cache.warm, args=(settings.value("target_language", "en"),), daemon=True).start()
+
     w = MainWindow()
 
     w.show()
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Any, Optional
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Iterable, Optional, TypeVar
 from enum import Enum
 from bs4 import BeautifulSoup
 import time
@@ -7,7 +7,7 @@ import re
 from markdownify import markdownify
 from .format import markdown_nop
 
-from .lemmatizer import lem_word
+from .lemmatizer import lem_word, lemmatize_many
 
 
 @dataclass(frozen=True, slots=True)
@@ -18,6 +18,7 @@ class Definition:
     source: str
     definition: Optional[str] = None
     error: Optional[str] = None
+    suggestion: bool = False  # Closest headword to lookup_term, which was not found itself
 
 
 @dataclass(frozen=True, slots=True)
@@ -172,6 +173,32 @@ class WordActionWeights:
     threshold_cognate: int
 
 
+def lemma_policy_terms(policy: LemmaPolicy, word: str, lemma: str) -> tuple[list[str], list[str]]:
+    '''
+    Get the terms to look up for a word according to a LemmaPolicy
+    Returns the terms to look up, and the terms to look up only if the first one fails
+    '''
+    match policy:
+        case LemmaPolicy.no_lemma:
+            return [word], []
+        case LemmaPolicy.only_lemma:
+            return [lemma], []
+        case LemmaPolicy.try_original:
+            return [word], [lemma]
+        case LemmaPolicy.try_lemma:
+            return [lemma], [word]
+        case LemmaPolicy.first_lemma:
+            return ([lemma, word] if word != lemma else [lemma]), []
+        case LemmaPolicy.first_original:
+            return ([word, lemma] if word != lemma else [word]), []
+    return [], []
+
+
+# Raw lookup results and the items they are formatted into, for Source._define_terms
+_Result = TypeVar("_Result", LookupResult, AudioLookupResult)
+_Item = TypeVar("_Item", Definition, AudioDefinition)
+
+
 class Source:
     '''Represents an abstract interface to a source of information in a language'''
     INTERNET = True
@@ -184,6 +211,32 @@ class Source:
         '''Get definitions for a word'''
         raise NotImplementedError
 
+    def _define_terms(self, words: Iterable[str], no_lemma: bool, lemma_policy: LemmaPolicy,
+                      lookup_many: Callable[[Iterable[str]], dict[str, _Result]],
+                      fmt_result: Callable[[str, str, _Result], _Item]
+                      ) -> tuple[dict[str, list[_Item]], dict[str, _Result]]:
+        '''Look up many words according to a LemmaPolicy, all terms in batches
+        Returns the formatted items of each word, and the results of each term looked up'''
+        words = list(words)
+        lemmas = words if no_lemma else lemmatize_many(words, self.langcode)
+        plans: dict[str, tuple[list[str], list[str]]] = {}
+        for word, lemma in zip(words, lemmas):
+            if no_lemma:
+                plans[word] = ([word], [])
+            else:
+                plans[word] = lemma_policy_terms(lemma_policy, word, lemma)
+        results = lookup_many({term for terms, _ in plans.values() for term in terms})
+        items = {word: [fmt_result(term, word, results[term]) for term in terms]
+                 for word, (terms, _) in plans.items()}
+
+        # Fallback terms are only looked up for words where the first lookup failed
+        failed = [word for word in plans if items[word][0].error is not None]
+        fallback_terms = {term for word in failed for term in plans[word][1]}
+        results.update(lookup_many(fallback_terms - results.keys()))
+        for word in failed:
+            items[word].extend(fmt_result(term, word, results[term]) for term in plans[word][1])
+        return items, results
+
 
 class FreqSource(Source):
     '''Represents an interface to a frequency list'''
@@ -198,9 +251,23 @@ class FreqSource(Source):
             return self._lookup(lem_word(word, self.langcode))
         return self._lookup(word)
 
+    def define_many(self, words: Iterable[str]) -> dict[str, int]:
+        '''Get the frequencies of many words at once'''
+        if self.lemmatized:
+            words = list(words)
+            terms = dict(zip(words, lemmatize_many(words, self.langcode)))
+        else:
+            terms = {word: word for word in words}
+        results = self._lookup_many(set(terms.values()))
+        return {word: results[term] for word, term in terms.items()}
+
     def _lookup(self, word: str) -> int:
         raise NotImplementedError
 
+    def _lookup_many(self, words: Iterable[str]) -> dict[str, int]:
+        '''Subclass may override this method to look up words in a batch'''
+        return {word: self._lookup(word) for word in words}
+
 
 class AudioSource(Source):
     def __init__(self, name: str, langcode: str, lemma_policy: LemmaPolicy) -> None:
@@ -209,42 +276,14 @@ class AudioSource(Source):
 
     def define(self, word: str, no_lemma=False) -> list[AudioDefinition]:
         "Get definitions according to LemmaPolicy"
-        items = []
-        lemma = lem_word(word, self.langcode)
-        if no_lemma:
-            return [self._fmt_lookup(word, word)]
-
-        if self.lemma_policy == LemmaPolicy.no_lemma:
-            items.append(self._fmt_lookup(word, word))
-
-        elif self.lemma_policy == LemmaPolicy.only_lemma:
-            items.append(self._fmt_lookup(lemma, word))
-
-        elif self.lemma_policy == LemmaPolicy.try_original:
-            items.append(self._fmt_lookup(word, word))
-            if items[0].error is not None:
-                items.append(self._fmt_lookup(lemma, word))
-
-        elif self.lemma_policy == LemmaPolicy.try_lemma:
-            items.append(self._fmt_lookup(lemma, word))
-            if items[0].error is not None:
-                items.append(self._fmt_lookup(word, word))
-
-        elif self.lemma_policy == LemmaPolicy.first_lemma:
-            items.append(self._fmt_lookup(lemma, word))
-            if word != lemma:
-                items.append(self._fmt_lookup(word, word))
-
-        elif self.lemma_policy == LemmaPolicy.first_original:
-            items.append(self._fmt_lookup(word, word))
-            if word != lemma:
-                items.append(self._fmt_lookup(lemma, word))
+        return self.define_many([word], no_lemma)[word]
 
+    def define_many(self, words: Iterable[str], no_lemma=False) -> dict[str, list[AudioDefinition]]:
+        "Get definitions for many words according to LemmaPolicy, looking up terms in batches"
+        items, _ = self._define_terms(words, no_lemma, self.lemma_policy, self._lookup_many, self._fmt_result)
         return items
 
-    def _fmt_lookup(self, word: str, lookup_term: str) -> AudioDefinition:
-        '''Format a LookupResult as a Definition'''
-        result = self._lookup(word)
+    def _fmt_result(self, word: str, lookup_term: str, result: AudioLookupResult) -> AudioDefinition:
         newdict = {}
         if result.audios is not None:
             for key in result.audios:
@@ -256,6 +295,10 @@ class AudioSource(Source):
     def _lookup(self, word: str) -> AudioLookupResult:
         raise NotImplementedError
 
+    def _lookup_many(self, words: Iterable[str]) -> dict[str, AudioLookupResult]:
+        '''Subclass may override this method to look up words in a batch'''
+        return {word: self._lookup(word) for word in words}
+
 
 class AudioSourceGroup:
     '''Wrapper for a group of Sources associated with a textbox on the main window'''
@@ -277,6 +320,15 @@ class AudioSourceGroup:
             definitions.extend(source.define(word, no_lemma))
         return definitions
 
+    def define_many(self, words: Iterable[str], no_lemma: bool = False) -> dict[str, list[AudioDefinition]]:
+        '''Get definitions for many words from all sources'''
+        words = list(dict.fromkeys(words))
+        definitions: dict[str, list[AudioDefinition]] = {word: [] for word in words}
+        for source in self.sources:
+            for word, items in source.define_many(words, no_lemma).items():
+                definitions[word].extend(items)
+        return definitions
+
 
 class DictionarySource(Source):
     '''Represents a an interface to a dictionary'''
@@ -296,44 +348,24 @@ class DictionarySource(Source):
         result = collapse_newlines(result, self.collapse_newlines)
         return result
 
-    def define(self, word: str, no_lemma=False) -> list[Definition]:
+    def define(self, word: str, no_lemma=False, fuzzy=False) -> list[Definition]:
         "Get definitions according to LemmaPolicy"
-        items = []
-        lemma = lem_word(word, self.langcode)
-        if no_lemma:
-            return [self._fmt_lookup(word, word)]
-
-        if self.lemma_policy == LemmaPolicy.no_lemma:
-            items.append(self._fmt_lookup(word, word))
-
-        elif self.lemma_policy == LemmaPolicy.only_lemma:
-            items.append(self._fmt_lookup(lemma, word))
-
-        elif self.lemma_policy == LemmaPolicy.try_original:
-            items.append(self._fmt_lookup(word, word))
-            if items[0].error is not None:
-                items.append(self._fmt_lookup(lemma, word))
-
-        elif self.lemma_policy == LemmaPolicy.try_lemma:
-            items.append(self._fmt_lookup(lemma, word))
-            if items[0].error is not None:
-                items.append(self._fmt_lookup(word, word))
-
-        elif self.lemma_policy == LemmaPolicy.first_lemma:
-            items.append(self._fmt_lookup(lemma, word))
-            if word != lemma:
-                items.append(self._fmt_lookup(word, word))
-
-        elif self.lemma_policy == LemmaPolicy.first_original:
-            items.append(self._fmt_lookup(word, word))
-            if word != lemma:
-                items.append(self._fmt_lookup(lemma, word))
-
+        return self.define_many([word], no_lemma, fuzzy)[word]
+
+    def define_many(self, words: Iterable[str], no_lemma=False, fuzzy=False) -> dict[str, list[Definition]]:
+        """Get definitions for many words according to LemmaPolicy, looking up terms in batches
+        If fuzzy, words that are not found at all fall back to the closest headword, if any,
+        marked as a suggestion. Only meant for interactive lookups, where the user sees it"""
+        items, results = self._define_terms(words, no_lemma, self.lemma_policy, self._lookup_many, self._fmt_result)
+        if fuzzy:
+            missing = [word for word, defis in items.items() if all(item.error is not None for item in defis)]
+            suggestions = {word: suggested[0] for word in missing if (suggested := self._suggest(word))}
+            results.update(self._lookup_many(set(suggestions.values()) - results.keys()))
+            for word, term in suggestions.items():
+                items[word].append(replace(self._fmt_result(term, word, results[term]), suggestion=True))
         return items
 
-    def _fmt_lookup(self, word: str, lookup_term: str) -> Definition:
-        '''Format a LookupResult as a Definition'''
-        result = self._lookup(word)
+    def _fmt_result(self, word: str, lookup_term: str, result: LookupResult) -> Definition:
         if result.definition is not None:
             return Definition(
                 headword=word,
@@ -350,6 +382,18 @@ class DictionarySource(Source):
         '''
         raise NotImplementedError
 
+    def _lookup_many(self, words: Iterable[str]) -> dict[str, LookupResult]:
+        '''Lookup many words in the dictionary
+        Subclass may override this method to look up words in a batch
+        '''
+        return {word: self._lookup(word) for word in words}
+
+    def _suggest(self, word: str) -> list[str]:
+        '''Headwords close to a word that was not found, best first
+        Subclass may override this method if it supports fuzzy lookups
+        '''
+        return []
+
 
 def convert_display_mode(entry: str, mode: DisplayMode) -> str:
     match mode:
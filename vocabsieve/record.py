@@ -1,38 +1,59 @@
+import dataclasses
 import sqlite3
 import os
+import threading
 import time
-import re
+from collections import Counter
+from contextlib import contextmanager
 from bidict import bidict
-from typing import Optional, cast
+from typing import Callable, Collection, Optional, cast
 import json
 from PyQt5.QtCore import QSettings
 from datetime import datetime
 from .constants import langcodes
 from .lemmatizer import lem_word
-from .models import LookupRecord, WordRecord, KnownMetadata, SRSNote
-from .tools import findNotes, notesInfo
+from .tokenizer import TOKEN_RE, tokenize, lemmatize_tokens
+from .models import LookupRecord, KnownMetadata, SRSNote
+from .known_data import AnkiNote, KnownDataSnapshot, KnownDataStore, load_snapshot, note_lemmas, save_snapshot
+from .anki_connect import get_client
+from .tools import findNotes, notesInfoChunks, notesModTime
+from .connection_pool import ConnectionPool
 from .global_names import logger, settings
 
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER, which is 999 on older builds
+NOTE_CACHE_CHUNK_SIZE = 900
+# Tables whose changes are logged in known_changes, with the statements that log them
+CHANGE_LOGGED = {
+    "lookup": ("lookups", ("INSERT",)),
+    "seen": ("seen_new", ("INSERT", "UPDATE", "DELETE")),
+    "modifier": ("modifiers", ("INSERT", "UPDATE", "DELETE")),
+}
+
 
 class Record():
     """Class to store user data"""
 
     def __init__(self, parent_settings: QSettings, datapath):
-        self.conn = sqlite3.connect(
-            os.path.join(
-                datapath,
-                "records.db"),
-            check_same_thread=False)
+        self.datapath = datapath
+        # self.conn and self.c are the writer, reads go through per-thread connections
+        self.pool = ConnectionPool(os.path.join(datapath, "records.db"))
+        self.conn = self.pool.writer
         self.c = self.conn.cursor()
-        self.c.execute("PRAGMA foreign_keys = ON")
-        self._createTables()
-        if not parent_settings.value("internal/lookup_unique_index"):
-            self._makeLookupUnique()
-            parent_settings.setValue("internal/lookup_unique_index", True)
-        self.conn.commit()
+        with self.pool.lock:
+            self.c.execute("PRAGMA foreign_keys = ON")
+            self._createTables()
+            if not parent_settings.value("internal/lookup_unique_index"):
+                self._makeLookupUnique()
+                parent_settings.setValue("internal/lookup_unique_index", True)
+            self.conn.commit()
 
-        self.last_known_data: Optional[tuple[dict[str, WordRecord], KnownMetadata]] = None
+        self.last_known_data: Optional[tuple[KnownDataStore, KnownMetadata]] = None
         self.last_known_data_date: float = 0.0  # 1970-01-01
+        self.known_snapshot: Optional[KnownDataSnapshot] = None
+        self._known_lock = threading.Lock()  # Held for a whole refresh
+        # Modifiers written while a refresh holds the known data, applied by whoever holds it next
+        self._pending_modifiers: list[tuple[str, Optional[dict[str, float]]]] = []
+        self._pending_lock = threading.Lock()
 
     def _createTables(self):
         self.c.execute("""
@@ -89,13 +110,113 @@ class Record():
         self.c.execute("""
                        CREATE UNIQUE INDEX IF NOT EXISTS modifier_index ON modifiers (language, lemma)
         """)
+        # Lemma counts of each content, so that seen words never have to be lemmatized again
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS lemma_ids (
+            id INTEGER PRIMARY KEY,
+            language TEXT,
+            lemma TEXT,
+            UNIQUE(language, lemma)
+        )
+        """)
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS content_lemmas (
+            content_id INTEGER REFERENCES contents(id) ON DELETE CASCADE,
+            lemma_id INTEGER,
+            count INTEGER,
+            PRIMARY KEY (content_id, lemma_id)
+        ) WITHOUT ROWID
+        """)
+        # Lemmas extracted from Anki notes, valid as long as the note and the fields used are the same
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS anki_notes (
+            note_id INTEGER PRIMARY KEY,
+            mod INTEGER,
+            model TEXT,
+            word_field TEXT,
+            ctx_field TEXT,
+            language TEXT,
+            tgt TEXT,
+            ctx TEXT
+        )
+        """)
+        if "n_words" not in [row[1] for row in self.c.execute("PRAGMA table_info(contents)")]:
+            self.c.execute("ALTER TABLE contents ADD COLUMN n_words INTEGER")
+            self.c.execute("SELECT id, content FROM contents")
+            self.c.executemany("UPDATE contents SET n_words=? WHERE id=?",
+                               [(sum(1 for _ in TOKEN_RE.finditer(content)), content_id)
+                                for content_id, content in self.c.fetchall()])
+            self.conn.commit()
         # Non-unique index for seen_new
         self.c.execute("""CREATE INDEX IF NOT EXISTS seen_index_lang ON seen_new (language)""")
+        self.c.execute("""CREATE INDEX IF NOT EXISTS lookup_lemma_index ON lookups (language, lemma)""")
+        self._createChangeLog()
         # Clean up old seen table
         self.c.execute("""DROP TABLE IF EXISTS seen""")
         self.c.execute("""VACUUM""")
         self.conn.commit()
 
+    def _createChangeLog(self):
+        """
+        Triggers log every lemma whose lookups, seen count or modifier changed,
+        so that known data can be refreshed with only what changed since a given seq.
+        Only the last change of each lemma is kept. Bulk writes log a single row
+        without a lemma instead, see _bulkWrite"""
+        self.c.execute("""
+        CREATE TABLE IF NOT EXISTS known_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT,
+            language TEXT,
+            lemma TEXT,
+            UNIQUE(source, language, lemma)
+        )
+        """)
+        for source in CHANGE_LOGGED:
+            # Recreated, older versions logged with a DELETE and an INSERT
+            self._dropChangeTriggers(source)
+            self._createChangeTriggers(source)
+
+    def _createChangeTriggers(self, source: str):
+        table, events = CHANGE_LOGGED[source]
+        for event in events:
+            row = "OLD" if event == "DELETE" else "NEW"
+            # The upsert moves a logged lemma to the end, with seq set explicitly
+            self.c.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_log AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO known_changes(seq, source, language, lemma)
+                VALUES((SELECT COALESCE(MAX(seq), 0) + 1 FROM known_changes),
+                       '{source}', {row}.language, {row}.lemma)
+                ON CONFLICT(source, language, lemma) DO UPDATE SET seq = excluded.seq;
+            END
+            """)
+
+    def _dropChangeTriggers(self, source: str):
+        table, events = CHANGE_LOGGED[source]
+        for event in events:
+            self.c.execute(f"DROP TRIGGER IF EXISTS {table}_{event.lower()}_log")
+
+    @contextmanager
+    def _bulkWrite(self, source: str, language: Optional[str] = None):
+        """
+        Write many rows of source without logging each of them, and make the next refresh
+        reload all of source for language, or for every language if None.
+        Even triggers that do nothing make sqlite write row by row, so they are dropped
+        for the duration, in the same transaction. For use under the writer lock"""
+        if not self.conn.in_transaction:
+            self.c.execute("BEGIN")
+        self._dropChangeTriggers(source)
+        try:
+            yield
+        finally:
+            self._createChangeTriggers(source)
+        seq = self.c.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM known_changes").fetchone()[0]
+        # Anything logged before is reloaded anyway
+        self.c.execute("DELETE FROM known_changes WHERE source=? AND (? IS NULL OR language=?)",
+                       (source, language, language))
+        self.c.execute("INSERT INTO known_changes(seq, source, language, lemma) VALUES(?,?,?,NULL)",
+                       (seq, source, language))
+
     def _makeLookupUnique(self):
         """
         In the past, lookups were not unique, which made it very slow
@@ -112,24 +233,57 @@ class Record():
         self.c.execute("""
             CREATE UNIQUE INDEX IF NOT EXISTS lookup_index ON lookups (timestamp, lemma)
         """)
+        self.c.execute("""CREATE INDEX IF NOT EXISTS lookup_lemma_index ON lookups (language, lemma)""")
+        self._createChangeLog()
         self.conn.commit()
 
-    def _seenContent(self, name, content, language):
+    @staticmethod
+    def _countLemmas(content: str, language: str,
+                     progress: Optional[Callable[[int, int], None]] = None) -> tuple[Counter[str], int]:
+        """Count how often each lemma occurs in a content. Returns the counts and the number of words
+        Large contents are lemmatized in a process pool. progress is called as in lemmatize_many"""
         start = time.time()
-        for word in content.replace("\\n", "\n").replace("\\N", "\n").split():
-            lemma = lem_word(word, language)
-            self.c.execute("""
-                    INSERT INTO seen_new(language, lemma) VALUES(?,?)
-                    ON CONFLICT(language, lemma) DO UPDATE SET count = count + 1
-            """, (language, lemma))
-        self.conn.commit()
-        logger.info("Lemmatized", name, "in", time.time() - start, "seconds")
-
-    def importContent(self, name: str, content: str, language: str, jd: int):
+        content = content.replace("\\n", "\n").replace("\\N", "\n")
+        lemmas = lemmatize_tokens(tokenize(content, language), language,
+                                  processes=os.cpu_count() or 1, progress=progress)
+        logger.info(f"Lemmatized {len(lemmas)} words in {time.time() - start:.2f} seconds")
+        return Counter(lemmas), len(lemmas)
+
+    def _storeLemmaCounts(self, content_id: int, counts: Counter[str], n_words: int, language: str):
+        "Store how often each lemma occurs in a content"
+        with self.pool.lock:
+            self.c.executemany("INSERT OR IGNORE INTO lemma_ids(language, lemma) VALUES(?,?)",
+                               ((language, lemma) for lemma in counts))
+            self.c.execute("DELETE FROM content_lemmas WHERE content_id=?", (content_id,))
+            self.c.executemany("""
+                INSERT INTO content_lemmas(content_id, lemma_id, count)
+                SELECT ?, id, ? FROM lemma_ids WHERE language=? AND lemma=?
+            """, ((content_id, count, language, lemma) for lemma, count in counts.items()))
+            self.c.execute("UPDATE contents SET n_words=? WHERE id=?", (n_words, content_id))
+
+    def _seenContent(self, counts: Counter[str], language: str):
+        "Add lemma counts to the seen words, with one upsert per distinct lemma"
+        with self.pool.lock:
+            self.c.executemany("""
+                    INSERT INTO seen_new(language, lemma, count) VALUES(?,?,?)
+                    ON CONFLICT(language, lemma) DO UPDATE SET count = count + excluded.count
+            """, ((language, lemma, count) for lemma, count in counts.items()))
+
+    def importContent(self, name: str, content: str, language: str, jd: int,
+                      progress: Optional[Callable[[int, int], None]] = None):
+        """Record a content and add its words to the seen words, in a single transaction
+        progress is called with (forms lemmatized, forms to lemmatize)"""
         start = time.time()
-        self.c.execute('SELECT * FROM contents WHERE (name=?)', (name,))
-        exists = self.c.fetchone()
-        if not exists:
+        if self.pool.cursor().execute('SELECT 1 FROM contents WHERE (name=?)', (name,)).fetchone():
+            logger.info(name, "already exists")
+            return False
+        # Lemmatize before taking the writer, this is the slow part
+        counts, n_words = self._countLemmas(content, language, progress)
+        with self.pool.lock:
+            self.c.execute('SELECT 1 FROM contents WHERE (name=?)', (name,))
+            if self.c.fetchone():
+                logger.info(name, "already exists")
+                return False
             sql = """INSERT INTO contents(name, content, language, jd)
                     VALUES(?,?,?,?)"""
             self.c.execute(
@@ -139,46 +293,117 @@ class Record():
             self.c.execute("SELECT last_insert_rowid()")
             source = self.c.fetchone()[0]
             logger.debug("ID for content", name, "is", source)
-            self._seenContent(name, content, language)
+            self._storeLemmaCounts(source, counts, n_words, language)
+            with self._bulkWrite("seen", language):
+                self._seenContent(counts, language)
             self.conn.commit()
-            logger.debug("Recorded", name, "in", time.time() - start, "seconds")
-            return True
-        logger.info(name, "already exists")
-        return False
+        logger.debug("Recorded", name, "in", time.time() - start, "seconds")
+        return True
 
     def getContents(self, language):
-        return self.c.execute('''
+        return self.pool.cursor().execute('''
             SELECT name, content, jd
             FROM contents
             WHERE language=?''', (language,))
 
+    def getContentsInfo(self, language):
+        "Name, date and word count of each content, without the text itself"
+        return self.pool.cursor().execute('''
+            SELECT name, jd, n_words
+            FROM contents
+            WHERE language=?''', (language,))
+
     def getModifier(self, language, lemma) -> float:
-        self.c.execute('''
+        c = self.pool.cursor()
+        c.execute('''
             SELECT value
             FROM modifiers
             WHERE language=? AND lemma=?''', (language, lemma))
-        value = self.c.fetchone()
+        value = c.fetchone()
         if value:
             return cast(float, value[0])
         else:
             return 1.0
 
     def setModifier(self, language, lemma, value):
-        self.c.execute('''
-            INSERT OR REPLACE INTO modifiers(language, lemma, value)
-            VALUES(?,?,?)''', (language, lemma, value))
-        self.conn.commit()
+        with self.pool.lock:
+            self.c.execute('''
+                INSERT OR REPLACE INTO modifiers(language, lemma, value)
+                VALUES(?,?,?)''', (language, lemma, value))
+            self.conn.commit()
+        self._updateKnownModifiers(language, {lemma: value})
+
+    def _updateKnownModifiers(self, language: str, modifiers: Optional[dict[str, float]]) -> None:
+        """Apply modifiers just written to the known data, or drop all of them if None,
+        so that they are used before the next refresh
+        This never waits for a refresh, one that is running applies them when it is done"""
+        with self._pending_lock:
+            self._pending_modifiers.append((language, modifiers))
+        self._flushPendingModifiers()
+
+    def _takePendingModifiers(self, snapshot: KnownDataSnapshot) -> set[str]:
+        "Apply queued modifiers to a snapshot, must hold _known_lock. Returns the lemmas that changed"
+        with self._pending_lock:
+            pending, self._pending_modifiers = self._pending_modifiers, []
+        touched: set[str] = set()
+        for language, modifiers in pending:
+            # Modifiers of other languages are read from the database when their snapshot is loaded
+            if language != snapshot.language:
+                continue
+            if modifiers is None:
+                touched |= snapshot.replaceValues(snapshot.modifiers, {})
+            else:
+                touched |= snapshot.applyValues(snapshot.modifiers, modifiers.items())
+        return touched
 
-    def rebuildSeen(self):
-        self.c.execute("DELETE FROM seen_new")
-        self.c.execute('SELECT id, name, content, language, jd FROM contents')
-        for _, name, content, language, _ in self.c.fetchall():
-            self._seenContent(name, content, language)
-        self.conn.commit()
-        self.c.execute("VACUUM")
+    def _flushPendingModifiers(self) -> None:
+        """Apply queued modifiers to the known data unless a refresh is running
+        Whoever holds _known_lock tries again after releasing it, so nothing stays queued"""
+        while self._pending_modifiers and self._known_lock.acquire(blocking=False):
+            try:
+                snapshot = self.known_snapshot
+                if snapshot is None:
+                    with self._pending_lock:
+                        self._pending_modifiers.clear()
+                    continue
+                touched = self._takePendingModifiers(snapshot)
+                if touched:
+                    snapshot.rebuildRecords(touched)
+                    if self.last_known_data is not None:
+                        self.last_known_data = snapshot.knownData()
+            finally:
+                self._known_lock.release()
+
+    def rebuildSeen(self, relemmatize: bool = False):
+        """Recompute seen words from the stored lemma counts of all contents
+        Contents without lemma counts, or all of them if relemmatize, are lemmatized first"""
+        # Lemmatize before taking the writer, this is the slow part
+        to_count = self.pool.cursor().execute(f"""
+            SELECT id, content, language FROM contents
+            WHERE (n_words IS NULL OR n_words > 0)
+            {"" if relemmatize else "AND NOT EXISTS (SELECT 1 FROM content_lemmas WHERE content_id=contents.id)"}
+        """).fetchall()
+        lemma_counts = [(content_id, language, *self._countLemmas(content, language))
+                        for content_id, content, language in to_count]
+        with self.pool.lock:
+            for content_id, language, counts, n_words in lemma_counts:
+                # Skip contents deleted in the meantime
+                if self.c.execute("SELECT 1 FROM contents WHERE id=?", (content_id,)).fetchone():
+                    self._storeLemmaCounts(content_id, counts, n_words, language)
+            with self._bulkWrite("seen"):
+                self.c.execute("DELETE FROM seen_new")
+                self.c.execute("""
+                    INSERT INTO seen_new(language, lemma, count)
+                    SELECT lemma_ids.language, lemma_ids.lemma, SUM(content_lemmas.count)
+                    FROM content_lemmas
+                    JOIN lemma_ids ON lemma_ids.id = content_lemmas.lemma_id
+                    GROUP BY content_lemmas.lemma_id
+                """)
+            self.conn.commit()
+            self.c.execute("VACUUM")
 
     def getSeen(self, language):
-        cursor = self.conn.cursor()
+        cursor = self.pool.cursor()
         return cursor.execute('''
             SELECT lemma, count
             FROM seen_new
@@ -186,94 +411,124 @@ class Record():
             ''', (language,))
 
     def countSeen(self, language):
-        self.c.execute('''
+        c = self.pool.cursor()
+        c.execute('''
             SELECT SUM (count), COUNT (DISTINCT lemma)
             FROM seen_new
             WHERE language=?''', (language,))
-        return self.c.fetchone()
+        return c.fetchone()
 
     def deleteContent(self, name: str):
-        self.c.execute("""
-            DELETE FROM contents
-            WHERE name=?
-        """, (name,))
-        self.conn.commit()
-        self.c.execute("VACUUM")
+        """Delete a content and take its words out of the seen words
+        Contents recorded before their lemma counts were stored have nothing to take out,
+        so the seen words are recomputed from the remaining contents instead"""
+        with self.pool.lock:
+            content = self.c.execute("SELECT id, language, n_words FROM contents WHERE name=?", (name,)).fetchone()
+            if content is None:
+                return
+            content_id, language, n_words = content
+            self.c.execute("""
+                SELECT lemma_ids.lemma, content_lemmas.count
+                FROM content_lemmas
+                JOIN lemma_ids ON lemma_ids.id = content_lemmas.lemma_id
+                WHERE content_lemmas.content_id = ?
+            """, (content_id,))
+            rows = self.c.fetchall()
+            counted = bool(rows) or n_words == 0
+            if counted:
+                with self._bulkWrite("seen", language):
+                    self.c.executemany("""
+                        UPDATE seen_new SET count = count - ?
+                        WHERE language=? AND lemma=?
+                    """, ((count, language, lemma) for lemma, count in rows))
+                    self.c.execute("DELETE FROM seen_new WHERE count <= 0")
+            self.c.execute("DELETE FROM contents WHERE id=?", (content_id,))
+            self.conn.commit()
+            if counted:
+                self.c.execute("VACUUM")
+        if not counted:
+            self.rebuildSeen()
 
     def deleteModifiers(self, langcode: str):
         "Drop all modifiers for given language"
-        self.c.execute("""
-            DELETE FROM modifiers
-            WHERE language=?
-        """, (langcode,))
-        self.conn.commit()
-        self.c.execute("VACUUM")
+        with self.pool.lock:
+            with self._bulkWrite("modifier", langcode):
+                self.c.execute("""
+                    DELETE FROM modifiers
+                    WHERE language=?
+                """, (langcode,))
+            self.conn.commit()
+            self.c.execute("VACUUM")
+        self._updateKnownModifiers(langcode, None)
 
     def recordLookup(self, lr: LookupRecord, timestamp: Optional[float] = None, commit: bool = True):
-        if timestamp is None:
-            timestamp = time.time()
-        sql = """INSERT OR IGNORE INTO lookups(timestamp, word, lemma, language, lemmatization, source, success)
-                VALUES(?,?,?,?,?,?,?)"""
-        self.c.execute(
-            sql,
-            (
-                timestamp,
-                lr.word,
-                lem_word(lr.word, lr.language),
-                lr.language,
-                True,
-                lr.source,
-                True
+        with self.pool.lock:
+            if timestamp is None:
+                timestamp = time.time()
+            sql = """INSERT OR IGNORE INTO lookups(timestamp, word, lemma, language, lemmatization, source, success)
+                    VALUES(?,?,?,?,?,?,?)"""
+            self.c.execute(
+                sql,
+                (
+                    timestamp,
+                    lr.word,
+                    lem_word(lr.word, lr.language),
+                    lr.language,
+                    True,
+                    lr.source,
+                    True
+                )
             )
-        )
-        if commit:
-            self.conn.commit()
+            if commit:
+                self.conn.commit()
 
     def recordNote(self, sn: SRSNote, content: str, commit: bool = True):
-        timestamp = time.time()
-        sql = """INSERT INTO notes(
-            timestamp, data, sentence, word, definition, definition2, pronunciation, image, tags, success
-            )
-            VALUES(?,?,?,?,?,?,?,?,?,?)"""
-        self.c.execute(sql,
-                       (
-                           timestamp,
-                           content,
-                           sn.sentence or "",
-                           sn.word or "",
-                           sn.definition1 or "",
-                           sn.definition2 or "",
-                           sn.audio_path or "",
-                           sn.image or "",
-                           " ".join(sn.tags) if sn.tags else "",
-                           1
-                       )
-                       )
-        if commit:
-            self.conn.commit()
+        with self.pool.lock:
+            timestamp = time.time()
+            sql = """INSERT INTO notes(
+                timestamp, data, sentence, word, definition, definition2, pronunciation, image, tags, success
+                )
+                VALUES(?,?,?,?,?,?,?,?,?,?)"""
+            self.c.execute(sql,
+                           (
+                               timestamp,
+                               content,
+                               sn.sentence or "",
+                               sn.word or "",
+                               sn.definition1 or "",
+                               sn.definition2 or "",
+                               sn.audio_path or "",
+                               sn.image or "",
+                               " ".join(sn.tags) if sn.tags else "",
+                               1
+                           )
+                           )
+            if commit:
+                self.conn.commit()
 
     def getAllLookups(self):
-        return self.c.execute("SELECT timestamp, word, lemma, language, lemmatization, source, success FROM lookups")
+        return self.pool.cursor().execute("SELECT timestamp, word, lemma, language, lemmatization, source, success FROM lookups")
 
     def getAllNotes(self):
-        return self.c.execute("SELECT * FROM notes")
+        return self.pool.cursor().execute("SELECT * FROM notes")
 
     def countLemmaLookups(self, word, language):
-        self.c.execute(
+        c = self.pool.cursor()
+        c.execute(
             '''SELECT COUNT (DISTINCT date(timestamp, "unixepoch")) FROM lookups WHERE lemma=?''',
             (lem_word(
                 word,
                 language),
              ))
-        return self.c.fetchone()[0]
+        return c.fetchone()[0]
 
     def countLookups(self, language):
-        cursor = self.conn.cursor()
+        cursor = self.pool.cursor()
         cursor.execute('''SELECT COUNT (*) FROM lookups WHERE language=?''', (language,))
         return cursor.fetchone()[0]
 
     def countAllLemmaLookups(self, language):
-        cursor = self.conn.cursor()
+        cursor = self.pool.cursor()
         return cursor.execute(
             '''SELECT lemma, COUNT (DISTINCT date(timestamp, "unixepoch"))
                FROM lookups
@@ -298,12 +553,13 @@ class Record():
         end = day.replace(hour=23, minute=59, second=59,
                           microsecond=999999).timestamp()
         try:
-            self.c.execute("""SELECT COUNT (DISTINCT word)
+            c = self.pool.cursor()
+            c.execute("""SELECT COUNT (DISTINCT word)
                             FROM lookups
                             WHERE timestamp
                             BETWEEN ? AND ?
                             AND success = 1 """, (start, end))
-            return self.c.fetchone()[0]
+            return c.fetchone()[0]
         except sqlite3.ProgrammingError:
             return -1
 
@@ -316,116 +572,149 @@ class Record():
         end = day.replace(hour=23, minute=59, second=59,
                           microsecond=999999).timestamp()
         try:
-            self.c.execute("""SELECT COUNT (timestamp)
+            c = self.pool.cursor()
+            c.execute("""SELECT COUNT (timestamp)
                             FROM notes
                             WHERE timestamp
                             BETWEEN ? AND ?
                             AND success = 1 """, (start, end))
-            return self.c.fetchone()[0]
+            return c.fetchone()[0]
         except sqlite3.ProgrammingError:
             return -1
 
     def purge(self):
-        self.c.execute("""
-        DROP TABLE IF EXISTS lookups,notes,contents,seen_new,seen
-        """)
-        self._createTables()
-        self.c.execute("VACUUM")
+        with self.pool.lock:
+            self.c.execute("""
+            DROP TABLE IF EXISTS lookups,notes,contents,seen_new,seen
+            """)
+            self._createTables()
+            self.c.execute("VACUUM")
 
-    def getKnownData(self) -> tuple[dict[str, WordRecord], KnownMetadata]:
+    def getKnownData(self) -> tuple[KnownDataStore, KnownMetadata]:
         lifetime = settings.value('tracking/known_data_lifetime', 1800, type=int)  # Seconds
         if self.last_known_data is None:
             logger.debug("No known data in this session. Creating known data from database..")
-            self.last_known_data = self._refreshKnownData()
+            known_data = self._refreshKnownData()
             self.last_known_data_date = time.time()
-            return self.last_known_data
+            return known_data
         else:
             known_data_age = time.time() - self.last_known_data_date
             if known_data_age > lifetime:
                 logger.debug(f"Known data is {known_data_age:.2f} s old, "
                              f"which is older than the specified lifetime of {lifetime} s. Refreshing..")
-                self.last_known_data = self._refreshKnownData()
+                known_data = self._refreshKnownData()
                 self.last_known_data_date = time.time()
-                return self.last_known_data
+                return known_data
             else:
                 logger.debug(f"Known data is {known_data_age:.2f} s old, "
                              f"which is newer than the specified lifetime of {lifetime} s. Not refreshing now.")
                 return self.last_known_data
 
-    @staticmethod
-    def process_notes_info(notes_info: dict,
-                           result: dict[str, WordRecord],
-                           tgt_key: str,
-                           ctx_key: str,
-                           fieldmap: dict[str, list[str]],
-                           langcode: str) -> tuple[list[str], list[str]]:
-        tgt_lemmas = []
-        ctx_lemmas = []
-        for info in notes_info:
-            model = info['modelName']
-            word_field, ctx_field = fieldmap.get(model) or ("<Ignore>", "<Ignore>")
-            word = ""
-            ctx = ""
-            lemma = ""
-            if word_field != "<Ignore>":
-                word = info['fields'][word_field]['value']
-            if ctx_field != "<Ignore>":
-                ctx = info['fields'][ctx_field]['value']
-            if word:
-                lemma = word  # word field is assumed to be already lemmatized
-                tgt_lemmas.append(lemma)
-                try:
-                    setattr(result[lemma], tgt_key, getattr(result[lemma], tgt_key) + 1)
-                except KeyError:
-                    result[lemma] = WordRecord(lemma=lemma, language=langcode, **{tgt_key: 1})
-            if ctx:
-                this_ctx_lemmas = set(map(lambda w: lem_word(w, langcode), re.sub(r"<.*?>", " ", ctx).split()))
-                if lemma:  # Don't count if already counted as word
-                    this_ctx_lemmas.discard(lemma)
-                for ctx_lemma in this_ctx_lemmas:
-                    ctx_lemmas.append(ctx_lemma)
-                    try:
-                        setattr(result[ctx_lemma], ctx_key, getattr(result[ctx_lemma], ctx_key) + 1)
-                    except KeyError:
-                        result[ctx_lemma] = WordRecord(lemma=ctx_lemma, language=langcode, **{ctx_key: 1})
-        return tgt_lemmas, ctx_lemmas
-
-    def _refreshKnownData(self) -> tuple[dict[str, WordRecord], KnownMetadata]:
-
-        langcode = settings.value('target_language', 'en')
-
-        result: dict[str, WordRecord] = {}
-
-        start = time.time()
-
-        metadata = KnownMetadata()
-
-        for lemma, count in self.countAllLemmaLookups(langcode):
-            metadata.n_lookups += 1
-            result[lemma] = WordRecord(lemma=lemma, language=langcode, n_lookups=count)
-
-        logger.debug(f"Processed lookup data in {time.time() - start:.2f} seconds")
-
-        start = time.time()
-        for lemma, count in self.getSeen(langcode):
-            metadata.n_seen += 1
-            try:
-                result[lemma].n_seen = count
-            except KeyError:
-                result[lemma] = WordRecord(lemma=lemma, language=langcode, n_seen=count)
-
-        logger.debug(f"Processed seen data in {time.time() - start:.2f} seconds")
-
-        start = time.time()
+    def _fillKnownSnapshot(self, snapshot: KnownDataSnapshot) -> set[str]:
+        "Fill a snapshot with all lookups, seen words and modifiers. Returns the lemmas"
+        c = self.pool.cursor()
+        # Read first, changes made while loading are applied again by the next refresh
+        snapshot.watermark = c.execute("SELECT COALESCE(MAX(seq), 0) FROM known_changes").fetchone()[0]
+        snapshot.lookups = dict(self.countAllLemmaLookups(snapshot.language))
+        snapshot.seen = dict(self.getSeen(snapshot.language))
+        snapshot.modifiers = dict(
+            c.execute("SELECT lemma, value FROM modifiers WHERE language=?", (snapshot.language,)))
+        return set(snapshot.lookups) | set(snapshot.seen) | set(snapshot.modifiers)
+
+    def _applyKnownChanges(self, snapshot: KnownDataSnapshot) -> Optional[set[str]]:
+        """Apply lookups, seen words and modifiers changed since the snapshot was taken
+        Returns the lemmas that changed, or None if the database was reset and the snapshot is unusable"""
+        c = self.pool.cursor()
+        watermark = c.execute("SELECT COALESCE(MAX(seq), 0) FROM known_changes").fetchone()[0]
+        if watermark < snapshot.watermark:
+            return None
+        # Bulk writes log no lemmas, everything they wrote to is reloaded
+        reloads = {source for source, in c.execute("""
+            SELECT source FROM known_changes
+            WHERE seq > ? AND lemma IS NULL AND (language IS NULL OR language = ?)
+        """, (snapshot.watermark, snapshot.language))}
+        touched = set()
+        if "seen" in reloads:
+            touched |= snapshot.replaceValues(snapshot.seen, dict(self.getSeen(snapshot.language)))
+        if "modifier" in reloads:
+            touched |= snapshot.replaceValues(snapshot.modifiers, dict(c.execute(
+                "SELECT lemma, value FROM modifiers WHERE language=?", (snapshot.language,))))
+        touched |= snapshot.applyValues(snapshot.lookups, c.execute("""
+            SELECT known_changes.lemma, NULLIF((
+                SELECT COUNT (DISTINCT date(timestamp, "unixepoch")) FROM lookups
+                WHERE lookups.language = known_changes.language AND lookups.lemma = known_changes.lemma
+            ), 0)
+            FROM known_changes
+            WHERE seq > ? AND source = 'lookup' AND language = ? AND lemma IS NOT NULL
+        """, (snapshot.watermark, snapshot.language)))
+        touched |= snapshot.applyValues(snapshot.seen, c.execute("""
+            SELECT known_changes.lemma, seen_new.count
+            FROM known_changes
+            LEFT JOIN seen_new
+            ON seen_new.language = known_changes.language AND seen_new.lemma = known_changes.lemma
+            WHERE seq > ? AND source = 'seen' AND known_changes.language = ? AND known_changes.lemma IS NOT NULL
+        """, (snapshot.watermark, snapshot.language)))
+        touched |= snapshot.applyValues(snapshot.modifiers, c.execute("""
+            SELECT known_changes.lemma, modifiers.value
+            FROM known_changes
+            LEFT JOIN modifiers
+            ON modifiers.language = known_changes.language AND modifiers.lemma = known_changes.lemma
+            WHERE seq > ? AND source = 'modifier' AND known_changes.language = ? AND known_changes.lemma IS NOT NULL
+        """, (snapshot.watermark, snapshot.language)))
+        snapshot.watermark = watermark
+        return touched
+
+    def _getCachedNotes(self, note_ids: list[int], mod_times: dict[int, int],
+                        fieldmap: dict[str, list[str]], language: str) -> dict[int, tuple[str, tuple[str, ...]]]:
+        "Target and context lemmas of notes cached with the same modification time, language and fields"
+        result = {}
+        note_ids = [note_id for note_id in note_ids if note_id in mod_times]
+        c = self.pool.cursor()
+        for i in range(0, len(note_ids), NOTE_CACHE_CHUNK_SIZE):
+            chunk = note_ids[i:i + NOTE_CACHE_CHUNK_SIZE]
+            c.execute(f"""
+                SELECT note_id, mod, model, word_field, ctx_field, tgt, ctx FROM anki_notes
+                WHERE language=? AND note_id IN ({",".join("?" * len(chunk))})
+            """, (language, *chunk))
+            for note_id, mod, model, word_field, ctx_field, tgt, ctx in c.fetchall():
+                fields = fieldmap.get(model) or ("<Ignore>", "<Ignore>")
+                if mod == mod_times[note_id] and (word_field, ctx_field) == tuple(fields):
+                    result[note_id] = (tgt, tuple(json.loads(ctx)))
+        return result
+
+    def _cacheNotes(self, rows: list[tuple]) -> None:
+        "Store (note_id, mod, model, word_field, ctx_field, language, tgt, ctx lemmas) of notes"
+        with self.pool.lock:
+            self.c.executemany("""
+                INSERT OR REPLACE INTO anki_notes(note_id, mod, model, word_field, ctx_field, language, tgt, ctx)
+                VALUES(?,?,?,?,?,?,?,?)
+            """, ((*row[:-1], json.dumps(row[-1], ensure_ascii=False)) for row in rows))
+            self.conn.commit()
 
-        if not settings.value('enable_anki', True, type=bool):
-            logger.debug("Anki disabled, skipping")
-            result = {k: v for k, v in result.items() if k.isalpha() and not k.startswith('http') and " " not in k}
-            return result, metadata
-        fieldmap = json.loads(settings.value("tracking/fieldmap", "{}"))
+    def _pruneNoteCache(self, note_ids: Collection[int]) -> None:
+        "Remove cached notes that are not among note_ids anymore, such as notes deleted in Anki"
+        c = self.pool.cursor()
+        # Notes in use are all cached once fetched, so there is nothing to remove unless there are more
+        if c.execute("SELECT COUNT(*) FROM anki_notes").fetchone()[0] <= len(note_ids):
+            return
+        gone = [note_id for note_id, in c.execute("SELECT note_id FROM anki_notes") if note_id not in note_ids]
+        if not gone:
+            return
+        with self.pool.lock:
+            for i in range(0, len(gone), NOTE_CACHE_CHUNK_SIZE):
+                chunk = gone[i:i + NOTE_CACHE_CHUNK_SIZE]
+                self.c.execute(f"DELETE FROM anki_notes WHERE note_id IN ({','.join('?' * len(chunk))})", chunk)
+            self.conn.commit()
+        logger.debug(f"Removed {len(gone)} notes from the note cache")
 
+    def _refreshAnkiNotes(self, snapshot: KnownDataSnapshot, touched: set[str]) -> None:
+        """Bring the notes of a snapshot in line with Anki
+        Only notes that are new or were modified since are fetched, unless their lemmas are
+        in the note cache. Touched lemmas are added to touched"""
+        fieldmap = json.loads(snapshot.fieldmap)
         anki_api = settings.value("anki_api", "http://127.0.0.1:8765")
 
+        start = time.time()
         mature_notes = findNotes(
             anki_api,
             settings.value("tracking/anki_query_mature")
@@ -434,35 +723,124 @@ class Record():
             anki_api,
             settings.value("tracking/anki_query_young")
         )
-        young_notes = [note for note in young_notes if note not in mature_notes]
+        # Notes matching both queries count as mature
+        maturity = dict.fromkeys(young_notes, False)
+        maturity.update(dict.fromkeys(mature_notes, True))
+        for note_id in [note_id for note_id in snapshot.notes if note_id not in maturity]:
+            touched |= snapshot.removeNote(note_id)
+        self._pruneNoteCache(maturity)
+        try:
+            mod_times = notesModTime(anki_api, list(maturity))
+        except Exception as e:
+            # Older versions of AnkiConnect, every note has to be fetched
+            logger.debug(f"Could not get modification times of notes: {repr(e)}")
+            mod_times = {}
+        stale = []
+        for note_id, mature in maturity.items():
+            note = snapshot.notes.get(note_id)
+            if note is None or note.mod != mod_times.get(note_id):
+                stale.append(note_id)
+            elif note.mature != mature:
+                touched |= snapshot.addNote(note_id, dataclasses.replace(note, mature=mature))
+        cached = self._getCachedNotes(stale, mod_times, fieldmap, snapshot.language)
+        for note_id, (tgt, ctx) in cached.items():
+            touched |= snapshot.addNote(note_id, AnkiNote(mod_times[note_id], maturity[note_id], tgt, ctx))
+        stale = [note_id for note_id in stale if note_id not in cached]
+        logger.debug(f"Received anki data from AnkiConnect in {time.time() - start:.2f} seconds, "
+                     f"{len(stale) + len(cached)} of {len(maturity)} notes changed, {len(cached)} of them cached")
 
-        logger.debug(f"Received anki data from AnkiConnect in {time.time() - start:.2f} seconds")
         start = time.time()
-        mature_notes_info = notesInfo(anki_api, mature_notes)
-        young_notes_info = notesInfo(anki_api, young_notes)
-
-        mature_tgt_lemmas, mature_ctx_lemmas = self.process_notes_info(
-            mature_notes_info,
-            result,
-            "anki_mature_tgt",
-            "anki_mature_ctx",
-            fieldmap,
-            langcode
-        )
-        young_tgt_lemmas, young_ctx_lemmas = self.process_notes_info(
-            young_notes_info,
-            result,
-            "anki_young_tgt",
-            "anki_young_ctx",
-            fieldmap,
-            langcode
-        )
-        metadata.n_mature_ctx = len(mature_ctx_lemmas)
-        metadata.n_mature_tgt = len(mature_tgt_lemmas)
-        metadata.n_young_ctx = len(young_ctx_lemmas)
-        metadata.n_young_tgt = len(young_tgt_lemmas)
-
+        # Lemmatize each chunk while the next ones are downloaded
+        for chunk in notesInfoChunks(anki_api, stale):
+            rows = []
+            for info in chunk:
+                if not info:
+                    continue  # Deleted since findNotes, the next refresh removes it
+                tgt, ctx = note_lemmas(info, fieldmap, snapshot.language)
+                note = AnkiNote(info.get('mod', 0), maturity[info['noteId']], tgt, ctx)
+                touched |= snapshot.addNote(info['noteId'], note)
+                word_field, ctx_field = fieldmap.get(info['modelName']) or ("<Ignore>", "<Ignore>")
+                rows.append((info['noteId'], note.mod, info['modelName'], word_field, ctx_field,
+                             snapshot.language, tgt, ctx))
+            self._cacheNotes(rows)
         logger.debug(f"Processed anki data in {time.time() - start:.2f} seconds")
+        logger.debug(f"AnkiConnect requests so far:\n{get_client(anki_api).summary()}")
 
-        result = {k: v for k, v in result.items() if k.isalpha() and not k.startswith('http') and " " not in k}
-        return result, metadata
+    def _snapshotPath(self, language: str) -> str:
+        return os.path.join(self.datapath, f"known_data_{language}.snapshot")
+
+    def _readKnownSnapshot(self, language: str) -> Optional[KnownDataSnapshot]:
+        path = self._snapshotPath(language)
+        if not os.path.exists(path):
+            return None
+        start = time.time()
+        try:
+            snapshot = load_snapshot(path)
+        except Exception as e:
+            logger.warning(f"Could not load known data snapshot: {repr(e)}")
+            return None
+        logger.debug(f"Loaded known data snapshot of {len(snapshot.records)} words "
+                     f"in {time.time() - start:.3f} seconds")
+        return snapshot
+
+    def loadKnownSnapshot(self) -> Optional[tuple[KnownDataStore, KnownMetadata]]:
+        """Load the known data saved by the last refresh for the target language, if any
+        It is used until the next call to getKnownData, which brings it up to date"""
+        snapshot = self._readKnownSnapshot(settings.value('target_language', 'en'))
+        if snapshot is None:
+            return None
+        with self._known_lock:
+            self.known_snapshot = snapshot
+            self.last_known_data = snapshot.knownData()
+            self.last_known_data_date = 0.0  # Refresh on first use
+            return self.last_known_data
+
+    def _refreshKnownData(self) -> tuple[KnownDataStore, KnownMetadata]:
+        """Update the known data snapshot with what changed since the last refresh
+        The first refresh in a session, or after switching languages, loads everything
+        unless a snapshot was saved. The snapshot is saved when anything changed"""
+        langcode = settings.value('target_language', 'en')
+        fieldmap = settings.value("tracking/fieldmap", "{}")
+
+        with self._known_lock:
+            start = time.time()
+            snapshot = self.known_snapshot
+            if snapshot is None or snapshot.language != langcode:
+                snapshot = self._readKnownSnapshot(langcode)
+            touched = None
+            watermark = -1
+            if snapshot is not None:
+                watermark = snapshot.watermark
+                touched = self._applyKnownChanges(snapshot)
+            if snapshot is None or touched is None:
+                snapshot = KnownDataSnapshot(language=langcode, fieldmap=fieldmap)
+                touched = self._fillKnownSnapshot(snapshot)
+            logger.debug(f"Processed lookup and seen data in {time.time() - start:.2f} seconds, "
+                         f"{len(touched)} lemmas changed")
+
+            if snapshot.fieldmap != fieldmap:
+                touched |= snapshot.clearNotes()
+                snapshot.fieldmap = fieldmap
+            try:
+                if settings.value('enable_anki', True, type=bool):
+                    self._refreshAnkiNotes(snapshot, touched)
+                else:
+                    logger.debug("Anki disabled, skipping")
+                    touched |= snapshot.clearNotes()
+            finally:
+                touched |= self._takePendingModifiers(snapshot)
+                snapshot.rebuildRecords(touched)
+                self.known_snapshot = snapshot
+                if touched or snapshot.watermark != watermark:
+                    start = time.time()
+                    try:
+                        save_snapshot(snapshot, self._snapshotPath(langcode))
+                    except OSError as e:
+                        logger.warning(f"Could not save known data snapshot: {repr(e)}")
+                    else:
+                        logger.debug(f"Saved known data snapshot in {time.time() - start:.2f} seconds")
+            known_data = self.last_known_data = snapshot.knownData()
+        # Modifiers written after they were taken above
+        self._flushPendingModifiers()
+        with self._known_lock:
+            return self.last_known_data or known_data
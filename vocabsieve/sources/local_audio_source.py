@@ -1,5 +1,6 @@
 from ..models import AudioSource, LemmaPolicy, AudioLookupResult
 from ..local_dictionary import dictdb
+from typing import Iterable
 import json
 from loguru import logger
 import os
@@ -27,3 +28,16 @@ class LocalAudioSource(AudioSource):
         except KeyError as e:
             logger.debug(repr(e))
             return AudioLookupResult(error=repr(e))
+
+    def _lookup_many(self, words: Iterable[str]) -> dict[str, AudioLookupResult]:
+        words = list(words)
+        audio_lists = dictdb.define_many(words, self.langcode, self.name)
+        results = {}
+        for word in words:
+            if word not in audio_lists:
+                results[word] = AudioLookupResult(error=repr(KeyError(f"Word {word} not found in {self.name}")))
+                continue
+            audio_files = json.loads(audio_lists[word] or "[]")
+            results[word] = AudioLookupResult(
+                audios={file: os.path.join(self.base_path, file) for file in audio_files})
+        return results
@@ -1,3 +1,5 @@
+from typing import Iterable
+from ..compiled_dictionary import DictionaryClosedError
 from ..models import DictionarySource, SourceOptions, LookupResult
 from ..local_dictionary import dictdb
 
@@ -10,9 +12,36 @@ class LocalDictionarySource(DictionarySource):
         # Ensure dictname exists in db
 
     def _lookup(self, word: str) -> LookupResult:
+        if (compiled := dictdb.getCompiled(self.langcode, self.name)) is not None:
+            try:
+                if (definition := compiled.lookup(word)) is not None:
+                    return LookupResult(definition=definition)
+                return LookupResult(error=repr(KeyError(f"Word {word} not found in {self.name}")))
+            except DictionaryClosedError:
+                pass  # Replaced or removed meanwhile, the database has the same entries
         try:
             definition = dictdb.define(word, self.langcode, self.name)
             return LookupResult(definition=definition)
         except KeyError as e:
             print(repr(e))
             return LookupResult(error=repr(e))
+
+    def _lookup_many(self, words: Iterable[str]) -> dict[str, LookupResult]:
+        words = list(words)
+        definitions = None
+        if (compiled := dictdb.getCompiled(self.langcode, self.name)) is not None:
+            try:
+                definitions = {word: definition for word in words
+                               if (definition := compiled.lookup(word)) is not None}
+            except DictionaryClosedError:
+                pass  # Replaced or removed meanwhile, the database has the same entries
+        if definitions is None:
+            definitions = dictdb.define_many(words, self.langcode, self.name)
+        return {
+            word: LookupResult(definition=definitions[word]) if word in definitions
+            else LookupResult(error=repr(KeyError(f"Word {word} not found in {self.name}")))
+            for word in words
+        }
+
+    def _suggest(self, word: str) -> list[str]:
+        return dictdb.suggest(word, self.langcode, self.name, limit=1, prefix=False)
@@ -1,3 +1,4 @@
+from typing import Iterable
 from ..models import FreqSource
 from ..local_dictionary import LocalDictionary
 
@@ -15,6 +16,11 @@ class LocalFreqSource(FreqSource):
         except KeyError:
             return -1
 
+    def _lookup_many(self, words: Iterable[str]) -> dict[str, int]:
+        words = list(words)
+        freqs = self.db.define_many(words, self.langcode, self.name)
+        return {word: int(freqs[word]) if word in freqs else -1 for word in words}
+
     def getAllWords(self) -> list[str]:
         data = self.db.getAllWords(self.langcode, self.name)
         d = {int(data[i][1]): data[i][0] for i in range(len(data))}
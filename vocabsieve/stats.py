@@ -93,7 +93,7 @@ class StatisticsWindow(QDialog):
                     f"Words: {prettydigits(known_metadata.n_seen)} seen, {prettydigits(known_metadata.n_lookups)} looked up, "
                     f"{prettydigits(known_metadata.n_mature_tgt + known_metadata.n_young_tgt)} as Anki targets, "
                     f"{prettydigits(known_metadata.n_mature_ctx + known_metadata.n_young_ctx)} in Anki context"))
-        known_words_widget = QPlainTextEdit(" ".join(known_words))
+        known_words_widget = QPlainTextEdit(" ".join(sorted(known_words)))
         known_words_widget.setReadOnly(True)
         self.known_layout.addWidget(known_words_widget)
 
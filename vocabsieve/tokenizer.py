@@ -0,0 +1,58 @@
+"""
+Splitting text into tokens
+
+Tokens are runs of non-whitespace, the same as str.split(), but each one carries
+its position in the text and its normalized form, which is what gets lemmatized.
+Languages written without spaces between words have no such runs, so there every
+Han or kana character and CJK punctuation mark is a token of its own.
+Stages that need both the words of a text and their lemmas can then share a single
+pass over it, and lemmatize every distinct form only once.
+"""
+import re
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+from .lemmatizer import lem_pre, lemmatize_many
+
+TOKEN_RE = re.compile(r"\S+")
+# Tags separate tokens, like whitespace
+TOKEN_HTML_RE = re.compile(r"<.*?>|((?:(?!<.*?>)\S)+)")
+CJK_CHARS = "\u3000-\u303f\uff00-\uffef\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+CJK_TOKEN_RE = re.compile(rf"[{CJK_CHARS}]|[^\s{CJK_CHARS}]+")
+CJK_TOKEN_HTML_RE = re.compile(rf"<.*?>|([{CJK_CHARS}]|(?:(?!<.*?>)[^\s{CJK_CHARS}])+)")
+NO_SPACE_LANGUAGES = {"zh", "ja", "yue", "lzh", "wuu"}
+
+
+def token_re(language: str, strip_tags: bool = False) -> re.Pattern:
+    "Pattern matching the tokens of a language, in group 1 if strip_tags"
+    if language in NO_SPACE_LANGUAGES:
+        return CJK_TOKEN_HTML_RE if strip_tags else CJK_TOKEN_RE
+    return TOKEN_HTML_RE if strip_tags else TOKEN_RE
+
+
+class Token(NamedTuple):
+    start: int
+    end: int
+    text: str
+    form: str  # without punctuation and markup
+
+
+def tokenize(text: str, language: str, strip_tags: bool = False) -> Iterator[Token]:
+    """
+    Yield the tokens of a text with their offsets
+    If strip_tags, html tags are skipped and also split words
+    """
+    # Most tokens repeat, normalize each distinct one once
+    forms: dict[str, str] = {}
+    for match in token_re(language, strip_tags).finditer(text):
+        token = match.group(1) if strip_tags else match.group()
+        if token is None:
+            continue  # A tag
+        if (form := forms.get(token)) is None:
+            form = forms[token] = lem_pre(token, language)
+        yield Token(match.start(), match.end(), token, form)
+
+
+def lemmatize_tokens(tokens: Iterable[Token], language: str, greedy: bool = False,
+                     processes: int = 1,
+                     progress: Optional[Callable[[int, int], None]] = None) -> list[str]:
+    "Lemmas of tokens, in the same order. See lemmatize_many"
+    return lemmatize_many([token.form for token in tokens], language, greedy, processes, progress)
@@ -1,16 +1,17 @@
 from functools import lru_cache
 import json
-import urllib.request
 import os
 import re
 import unicodedata
 from itertools import zip_longest, islice
 import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
+from .anki_connect import AnkiConnect, AnkiConnectError, get_client, request
 from .constants import FORVO_HEADERS
 from .vsnt import FIELDS, CARDS, CSS
 from bs4 import BeautifulSoup
-from typing import List, Optional
+from typing import Iterator, List, Optional
 from .local_dictionary import LocalDictionary
 from json.decoder import JSONDecodeError
 try:
@@ -45,23 +46,18 @@ def profile(func):
     return wrapper
 
 
-def request(action, **params):
-    return {'action': action, 'params': params, 'version': 6}
+# Notes per request when getting info about many notes, and requests in flight at a time
+NOTES_INFO_CHUNK_SIZE = 500
+NOTES_INFO_WORKERS = 4
+# Modification times are much smaller than notesInfo
+NOTES_MOD_TIME_CHUNK_SIZE = 5000
+# Notes added and checked per request
+ADD_NOTES_CHUNK_SIZE = 100
+CAN_ADD_NOTES_CHUNK_SIZE = 500
 
 
 def invoke(action, server, **params):
-    requestJson = json.dumps(request(action, **params)).encode('utf-8')
-    with urllib.request.urlopen(urllib.request.Request(server, requestJson)) as response:
-        response = json.load(response)
-    if len(response) != 2:
-        raise Exception('response has an unexpected number of fields')
-    if 'error' not in response:
-        raise Exception('response is missing required error field')
-    if 'result' not in response:
-        raise Exception('response is missing required result field')
-    if response['error'] is not None:
-        raise Exception(response['error'])
-    return response['result']
+    return get_client(server).invoke(action, **params)
 
 
 def getDeckList(server) -> list:
@@ -142,21 +138,89 @@ def addNote(server, content, allow_duplicates=False) -> int:
     return int(result)
 
 
-def addNotes(server, content) -> list[Optional[int]]:
-    # result = invoke('addNotes', server, notes=content)
-    # This now throws if not successful
-    # return list(result)
-    # workaround: just use addNote in a loop, catch exceptions
-    results: list[Optional[int]] = []
-    for note in content:
+def _searchValue(value: str) -> str:
+    "Escape a field value for use inside a quoted Anki search term"
+    return re.sub(r'(["*_\\])', r'\\\1', value)
+
+
+def _findAdded(client: AnkiConnect, notes: list[dict]) -> list[Optional[int]]:
+    """Ids of notes found by their first field, None for those not in the collection
+    Notes with the same first field get the id only once, for the first of them"""
+    models = sorted({note['modelName'] for note in notes})
+    first_fields = {model: fields[0] if isinstance(fields, list) and fields else None
+                    for model, fields in zip(models, client.multi(
+                        [request('modelFieldNames', modelName=model) for model in models]))}
+    queries = [f'"note:{_searchValue(note["modelName"])}" '
+               f'"{_searchValue(first)}:{_searchValue(note["fields"].get(first, ""))}"'
+               if (first := first_fields[note['modelName']]) else None
+               for note in notes]
+    found = iter(client.multi([request('findNotes', query=query) for query in queries if query is not None]))
+    claimed: set[int] = set()
+    note_ids: list[Optional[int]] = []
+    for query in queries:
+        candidates = next(found) if query is not None else None
+        note_id = None
+        if isinstance(candidates, list):
+            # The newest match is the one the request added
+            note_id = max((int(candidate) for candidate in candidates if int(candidate) not in claimed),
+                          default=None)
+        if note_id is not None:
+            claimed.add(note_id)
+        note_ids.append(note_id)
+    return note_ids
+
+
+def _addNotesBisect(client: AnkiConnect, notes: list[dict]) -> list[int | AnkiConnectError]:
+    """Add notes that could all be added when checked in one request, splitting it in halves until
+    the notes that fail are found
+    A request that fails may still have added some of its notes, so the notes are checked again before
+    retrying, and those that cannot be added anymore are looked up by their first field"""
+    if len(notes) == 1:
         try:
-            result = addNote(server, note)
+            return [int(client.invoke('addNote', note=notes[0]))]
+        except AnkiConnectError as e:
+            return [e]
+    try:
+        # Older versions return null for notes that failed, newer ones fail the whole request
+        result = client.invoke('addNotes', notes=notes)
+        return [AnkiConnectError("cannot add note") if note_id is None else int(note_id) for note_id in result]
+    except AnkiConnectError:
+        pass
+    errors = _canAddNotes(client, notes)
+    results: list[int | AnkiConnectError] = [AnkiConnectError(error or "cannot add note") for error in errors]
+    failed = [i for i, error in enumerate(errors) if error is not None]
+    for i, note_id in zip(failed, _findAdded(client, [notes[i] for i in failed])):
+        if note_id is not None:
+            results[i] = note_id
+    addable = [i for i, error in enumerate(errors) if error is None]
+    middle = len(addable) // 2
+    for half in (addable[:middle], addable[middle:]):
+        if half:
+            for i, result in zip(half, _addNotesBisect(client, [notes[i] for i in half])):
+                results[i] = result
+    return results
+
+
+def addNotes(server, content, chunk_size: int = ADD_NOTES_CHUNK_SIZE) -> list[int | AnkiConnectError]:
+    """Add many notes, a chunk of them per request
+    Returns the id of each note, or the error for those that could not be added"""
+    client = get_client(server)
+    results: list[int | AnkiConnectError] = []
+    for i in range(0, len(content), chunk_size):
+        chunk = content[i:i + chunk_size]
+        # Only notes that can be added now are sent, so that any of them that a failed request
+        # still added can be told apart from notes that were already in the collection
+        errors = _canAddNotes(client, chunk)
+        chunk_results: list[int | AnkiConnectError] = [AnkiConnectError(error or "cannot add note")
+                                                        for error in errors]
+        addable = [j for j, error in enumerate(errors) if error is None]
+        if addable:
+            for j, result in zip(addable, _addNotesBisect(client, [chunk[j] for j in addable])):
+                chunk_results[j] = result
+        for note, result in zip(chunk, chunk_results):
+            if isinstance(result, AnkiConnectError):
+                logger.error(f"Error adding note: {note}. Exception: {result}")
             results.append(result)
-        except Exception as e:
-            logger.error(f"Error adding note: {note}. Exception: {e}")
-            # If we want to continue adding notes even if one fails, we can
-            # just append None or some error code here.
-            results.append(None)
     return results
 
 
@@ -165,10 +229,70 @@ def canAddNotes(server, content) -> List[int]:
     return list(result)
 
 
+def _canAddNotes(client: AnkiConnect, notes: list[dict]) -> list[Optional[str]]:
+    "None for each note that can be added, otherwise the reason it cannot"
+    try:
+        details = client.invoke('canAddNotesWithErrorDetail', notes=notes)
+    except AnkiConnectError as e:
+        if "unsupported action" not in str(e):
+            raise
+        # Older versions of AnkiConnect do not give reasons
+        details = [{'canAdd': bool(can_add)} for can_add in client.invoke('canAddNotes', notes=notes)]
+    return [None if detail['canAdd'] else str(detail.get('error', "cannot add note")) for detail in details]
+
+
+def canAddNotesWithErrorDetail(server, content,
+                               chunk_size: int = CAN_ADD_NOTES_CHUNK_SIZE) -> list[Optional[str]]:
+    """Check whether many notes can be added, a chunk of them per request
+    Returns None for each note that can be added, otherwise the reason it cannot"""
+    client = get_client(server)
+    errors: list[Optional[str]] = []
+    for i in range(0, len(content), chunk_size):
+        errors.extend(_canAddNotes(client, content[i:i + chunk_size]))
+    return errors
+
+
 def notesInfo(server, notes):
     return invoke('notesInfo', server, notes=notes)
 
 
+def _inChunks(fetch, server, notes: list[int], chunk_size: int, workers: int) -> Iterator:
+    """Call fetch(server, chunk) on chunks of notes, with several requests in flight at a time
+    Results are yielded as soon as they arrive, not necessarily in order"""
+    with ThreadPoolExecutor(workers) as executor:
+        pending: set[Future] = set()
+        for i in range(0, len(notes), chunk_size):
+            pending.add(executor.submit(fetch, server, notes[i:i + chunk_size]))
+            # Bound the responses waiting to be processed
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def notesInfoChunks(server, notes: list[int],
+                    chunk_size: int = NOTES_INFO_CHUNK_SIZE,
+                    workers: int = NOTES_INFO_WORKERS) -> Iterator[list[dict]]:
+    """Get notesInfo of many notes in chunks, with several requests in flight at a time
+    Chunks are yielded as soon as they arrive, not necessarily in order"""
+    return _inChunks(notesInfo, server, notes, chunk_size, workers)
+
+
+def notesModTime(server, notes: list[int],
+                 chunk_size: int = NOTES_MOD_TIME_CHUNK_SIZE,
+                 workers: int = NOTES_INFO_WORKERS) -> dict[int, int]:
+    "Modification time of each note, requested in chunks like notesInfoChunks"
+    def fetch(server, chunk: list[int]):
+        return invoke('notesModTime', server, notes=chunk)
+    return {item['noteId']: item['mod']
+            for chunk in _inChunks(fetch, server, notes, chunk_size, workers)
+            for item in chunk}
+
+
 def getVersion(server) -> str:
     result = invoke('version', server)
     return str(result)
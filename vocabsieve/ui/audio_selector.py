@@ -41,6 +41,11 @@ class AudioSelector(QListWidget):
             return []
         return self.sg.define(word)
 
+    def getDefinitionsForWords(self, words: list[str]) -> dict[str, list[AudioDefinition]]:
+        if self.sg is None:
+            return {word: [] for word in words}
+        return self.sg.define_many(words)
+
     def lookup_on_thread(self, word: str):
         self.clear()
         for definition in self.getDefinitions(word):
@@ -58,17 +63,12 @@ class AudioSelector(QListWidget):
         self.current_audio_path = ""
 
     def lookup(self, word: str):
-        # check if all sources are online
         if self.sg is not None:
-            all_online = all(not source.INTERNET for source in self.sg.sources)
-            if all_online:
-                # Use threads only if all online because sqlite cursor
-                # can't be accessed from multiple threads
-                threading.Thread(
-                    target=self.lookup_on_thread,
-                    args=(word,)).start()
-            else:
-                self.lookup_on_thread(word)
+            # Local sources are safe to use here too, as every thread
+            # gets its own database connection
+            threading.Thread(
+                target=self.lookup_on_thread,
+                args=(word,)).start()
 
     def play_audio_if_exists(self, x):
         if x is not None:
@@ -58,13 +58,15 @@ class LookupWorker(QObject):
 
     def run(self):
         start = time.time()
-        definitions = self.source.define(self.word, no_lemma=self.no_lemma)
+        # Word rules come before guessing the closest headword, which the user gets to see
+        definitions = self.source.define(self.word, no_lemma=self.no_lemma, fuzzy=not self.rules)
         any_definitions = any(defi.definition is not None for defi in definitions)
         if not any_definitions and self.rules:
             logger.info(f"No definitions found for {self.word} in {self.source.name}, applying word rules")
             definitions = self.source.define(
                 apply_word_rules(self.word, self.rules),
-                no_lemma=self.no_lemma
+                no_lemma=self.no_lemma,
+                fuzzy=True
             )
         self.got_definitions.emit(definitions)
         logger.debug(f"LookupWorker: looked up {self.word} in {self.source.name} in {time.time()-start:.2f} seconds")
@@ -143,23 +145,21 @@ class MultiDefinitionWidget(SearchableTextEdit):
 
     def _lookup_in_source(self, source: DictionarySource, word: str,
                           no_lemma: bool, rules: list[tuple[str, str]]) -> None:
-        if source.INTERNET:
-            lookup_thread = QThread()
-            lookup_worker = LookupWorker(source, word, no_lemma, rules)
-            lookup_worker.moveToThread(lookup_thread)
-            lookup_thread.started.connect(lookup_worker.run)
-            lookup_worker.got_definitions.connect(self.appendDefinition)
-            lookup_worker.finished.connect(lookup_thread.quit)
-            lookup_worker.finished.connect(lookup_worker.deleteLater)
-            lookup_thread.finished.connect(lookup_thread.deleteLater)
-            lookup_thread.start()
-
-            # Keep references to avoid garbage collection, otherwise this crashes
-            self.threads.append(lookup_thread)
-            self.workers.append(lookup_worker)
-
-        else:  # Local source, no thread
-            self.appendDefinition(source.define(word, no_lemma=no_lemma))
+        # Local sources are looked up on threads too, every thread
+        # gets its own database connection
+        lookup_thread = QThread()
+        lookup_worker = LookupWorker(source, word, no_lemma, rules)
+        lookup_worker.moveToThread(lookup_thread)
+        lookup_thread.started.connect(lookup_worker.run)
+        lookup_worker.got_definitions.connect(self.appendDefinition)
+        lookup_worker.finished.connect(lookup_thread.quit)
+        lookup_worker.finished.connect(lookup_worker.deleteLater)
+        lookup_thread.finished.connect(lookup_thread.deleteLater)
+        lookup_thread.start()
+
+        # Keep references to avoid garbage collection, otherwise this crashes
+        self.threads.append(lookup_thread)
+        self.workers.append(lookup_worker)
 
     @pyqtSlot(list)
     def appendDefinition(self, definitions: list[Definition]):
@@ -198,10 +198,26 @@ class MultiDefinitionWidget(SearchableTextEdit):
             logger.debug("Getting definition from source " + source.name)
             for defi in source.define(target):
                 logger.debug("Got definition from source " + defi.source + ": " + str(defi))
-                if defi.definition is not None:
+                if defi.definition is not None and not defi.suggestion:
                     return defi
         return None
 
+    def getFirstDefinitions(self, targets: list[str]) -> dict[str, Optional[Definition]]:
+        """
+        Blocking function to get the first definition for many words from all sources
+        Each source is queried once with all words that are still undefined
+        """
+        results: dict[str, Optional[Definition]] = dict.fromkeys(targets)
+        for source in self.sources:
+            remaining = [target for target, defi in results.items() if defi is None]
+            if not remaining:
+                break
+            logger.debug(f"Getting definitions for {len(remaining)} words from source {source.name}")
+            for target, definitions in source.define_many(remaining).items():
+                results[target] = next((defi for defi in definitions
+                                        if defi.definition is not None and not defi.suggestion), None)
+        return results
+
     def updateIndex(self):
         if not self.definitions:
             return
@@ -219,7 +235,11 @@ class MultiDefinitionWidget(SearchableTextEdit):
                     self.setHtml(defi.definition)
                 case _:
                     self.setText(defi.definition)
-            self.info_label.setText(f"<strong>{defi.headword}</strong> in <em>{defi.source}</em>")
+            if defi.suggestion:
+                self.info_label.setText(f"\"{defi.lookup_term}\" not found, closest match "
+                                        f"<strong>{defi.headword}</strong> in <em>{defi.source}</em>")
+            else:
+                self.info_label.setText(f"<strong>{defi.headword}</strong> in <em>{defi.source}</em>")
             if self.word_widget:
                 self.word_widget.setText(defi.headword)
 
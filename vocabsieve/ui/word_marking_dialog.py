@@ -4,9 +4,9 @@ from PyQt5.QtCore import Qt
 from typing import Optional
 
 
-from ..models import WordActionWeights, WordRecord
+from ..models import WordActionWeights
 from .main_window_base import MainWindowBase
-from ..tools import compute_word_score
+from ..known_data import KnownDataStore
 from ..global_names import settings, logger
 from ..local_dictionary import dictdb
 
@@ -14,9 +14,9 @@ from ..local_dictionary import dictdb
 class TogglableLabel(QLabel):
     def __init__(self, parent: "WordGridWidget"):
         super().__init__()
-        self.known_data: dict[str, WordRecord] = parent.known_data
-        self.waw: WordActionWeights = parent.waw
-        self.cognates: set[str] = parent.cognates
+        self.scores: dict[str, int] = parent.scores
+        self.cognates: frozenset[str] = parent.cognates
+        self.modifiers: dict[str, float] = parent.modifiers
         self.rec = parent.rec  # type: ignore
         self.langcode = settings.value("target_language", "en")
         self.word = ""
@@ -26,13 +26,7 @@ class TogglableLabel(QLabel):
         self.known = False
 
     def setText(self, text: str):
-        self.score = compute_word_score(
-            self.known_data.get(
-                text,
-                WordRecord(
-                    text,
-                    self.langcode)),
-            self.waw)  # type: ignore
+        self.score = self.scores.get(text, 0)
         self.threshold = settings.value(
             "tracking/known_threshold",
             100,
@@ -40,7 +34,7 @@ class TogglableLabel(QLabel):
             "tracking/known_threshold_cognate",
             25,
             type=int)  # type: ignore
-        self.modifier = self.rec.getModifier(self.langcode, text)
+        self.modifier = self.modifiers.get(text, 1.0)
         self.known = False
         stylesheet = "border: 2px solid transparent; border-radius: 5px; padding: 4px;"
         if self.score >= self.threshold * self.modifier:
@@ -80,6 +74,7 @@ class TogglableLabel(QLabel):
             self.modifier = 1.0
             self.rec.setModifier(self.langcode, self.word, self.modifier)
             logger.info(f"Resetting modifier of {self.word} to {self.modifier}")
+        self.modifiers[self.word] = self.modifier
 
         self.setText(self.word)
 
@@ -95,9 +90,12 @@ class WordGridWidget(QWidget):
         self.words: list[str] = words or []
         self.rec = parent.rec
         self.waw: WordActionWeights = parent.waw
-        self.cognates: set[str] = parent.cognates
-        self.known_data: dict[str, WordRecord]
+        self.cognates: frozenset[str] = parent.cognates
+        self.known_data: KnownDataStore
         self.known_data, _ = parent.rec.getKnownData()
+        # Scored all at once, labels only look them up
+        self.scores: dict[str, int] = dict(zip(self.words, self.known_data.scoresOf(self.words, self.waw).tolist()))
+        self.modifiers: dict[str, float] = dict(zip(self.words, self.known_data.modifiersOf(self.words).tolist()))
         self.layout_ = QGridLayout(self)
         self.index_offset_label = QLabel("<b>Rank 0</b>")
         self.layout_.addWidget(self.index_offset_label, 0, 0, 1, COLS - 2)
@@ -145,6 +143,7 @@ class WordGridWidget(QWidget):
     def resetModifiers(self):
         logger.info("Resetting all modifiers to default by user request")
         self.rec.deleteModifiers(settings.value("target_language", "en"))
+        self.modifiers.clear()
         self.update_page()
 
 